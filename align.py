@@ -0,0 +1,77 @@
+"""Align the rows of a text with the rows of its template.
+
+The OCR text of a page should have one row for each template row, but
+the model sometimes drops or adds a line, usually a blank one, which
+shifts every row after it. Each row is reduced to its number of
+characters (non whitespace cells), and the two sequences of counts are
+aligned by dynamic programming, as in aligning two strings: a template
+row and a text row with the same count cost nothing to pair, a pair
+with different counts costs MISMATCH, and leaving a row unpaired costs
+GAP, or BLANK_GAP if the row is blank. Only pairs within a band of the
+diagonal are considered, as a page is only ever shifted a few rows.
+
+Pairing the rows only recovers a page whose text gained or lost blank
+lines. A template row with characters left unpaired still fails the
+merge, as there is no text for it, but the rows around it stay paired.
+"""
+
+
+MISMATCH = 3.0
+GAP = 2.0
+BLANK_GAP = 0.25
+BAND = 8
+
+
+def gap_cost(count):
+    """Return the cost of leaving a row with count characters unpaired."""
+    return BLANK_GAP if count == 0 else GAP
+
+
+def align_rows(template_counts, text_counts, band=BAND):
+    """Return the best alignment of template rows with text rows, given
+    the number of characters in each row, as a list of (template_index,
+    text_index) pairs in order, where an index is None for a row left
+    unpaired."""
+    if template_counts == text_counts:
+        return [(i, i) for i in range(len(template_counts))]
+    num_template, num_text = len(template_counts), len(text_counts)
+    band += abs(num_template - num_text)
+    template_gaps = [gap_cost(count) for count in template_counts]
+    text_gaps = [gap_cost(count) for count in text_counts]
+    inf = float('inf')
+    # cost[i][j] is the cost of aligning the first i template rows with
+    # the first j text rows; move[i][j] is the step that got there
+    cost = [[inf] * (num_text + 1) for _ in range(num_template + 1)]
+    move = [[None] * (num_text + 1) for _ in range(num_template + 1)]
+    cost[0][0] = 0.0
+    for i in range(num_template + 1):
+        for j in range(max(0, i - band), min(num_text, i + band) + 1):
+            if i > 0 and j > 0:
+                pair = cost[i - 1][j - 1] + \
+                    (0.0 if template_counts[i - 1] == text_counts[j - 1]
+                     else MISMATCH)
+                if pair < cost[i][j]:
+                    cost[i][j], move[i][j] = pair, 'pair'
+            if i > 0:
+                skip = cost[i - 1][j] + template_gaps[i - 1]
+                if skip < cost[i][j]:
+                    cost[i][j], move[i][j] = skip, 'template'
+            if j > 0:
+                skip = cost[i][j - 1] + text_gaps[j - 1]
+                if skip < cost[i][j]:
+                    cost[i][j], move[i][j] = skip, 'text'
+    pairs = []
+    i, j = num_template, num_text
+    while i > 0 or j > 0:
+        step = move[i][j]
+        if step == 'pair':
+            i, j = i - 1, j - 1
+            pairs.append((i, j))
+        elif step == 'template':
+            i -= 1
+            pairs.append((i, None))
+        else:
+            j -= 1
+            pairs.append((None, j))
+    pairs.reverse()
+    return pairs
@@ -0,0 +1,243 @@
+"""Run the pipelines of several projects at once, sharing the CPU
+workers and the OCR budget between them.
+
+Each project runs its pipeline in a process of its own, in its own
+directory, so the stage commands find its files as usual. The
+projects share a BatchScheduler kept in a manager process, which
+hands out slots: a pipeline takes a CPU slot before giving a job to
+its pool and hands it back when the job is done, and its OCR engine
+takes an OCR slot, and a request and its estimated tokens from the
+shared per minute limits, before each request. So no more jobs run at
+once than the batch has workers, and the OCR limits hold for the
+requests of all projects together.
+
+When more than one project is waiting for a slot the policy decides
+which gets it. "fair" gives it to the project using the fewest slots
+for its priority, so a project of priority 2 gets twice the slots of
+a project of priority 1. "priority" gives it to the project with the
+highest priority, so lower priorities only get slots it leaves idle.
+
+Pipelines report how many pages have been through each stage to the
+scheduler, which gridlock batch shows for all the projects together.
+"""
+
+
+import asyncio
+import math
+import threading
+import time
+from multiprocessing.managers import BaseManager
+from ocr_engine import TokenBucket
+
+
+RESOURCES = ('cpu', 'ocr')
+POLICIES = ('fair', 'priority')
+
+# A project refused a slot this recently is still waiting for one, so
+# others do not take a slot first unless they have a better claim
+WAIT_WINDOW = 1.0
+
+# How often a project waiting for a slot asks again, in seconds
+POLL_INTERVAL = 0.25
+
+
+class BatchScheduler():
+    """Share CPU slots and the OCR budget between projects."""
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(self, workers, ocr_concurrency, requests_per_minute=0,
+                 tokens_per_minute=0, policy='fair'):
+        self.limits = {'cpu': workers, 'ocr': ocr_concurrency}
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.policy = policy
+        self.projects = {}
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+
+    def add_project(self, name, priority=1, expected_pages=0):
+        """Add a project to share the slots."""
+        with self.lock:
+            self.projects[name] = {
+                "priority": priority, "expected_pages": expected_pages,
+                "in_use": dict.fromkeys(RESOURCES, 0), "waiting": {},
+                "counts": {}, "requests": 0, "tokens": 0,
+                "started": None, "finished": None, "ok": None}
+
+    def claim(self, name, resource):
+        """Return the sort key of a project's claim to a slot of
+        resource, lowest first."""
+        project = self.projects[name]
+        in_use = project["in_use"][resource]
+        if self.policy == 'priority':
+            return (-project["priority"], in_use, name)
+        return (in_use / project["priority"], name)
+
+    def in_use(self, resource):
+        """Return the number of slots of resource taken."""
+        return sum(project["in_use"][resource]
+                   for project in self.projects.values())
+
+    def try_acquire(self, name, resource, estimate=0):
+        """Take a slot of resource for the project if one is free and no
+        waiting project has a better claim to it. An OCR slot also needs
+        a request and estimate tokens of the per minute limits. Return
+        True if the slot was taken."""
+        with self.lock:
+            now = time.monotonic()
+            project = self.projects[name]
+            project["waiting"][resource] = now
+            if self.in_use(resource) >= self.limits[resource]:
+                return False
+            waiting = [other for other, state in self.projects.items()
+                       if now - state["waiting"].get(resource, -math.inf)
+                       < WAIT_WINDOW]
+            if min(waiting, key=lambda other: self.claim(other, resource)) \
+               != name:
+                return False
+            if resource == 'ocr':
+                if not self.requests.available() or \
+                   not self.tokens.available(estimate):
+                    return False
+                self.requests.adjust(1)
+                self.tokens.adjust(estimate)
+            project["in_use"][resource] += 1
+            # It only waits again if it asks for another slot in vain
+            del project["waiting"][resource]
+            return True
+
+    def release(self, name, resource, estimate=0, used=None):
+        """Give back a slot of resource. For an OCR slot used is the
+        tokens the request took, or None if it failed."""
+        with self.lock:
+            project = self.projects[name]
+            project["in_use"][resource] -= 1
+            if resource == 'ocr':
+                project["requests"] += 1
+                self.tokens.adjust((used or 0) - estimate)
+                project["tokens"] += used or 0
+
+    def report(self, name, counts):
+        """Record how many of the project's pages have been through each
+        stage."""
+        with self.lock:
+            project = self.projects[name]
+            if project["started"] is None:
+                project["started"] = time.monotonic()
+            project["counts"] = dict(counts)
+
+    def finish(self, name, ok):
+        """Record that the project's run has ended, giving back any
+        slots it still held if it died."""
+        with self.lock:
+            project = self.projects[name]
+            project["in_use"] = dict.fromkeys(RESOURCES, 0)
+            project["waiting"] = {}
+            project["finished"] = time.monotonic()
+            project["ok"] = ok
+
+    def status(self):
+        """Return the state of the batch and of each project."""
+        with self.lock:
+            now = time.monotonic()
+            projects = {}
+            for name, project in self.projects.items():
+                started = project["started"]
+                elapsed = 0.0 if started is None else \
+                    (project["finished"] or now) - started
+                projects[name] = {
+                    key: project[key] for key in
+                    ("priority", "expected_pages", "counts", "requests",
+                     "tokens", "ok")}
+                projects[name]["in_use"] = dict(project["in_use"])
+                projects[name]["elapsed"] = elapsed
+                projects[name]["finished"] = project["finished"] is not None
+            return {"elapsed": now - self.started, "policy": self.policy,
+                    "limits": dict(self.limits),
+                    "in_use": {resource: self.in_use(resource)
+                               for resource in RESOURCES},
+                    "projects": projects}
+
+
+class BatchManager(BaseManager):
+    """Manager process holding the scheduler of a batch."""
+
+
+BatchManager.register('BatchScheduler', BatchScheduler)
+
+
+class BatchShare():
+    """A project's side of the batch scheduler, used by its pipeline."""
+    def __init__(self, scheduler, name, workers, ocr_concurrency):
+        self.scheduler = scheduler
+        self.name = name
+        self.workers = workers
+        self.ocr_concurrency = ocr_concurrency
+        self.reported = None
+
+    def try_cpu(self):
+        """Take a CPU slot if the project can have one now."""
+        return self.scheduler.try_acquire(self.name, 'cpu')
+
+    def release_cpu(self):
+        """Give back a CPU slot."""
+        self.scheduler.release(self.name, 'cpu')
+
+    def report(self, counts):
+        """Report the project's progress, if it has changed."""
+        if counts != self.reported:
+            self.scheduler.report(self.name, counts)
+            self.reported = counts
+
+    def use_budget(self, engine):
+        """Make the OCR engine's requests come out of the batch's budget
+        instead of the project's own limits."""
+        engine.concurrency = self.ocr_concurrency
+        engine.requests = TokenBucket(0)
+        engine.tokens = TokenBucket(0)
+        engine.budget = self
+
+    async def acquire(self, estimate):
+        """Wait for an OCR slot and estimate tokens."""
+        while not await asyncio.to_thread(self.scheduler.try_acquire,
+                                          self.name, 'ocr', estimate):
+            await asyncio.sleep(POLL_INTERVAL)
+
+    async def release(self, estimate, used):
+        """Give back an OCR slot, with the tokens the request used."""
+        await asyncio.to_thread(self.scheduler.release, self.name, 'ocr',
+                                estimate, used)
+
+
+def format_status(status, stages):
+    """Return the lines of a table of the progress of each project and
+    of the batch."""
+    elapsed = status["elapsed"]
+    in_use = status["in_use"]
+    limits = status["limits"]
+    lines = [f"{elapsed:.0f}s  cpu {in_use['cpu']}/{limits['cpu']}  " +
+             f"ocr {in_use['ocr']}/{limits['ocr']}  " +
+             f"policy {status['policy']}",
+             f"{'project':16} {'pri':>3} " +
+             " ".join(f"{stage[:5]:>5}" for stage in stages) +
+             f" {'pages':>7} {'pg/min':>6} {'tokens':>8}  state"]
+    merged = 0
+    for name, project in status["projects"].items():
+        counts = project["counts"]
+        done = counts.get(stages[-1], 0)
+        merged += done
+        minutes = project["elapsed"] / 60
+        rate = done / minutes if minutes > 0 else 0.0
+        if project["finished"]:
+            state = "done" if project["ok"] else "failed"
+        elif project["elapsed"]:
+            state = "running"
+        else:
+            state = "waiting"
+        lines.append(
+            f"{name[:16]:16} {project['priority']:>3} " +
+            " ".join(f"{counts.get(stage, 0):>5}" for stage in stages) +
+            f" {done:>3}/{project['expected_pages']:<3} {rate:>6.1f}" +
+            f" {project['tokens']:>8}  {state}")
+    rate = merged / (elapsed / 60) if elapsed > 0 else 0.0
+    lines.append(f"total {merged} pages merged, {rate:.1f} pages/min")
+    return lines
@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+
+"""Benchmarks for gridlock.
+
+Run from the source directory with 'python3 bench.py'.
+
+The tutorial benchmark compares the template engines on the ELIZA
+pages. The synthetic benchmark times each step on synthetic line
+printer pages made by synthetic.py, and checks the results against the
+text and grid the pages were made from. The pipeline benchmark runs
+gridlock run on a project of synthetic pages, with OCR answered by the
+fake OCR system from the text each page was made from.
+
+Each run is added to bench_results.jsonl with the settings and the
+version of gridlock, and compared with the last run with the same
+settings, so a change that slows a step down shows up.
+"""
+
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import yaml
+from PIL import Image
+from columns import find_columns
+from grid import numpy_template, pil_template, draw_grid
+from merge import merge
+from metrics import read_metrics, summarise_stages
+from occupancy import Occupancy
+from segment import page_pitch, page_attributes
+from straighten import find_skew
+from synthetic import LAYOUTS, make_page
+
+
+SOURCE_DIR = os.path.dirname(os.path.realpath(__file__))
+TUTORIAL_DIR = os.path.join(SOURCE_DIR, "tutorial")
+
+# The ELIZA pages from the tutorial, with the grid gridlock segment
+# found for them
+TUTORIAL_PAGES = ["ELIZA-000-1st.png", "ELIZA-000-2nd.png"]
+TUTORIAL_ATTRS = {"grid_x_spacing": 15.0, "grid_y_spacing": 25.0,
+                  "x_offset": 3.0, "y_offset": 11.0}
+
+SUITES = ('tutorial', 'synthetic', 'pipeline')
+RESULTS_FILE = "bench_results.jsonl"
+
+# A step is reported as slower or faster than the last run if its time
+# changed by more than this fraction
+CHANGE = 0.1
+
+
+def time_call(func, repeat):
+    """Return the best wall time in seconds of repeat calls to func."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def time_pages(func, pages, repeat):
+    """Return the best wall time in seconds over repeat runs of
+    func(page) for every page, per page."""
+    return time_call(lambda: [func(page) for page in pages],
+                     repeat) / len(pages)
+
+
+def bench_templates(repeat, variance_threshold, results):
+    """Compare the template engines on the tutorial pages."""
+    print(f"Template engines, variance threshold {variance_threshold}, " +
+          f"best of {repeat}")
+    status = True
+    for page in TUTORIAL_PAGES:
+        img = Image.open(os.path.join(TUTORIAL_DIR, page))
+        img.load()
+        pa = TUTORIAL_ATTRS
+        pil = time_call(lambda: pil_template(img, pa, variance_threshold),
+                        repeat)
+        vec = time_call(lambda: numpy_template(img, pa, variance_threshold),
+                        repeat)
+        same = pil_template(img, pa, variance_threshold) == \
+            numpy_template(img, pa, variance_threshold)
+        status = status and same
+        sign = '✔' if same else '✗'
+        print(f"{sign} {page}: pil {pil * 1000:.1f} ms, " +
+              f"numpy {vec * 1000:.1f} ms, speedup {pil / vec:.1f}x")
+        results[f"tutorial.pil.{page}"] = pil
+        results[f"tutorial.numpy.{page}"] = vec
+    return status
+
+
+def show_step(name, seconds, good, total, results):
+    """Print the time per page of a step and how many pages it got
+    right, and save the time in results. Return True if it got them
+    all right."""
+    sign = '✔' if good == total else '✗'
+    print(f"{sign} {name}: {seconds * 1000:.2f} ms a page, " +
+          f"{good} of {total} right")
+    results[f"synthetic.{name}"] = seconds
+    return good == total
+
+
+def show_time(name, seconds, results):
+    """Print the time per page of a step and save it in results."""
+    print(f"  {name}: {seconds * 1000:.2f} ms a page")
+    results[f"synthetic.{name}"] = seconds
+
+
+def trimmed_template(page):
+    """Return the page's template as gridlock templates saves it, less
+    the blank lines above and below, as lines ending in newlines."""
+    template = [line.rstrip() for line in page.template()]
+    while template and not template[0]:
+        template.pop(0)
+    while template and not template[-1]:
+        template.pop()
+    return [line + "\n" for line in template]
+
+
+def text_lines(page):
+    """Return the page's OCR text as lines ending in newlines."""
+    return [line + "\n" for line in page.ocr_text().split("\n")]
+
+
+def merged_right(page, report):
+    """Return True if the merged report is the text of the page in its
+    place on the grid."""
+    column = page.origin[0]
+    expected = [(' ' * column + line).rstrip()
+                for line in page.ocr_text().split("\n")]
+    merged = "".join(report).rstrip("\n").split("\n")
+    return [line.rstrip() for line in merged] == expected
+
+
+def drop_blank_line(lines):
+    """Return lines with the first blank line inside the text removed,
+    as an OCR model sometimes does."""
+    for index, line in enumerate(lines):
+        if not line.strip():
+            return lines[:index] + lines[index + 1:]
+    return lines
+
+
+# pylint: disable=too-many-locals
+def bench_synthetic(args, results):
+    """Time each step on synthetic pages and check what it found."""
+    print(f"\nSynthetic pages: {args.pages} pages of {args.lines} lines " +
+          f"at {args.dpi} dpi, {args.layout} layout, noise {args.noise}, " +
+          f"best of {args.repeat}")
+    seeds = range(args.pages)
+    start = time.perf_counter()
+    pages = [make_page(seed, args.dpi, args.lines, args.layout,
+                       noise=args.noise) for seed in seeds]
+    results["synthetic.render"] = (time.perf_counter() - start) / len(pages)
+    skewed = [make_page(seed, args.dpi, args.lines, args.layout,
+                        skew=args.skew * (1 if seed % 2 else -1),
+                        noise=args.noise) for seed in seeds]
+    threshold = args.threshold
+    status = True
+
+    def template_and_grid(page):
+        template = numpy_template(page.image, page.attrs, threshold)
+        draw_grid(page.image, page.attrs, template, 0.5)
+        return template
+
+    seconds = time_pages(template_and_grid, pages, args.repeat)
+    good = sum(numpy_template(page.image, page.attrs, threshold) ==
+               page.template() for page in pages)
+    status &= show_step("template_grid", seconds, good, len(pages), results)
+
+    def pitch_and_offset(page):
+        array = np.asarray(page.image)
+        pitch = page_pitch(array)
+        if None not in pitch:
+            page_attributes(array, *pitch)
+        return pitch
+
+    seconds = time_pages(pitch_and_offset, pages, args.repeat)
+    good = 0
+    for page in pages:
+        pitch = pitch_and_offset(page)
+        good += None not in pitch and \
+            abs(pitch[0] - page.attrs["grid_x_spacing"]) < 0.1 and \
+            abs(pitch[1] - page.attrs["grid_y_spacing"]) < 0.1
+    status &= show_step("segment", seconds, good, len(pages), results)
+
+    seconds = time_pages(lambda page: find_skew(page.image), skewed,
+                         args.repeat)
+    good = sum(abs(find_skew(page.image) - page.skew) < 0.1
+               for page in skewed)
+    status &= show_step("straighten", seconds, good, len(skewed), results)
+
+    templates = [trimmed_template(page) for page in pages]
+    seconds = time_pages(lambda template: find_columns(template, 1),
+                         templates, args.repeat)
+    show_time("find_columns", seconds, results)
+    occupancies = [Occupancy.from_lines(template) for template in templates]
+    seconds = time_pages(lambda occupancy: find_columns(occupancy, 1),
+                         occupancies, args.repeat)
+    show_time("find_columns_occupancy", seconds, results)
+
+    pairs = [(template, text_lines(page), page)
+             for template, page in zip(templates, pages)]
+    for engine in ('rows', 'align'):
+        seconds = time_pages(
+            lambda pair, engine=engine: merge(pair[0], pair[1], 1,
+                                              engine=engine),
+            pairs, args.repeat)
+        good = sum(merged_right(page, merge(template, text, 1,
+                                            engine=engine)[1])
+                   for template, text, page in pairs)
+        status &= show_step(f"merge_{engine}", seconds, good, len(pages),
+                            results)
+    dropped = [(template, drop_blank_line(text), page)
+               for template, text, page in pairs]
+    seconds = time_pages(
+        lambda pair: merge(pair[0], pair[1], 1, engine='align'),
+        dropped, args.repeat)
+    good = sum(merge(template, text, 1, engine='align')[0]
+               for template, text, _ in dropped)
+    status &= show_step("merge_align_dropped_line", seconds, good,
+                        len(pages), results)
+    return status
+
+
+def make_project(pages, prefix):
+    """Make a gridlock project for the pages in the current directory,
+    with the split page images already in place and OCR answered by the
+    fake OCR system from the text of each page. Return the config."""
+    with open(os.path.join(SOURCE_DIR, "config.yaml"), 'r',
+              encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    width, height = pages[0].image.size
+    config["split"].update({"input": "synthetic.pdf", "prefix": prefix,
+                            "first_page": 1, "last_page": len(pages)})
+    config["crop"].update({"crop_from": [0, 0], "crop_to": [width, height]})
+    config["grid"]["grid_images"] = "none"
+    config["text"].update({"ocr_system": "fake", "fake_text_dir": "truth",
+                           "fake_latency": 0.0, "cache": False})
+    config["jobs"]["metrics"] = True
+    with open("config.yaml", 'w', encoding='utf-8') as f:
+        yaml.safe_dump(config, f)
+    with open(os.path.join(SOURCE_DIR, "prompt.md"), 'r',
+              encoding='utf-8') as f:
+        prompt = f.read()
+    with open("prompt.md", 'w', encoding='utf-8') as f:
+        f.write(prompt)
+    os.mkdir("split")
+    os.mkdir("truth")
+    for index, page in enumerate(pages):
+        page.image.convert('RGB').save(f"split/{prefix}-{index:03d}.png")
+        with open(f"truth/{prefix}-{index:03d}.txt", 'w',
+                  encoding='utf-8') as f:
+            f.write(page.ocr_text() + "\n")
+    return config
+
+
+def bench_pipeline(args, results):
+    """Run every step with gridlock run on a project of synthetic pages,
+    with OCR answered from the text of each page, and show the median
+    time of each step from the metrics of the run."""
+    print(f"\nPipeline: {args.pipeline_pages} pages at {args.dpi} dpi, " +
+          f"{args.layout} layout")
+    try:
+        # pylint: disable=import-outside-toplevel
+        from pipeline import Pipeline
+    except ImportError as e:
+        print(f"✗ skipped, as {e}")
+        return True
+    prefix = "BENCH"
+    pages = [make_page(seed, args.dpi, args.lines, args.layout,
+                       skew=args.skew * (1 if seed % 2 else -1),
+                       noise=args.noise)
+             for seed in range(args.pipeline_pages)]
+    texts = {f"{prefix}-{index:03d}": page.ocr_text()
+             for index, page in enumerate(pages)}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as project:
+        os.chdir(project)
+        try:
+            config = make_project(pages, prefix)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()), \
+                    contextlib.redirect_stderr(io.StringIO()):
+                Pipeline(config).run()
+            seconds = time.perf_counter() - start
+            stages = summarise_stages(read_metrics())
+            good = 0
+            for key, page in zip(sorted(texts), pages):
+                merged_file = f"merged/{key}.txt"
+                if os.path.exists(merged_file):
+                    with open(merged_file, 'r', encoding='utf-8') as f:
+                        report = f.read()
+                    good += [line.strip() for line in report.split("\n")
+                             if line.strip()] == \
+                        [line.strip() for line in page.ocr_text().split("\n")
+                         if line.strip()]
+        finally:
+            os.chdir(cwd)
+    sign = '✔' if good == len(pages) else '✗'
+    print(f"{sign} {seconds:.2f} s, {seconds / len(pages) * 1000:.0f} ms " +
+          f"a page, {good} of {len(pages)} pages merged right")
+    results["pipeline.page"] = seconds / len(pages)
+    for stage, summary in stages.items():
+        print(f"  {stage}: {summary['wall']['p50'] * 1000:.1f} ms a page")
+        results[f"pipeline.{stage}"] = summary['wall']['p50']
+    return good == len(pages)
+
+
+def get_version():
+    """Return the git version of the source, or None if not known."""
+    try:
+        return subprocess.run(
+            ["git", "-C", SOURCE_DIR, "describe", "--always", "--dirty"],
+            check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def read_results(results_file):
+    """Return the runs recorded in results_file."""
+    runs = []
+    try:
+        with open(results_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    runs.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return runs
+
+
+def compare_results(previous, results):
+    """Print how each time changed since the previous run."""
+    print(f"\nCompared with {previous['version']} at " +
+          time.strftime("%Y-%m-%d %H:%M", time.localtime(previous["time"])))
+    for name, seconds in results.items():
+        before = previous["results"].get(name)
+        if not before or not seconds:
+            continue
+        ratio = seconds / before
+        change = "slower" if ratio > 1 + CHANGE else \
+            "faster" if ratio < 1 - CHANGE else "same"
+        print(f"{name}: {before * 1000:.2f} -> {seconds * 1000:.2f} ms, " +
+              f"{ratio:.2f}x {change}")
+
+
+def record_results(results_file, settings, results):
+    """Compare results with the last run with the same settings in
+    results_file, then add them to it."""
+    runs = [run for run in read_results(results_file)
+            if run["settings"] == settings]
+    if runs:
+        compare_results(runs[-1], results)
+    run = {"time": time.time(), "version": get_version(),
+           "settings": settings, "results": results}
+    with open(results_file, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(run) + "\n")
+
+
+def parse_args():
+    """Parse the command line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Run gridlock benchmarks.",
+        usage="bench.py [-n REPEAT] [-t THRESHOLD] [--dpi DPI] " +
+        "[--lines LINES] [--layout LAYOUT] [--skew DEGREES] " +
+        "[--noise FRACTION] [--pages N] [--pipeline-pages N] " +
+        "[-o FILE] [SUITE ...]"
+    )
+
+    parser.add_argument('-n', type=int, default=5, dest='repeat',
+                        help='Number of times to repeat each timing.')
+
+    parser.add_argument('-t', type=int, default=1500, dest='threshold',
+                        help='Variance threshold to use for templates.')
+
+    parser.add_argument('--dpi', type=int, default=300,
+                        help='Resolution of synthetic pages.')
+
+    parser.add_argument('--lines', type=int, default=60,
+                        help='Lines of text on each synthetic page.')
+
+    parser.add_argument('--layout', choices=sorted(LAYOUTS),
+                        default='listing',
+                        help='Column layout of synthetic pages.')
+
+    parser.add_argument('--skew', type=float, default=1.0,
+                        help='Skew in degrees of pages to straighten.')
+
+    parser.add_argument('--noise', type=float, default=0.005,
+                        help='Fraction of pixels of synthetic pages ' +
+                        'changed to a random grey.')
+
+    parser.add_argument('--pages', type=int, default=8,
+                        help='Number of synthetic pages to time each ' +
+                        'step on.')
+
+    parser.add_argument('--pipeline-pages', type=int, default=12,
+                        help='Number of pages in the pipeline project.')
+
+    parser.add_argument('-o', type=str, default=RESULTS_FILE,
+                        dest='results_file',
+                        help='File to add the results to, or "" for ' +
+                        'none.')
+
+    parser.add_argument('suites', nargs='*',
+                        help='Benchmarks to run, by default all of ' +
+                        ", ".join(SUITES) + '.')
+
+    args = parser.parse_args()
+    for suite in args.suites:
+        if suite not in SUITES:
+            parser.error(f"unknown benchmark {suite}")
+    return args
+
+
+def main():
+    """Main entry point"""
+    args = parse_args()
+    suites = args.suites or SUITES
+    results = {}
+    status = True
+    if 'tutorial' in suites:
+        status &= bench_templates(args.repeat, args.threshold, results)
+    if 'synthetic' in suites:
+        status &= bench_synthetic(args, results)
+    if 'pipeline' in suites:
+        status &= bench_pipeline(args, results)
+    if args.results_file:
+        settings = {name: value for name, value in vars(args).items()
+                    if name != 'results_file'}
+        settings["suites"] = list(suites)
+        record_results(args.results_file, settings, results)
+    sys.exit(0 if status else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""Join the merged pages of a document into one file.
+
+Pages are read and written one at a time, in the order of their page
+numbers, to a temporary file that replaces the output when done, so
+the whole document is never held in memory. Pages not merged yet can
+be given a placeholder line instead.
+
+Alongside the text an index is written, as JSON, giving for each page
+its byte offset and length in the file and its first line (counting
+from 1) and number of lines, so a tool can seek straight to a page.
+
+The structured outputs place every character of each page on the page
+image: the template of a page is matched against the template of the
+whole page grid to find which grid cell its top left corner is on, and
+each character of the merged text is given its grid cell and pixel
+box. They are written as JSON or as hOCR.
+"""
+
+
+import html
+import json
+import os
+import numpy as np
+from grid import cell_edges
+from util import temp_name
+
+
+PLACEHOLDER = "[{key} not merged yet]\n"
+
+INDEX_SUFFIX = ".index.json"
+JSON_SUFFIX = ".chars.json"
+HOCR_SUFFIX = ".hocr"
+
+
+def page_number(key):
+    """Return the sort key of a page key, so pages sort by number, eg
+    ABC-9 before ABC-10."""
+    number = key.rsplit('-', 1)[-1]
+    if number.isdigit():
+        return (0, int(number), key)
+    return (1, 0, key)
+
+
+def collect_text(keys, read_page, output_file, placeholder=PLACEHOLDER):
+    """Write the text of each page in keys, in order, to output_file.
+    read_page(key) returns the page's text, or None if it has not been
+    merged, when placeholder is written instead. Return the index of
+    the pages in the file."""
+    index = []
+    offset = 0
+    line = 1
+    temp_file = temp_name(output_file)
+    with open(temp_file, 'wb') as f:
+        for key in keys:
+            text = read_page(key)
+            merged = text is not None
+            if not merged:
+                text = placeholder.format(key=key)
+            elif text and not text.endswith("\n"):
+                text += "\n"
+            data = text.encode('utf-8')
+            f.write(data)
+            lines = text.count("\n")
+            index.append({"key": key, "offset": offset, "length": len(data),
+                          "first_line": line, "lines": lines,
+                          "merged": merged})
+            offset += len(data)
+            line += lines
+    os.replace(temp_file, output_file)
+    return index
+
+
+def write_index(index_file, output_file, index):
+    """Write the index of the pages in output_file."""
+    temp_file = temp_name(index_file)
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump({"file": output_file, "pages": index}, f, indent=1)
+        f.write("\n")
+    os.replace(temp_file, index_file)
+
+
+def read_page_at(output_file, entry):
+    """Return the text of the page with the given index entry."""
+    with open(output_file, 'rb') as f:
+        f.seek(entry["offset"])
+        return f.read(entry["length"]).decode('utf-8')
+
+
+def occupied(lines):
+    """Return a bool array of the cells of lines that are not blank."""
+    width = max((len(line) for line in lines), default=0)
+    return np.array([[char != ' ' for char in line.ljust(width)]
+                     for line in lines], dtype=bool).reshape(len(lines),
+                                                             width)
+
+
+def template_origin(template, raw):
+    """Return the (row, column) of the page grid cell the top left of
+    template is on, where raw is the template of the whole page grid,
+    as the shift that lines up the most character cells of the two."""
+    return cells_origin(occupied([line.rstrip("\n") for line in template]),
+                        occupied(raw))
+
+
+def cells_origin(small, grid):
+    """Return the (row, column) of grid, a bool array of the occupied
+    cells of the page grid, that the top left of the bool array small
+    lines up with best."""
+    if not small.any() or not grid.any():
+        return 0, 0
+    shape = (grid.shape[0] + small.shape[0], grid.shape[1] + small.shape[1])
+    # Cross correlation, with negative shifts wrapped round to the end
+    overlap = np.fft.irfft2(np.fft.rfft2(grid, shape) *
+                            np.conj(np.fft.rfft2(small, shape)), shape)
+    index = np.unravel_index(np.argmax(np.round(overlap)), shape)
+    row, column = int(index[0]), int(index[1])
+    if row > grid.shape[0]:
+        row -= shape[0]
+    if column > grid.shape[1]:
+        column -= shape[1]
+    return row, column
+
+
+def line_layout(line, row, first_column, x_edges, y_edges):
+    """Return the layout of a line of text on grid row row, starting at
+    grid column first_column, or None if none of its characters are on
+    the grid."""
+    chars = []
+    for offset, char in enumerate(line):
+        column = first_column + offset
+        if char == ' ' or not 0 <= column < len(x_edges) - 1:
+            continue
+        chars.append([char, row, column, x_edges[column], y_edges[row],
+                      x_edges[column + 1], y_edges[row + 1]])
+    if not chars:
+        return None
+    return {"row": row, "text": line.rstrip(),
+            "bbox": [min(c[3] for c in chars), chars[0][4],
+                     max(c[5] for c in chars), chars[0][6]],
+            "chars": chars}
+
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+def page_layout(key, text, origin, attrs, size, image_file):
+    """Return a dict of the lines of the page's merged text with the
+    grid cell and pixel box of each character, given the origin of its
+    template in the page grid, the page's grid attributes and the
+    (width, height) of the page image."""
+    x_edges = cell_edges(attrs["x_offset"], attrs["grid_x_spacing"], size[0])
+    y_edges = cell_edges(attrs["y_offset"], attrs["grid_y_spacing"], size[1])
+    lines = []
+    for index, line in enumerate(text.split("\n")):
+        row = origin[0] + index
+        if not line.strip() or not 0 <= row < len(y_edges) - 1:
+            continue
+        layout = line_layout(line, row, origin[1], x_edges, y_edges)
+        if layout is not None:
+            lines.append(layout)
+    return {"key": key, "image": image_file, "width": size[0],
+            "height": size[1], "origin": list(origin), "lines": lines}
+
+
+class StructuredWriter():
+    """Write page layouts one at a time to a JSON or hOCR file."""
+    def __init__(self, output_file, kind, title):
+        self.output_file = output_file
+        self.kind = kind
+        self.pages = 0
+        # pylint: disable=consider-using-with
+        self.f = open(temp_name(output_file), 'w', encoding='utf-8')
+        if kind == 'json':
+            self.f.write(f'{{"document": {json.dumps(title)}, "pages": [\n')
+        else:
+            self.f.write(
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<!DOCTYPE html>\n'
+                '<html xmlns="http://www.w3.org/1999/xhtml">\n<head>\n'
+                f'<title>{html.escape(title)}</title>\n'
+                '<meta http-equiv="Content-Type" '
+                'content="text/html; charset=utf-8"/>\n'
+                '<meta name="ocr-system" content="gridlock"/>\n'
+                '<meta name="ocr-capabilities" '
+                'content="ocr_page ocr_line ocrx_word"/>\n'
+                '</head>\n<body>\n')
+
+    def write(self, layout):
+        """Add one page."""
+        if self.kind == 'json':
+            if self.pages:
+                self.f.write(",\n")
+            self.f.write(json.dumps(layout))
+        else:
+            self.f.write(hocr_page(layout, self.pages))
+        self.pages += 1
+
+    def close(self):
+        """Finish the file and put it in place."""
+        if self.kind == 'json':
+            self.f.write("\n]}\n")
+        else:
+            self.f.write('</body>\n</html>\n')
+        self.f.close()
+        os.replace(temp_name(self.output_file), self.output_file)
+
+
+def bbox(box):
+    """Return an hOCR bbox property."""
+    return "bbox " + " ".join(str(value) for value in box)
+
+
+def hocr_words(chars):
+    """Split the characters of a line into words of characters in
+    adjacent cells."""
+    words = []
+    for char in chars:
+        if words and char[2] == words[-1][-1][2] + 1:
+            words[-1].append(char)
+        else:
+            words.append([char])
+    return words
+
+
+def hocr_page(layout, number):
+    """Return the hOCR of one page layout."""
+    key = html.escape(layout["key"])
+    out = [f'<div class="ocr_page" id="page_{number + 1}" title="image '
+           f'{html.escape(layout["image"])}; '
+           f'{bbox([0, 0, layout["width"], layout["height"]])}; '
+           f'ppageno {number}">\n']
+    for line in layout["lines"]:
+        out.append(f'<span class="ocr_line" id="{key}_line_{line["row"]}" '
+                   f'title="{bbox(line["bbox"])}">')
+        for word in hocr_words(line["chars"]):
+            box = [word[0][3], word[0][4], word[-1][5], word[-1][6]]
+            cells = "; x_bboxes " + " ".join(
+                " ".join(str(value) for value in char[3:]) for char in word)
+            text = html.escape("".join(char[0] for char in word))
+            out.append(f'<span class="ocrx_word" title="{bbox(box)}{cells}">'
+                       f'{text}</span> ')
+        out.append('</span>\n')
+    out.append('</div>\n')
+    return "".join(out)
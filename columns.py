@@ -7,6 +7,10 @@
 """
 
 
+import numpy as np
+from occupancy import Occupancy
+
+
 def is_pole_whitespace(page, index):
     """Is the pole identified by index all whitespace on the page?"""
     for row in page:
@@ -18,59 +22,42 @@ def is_pole_whitespace(page, index):
 
 
 def find_columns(page, margin=2):
-    """See if page can be divided into columns of text. margin is the
-    vertical spacing between columns to look for. Return a list of
-    [col_start, col_end] extents.    """
-    extents = []
-    # Don't process an empty page
-    if len(page) < 1:
-        return extents
-    num_poles = max((len(row) for row in page))
-    # We look for columns separated by margin's worth of whitespace
-    # for example:
-    # 01234567890
-    # a aa  bb  \n
-    #           \n
-    #  aa   b   \n
-    #  a     b  \n
-    # Columns are [0, 5], [5, 9], [9, 11]
-    # Define state machine variables
-    start_col = 0               # start of current column
-    start_text = -1             # start of text in current column
-    end_text = -1               # end of text if current column
-    for pole in range(num_poles):
-        if is_pole_whitespace(page, pole):
-            if start_text < 0:
-                # We are still in whitespace at the start of the column
-                continue
-            # We may be coming to the end of a column
-            if end_text < 0:
-                # Text has just finished, set end, wait for margin
-                end_text = pole
-            if pole - end_text + 1 == margin:
-                # Margin reached, we have a column
-                extents.append([start_col, end_text])
-                start_col = end_text
-                start_text = -1
-                end_text = -1
-        else:
-            if start_text < 0:
-                # In a column, just started text
-                start_text = pole
-            # Reset end_text if we had whitespace but did not make margin
-            end_text = -1
-    # End of line reacged
-    last_pole = num_poles - 1   # excluding new line
-    if start_text == -1:
-        if len(extents) == 0:
-            # We never started any columns
-            return []
-        # All whitespace past the last column. Merge it in
-        extents[-1][1] = last_pole
+    """See if page can be divided into columns of text. page is a list
+    of strings or an Occupancy. margin is the vertical spacing between
+    columns to look for. Return a list of [col_start, col_end] extents."""
+    if not isinstance(page, Occupancy):
+        page = Occupancy.from_lines(page)
+    return column_extents(page.pole_occupied(), margin)
+
+
+def column_extents(occupied, margin=2):
+    """Return the [col_start, col_end] extents of the columns in a page
+    from a bool array that is True for each pole holding a character.
+    Columns are separated by at least margin whitespace poles.
+
+    For example:
+    01234567890
+    a aa  bb  \n
+              \n
+     aa   b   \n
+     a     b  \n
+    Columns are [0, 5], [5, 11]
+
+    A column starts where the last one ended, so takes in the gap
+    before its text, and the last column runs to the last pole before
+    the new line."""
+    text_poles = np.flatnonzero(occupied)
+    if len(text_poles) == 0:
+        return []
+    if margin < 1:
+        starts = []
     else:
-        # Last column
-        extents.append([start_col, last_pole])
-    return extents
+        # A gap of margin or more whitespace poles after text ends a
+        # column at the first pole of the gap
+        gaps = np.diff(text_poles) - 1
+        starts = (text_poles[:-1][gaps >= margin] + 1).tolist()
+    bounds = [0] + starts + [len(occupied) - 1]
+    return [[start, end] for start, end in zip(bounds[:-1], bounds[1:])]
 
 
 def get_column(page, extent):
@@ -0,0 +1,168 @@
+"""Functions to classify the cells of a page grid as character or
+whitespace.
+
+Two engines are provided. The 'pil' engine crops each cell and
+measures it with ImageStat, one cell at a time. The 'numpy' engine
+reads the page once and works out the variance of every cell in a
+single batched pass. Both give the same template for the same
+variance threshold.
+"""
+
+
+import numpy as np
+from PIL import Image, ImageStat
+
+
+TEMPLATE_ENGINES = ('numpy', 'pil')
+
+# Colours used when drawing the grid over a page
+CHAR_FILL = (255, 255, 255)
+WHITESPACE_FILL = (0, 50, 0)
+GRID_LINE = (255, 0, 0)
+FILL_ALPHA = 127
+
+
+def cell_edges(offset, spacing, limit):
+    """Return the pixel edges of the cells along one axis, starting at
+    offset and stepping by spacing while a whole cell fits in limit.
+    This mirrors the float stepping and rounding done when cropping
+    cells, so both engines see exactly the same cells."""
+    edges = []
+    pos = offset
+    while pos < limit:
+        end = pos + spacing
+        if end > limit:
+            break
+        edges.append(pos)
+        pos = end
+    edges.append(pos)
+    # PIL rounds crop boxes to the nearest integer
+    return [int(round(edge)) for edge in edges]
+
+
+def read_page(img):
+    """Return the first band of img as a 2D uint8 array. This is the
+    band ImageStat.var[0] measures, and for the grey pages produced by
+    gridlock straighten it is the grey level."""
+    return np.asarray(img.getchannel(0), dtype=np.uint8)
+
+
+def read_luminance(img):
+    """Return the luminance of img as a 2D uint8 array, for looking at
+    the page rather than measuring its cells. For a grey page it is the
+    same as read_page."""
+    if img.mode != 'L':
+        img = img.convert('L')
+    return np.asarray(img, dtype=np.uint8)
+
+
+def cell_variances(page, pa):
+    """Return a rows x columns array with the pixel variance of each
+    cell of the grid described by the page attributes pa. page is a
+    2D uint8 array as returned by read_page."""
+    max_y, max_x = page.shape
+    y_edges = cell_edges(pa["y_offset"], pa["grid_y_spacing"], max_y)
+    x_edges = cell_edges(pa["x_offset"], pa["grid_x_spacing"], max_x)
+    if len(y_edges) < 2 or len(x_edges) < 2:
+        return np.zeros((len(y_edges) - 1, len(x_edges) - 1))
+    # Cells outside the image read as 0, as with a PIL crop
+    pad_y, pad_x = max(0, -y_edges[0]), max(0, -x_edges[0])
+    if pad_y or pad_x:
+        page = np.pad(page, ((pad_y, 0), (pad_x, 0)))
+    ys = np.array(y_edges) + pad_y
+    xs = np.array(x_edges) + pad_x
+    area = page[ys[0]:ys[-1], xs[0]:xs[-1]]
+    values = area.astype(np.uint32)
+    # Sum rows of pixels into bands of cells, then columns into cells
+    sums = np.add.reduceat(values, ys[:-1] - ys[0], axis=0, dtype=np.int64)
+    sums = np.add.reduceat(sums, xs[:-1] - xs[0], axis=1)
+    values *= values
+    sums2 = np.add.reduceat(values, ys[:-1] - ys[0], axis=0, dtype=np.int64)
+    sums2 = np.add.reduceat(sums2, xs[:-1] - xs[0], axis=1)
+    count = np.outer(np.diff(ys), np.diff(xs)).astype(np.float64)
+    # Same order of operations as ImageStat so results agree exactly
+    sums = sums.astype(np.float64)
+    return (sums2.astype(np.float64) - sums ** 2.0 / count) / count
+
+
+def template_from_variances(variances, variance_threshold):
+    """Turn a matrix of cell variances into a list of template lines."""
+    chars = np.where(variances > variance_threshold, '#', ' ')
+    return [''.join(row) for row in chars]
+
+
+def numpy_template(img, pa, variance_threshold):
+    """Make a template using the batched numpy engine."""
+    variances = cell_variances(read_page(img), pa)
+    return template_from_variances(variances, variance_threshold)
+
+
+def pil_template(img, pa, variance_threshold):
+    """Make a template by cropping and measuring each cell in turn."""
+    char_width = pa["grid_x_spacing"]
+    char_height = pa["grid_y_spacing"]
+    max_x, max_y = img.size
+    x, y = pa["x_offset"], pa["y_offset"]
+    template = []
+
+    while y < max_y:
+        template_line = ""
+        yy = y + char_height
+        if yy > max_y:
+            break
+        while x < max_x:
+            xx = x + char_width
+            if xx > max_x:
+                break
+            tile = img.crop((x, y, xx, yy))
+            var = ImageStat.Stat(tile).var[0]
+            if var > variance_threshold:
+                template_line += '#'
+            else:
+                template_line += ' '
+            x = xx
+        y = yy
+        x = pa["x_offset"]
+        template.append(template_line)
+    return template
+
+
+def draw_grid(img, pa, template, scale=1.0):
+    """Return an RGB copy of img scaled by scale, with the grid of
+    template drawn over it in a single pass. Character cells are
+    tinted white, whitespace cells green, and each cell has a red line
+    on its top and left edges."""
+    y_edges = cell_edges(pa["y_offset"], pa["grid_y_spacing"], img.height)
+    x_edges = cell_edges(pa["x_offset"], pa["grid_x_spacing"], img.width)
+    if scale != 1.0:
+        size = (max(1, round(img.width * scale)),
+                max(1, round(img.height * scale)))
+        img = img.resize(size, Image.Resampling.BILINEAR)
+    img = img.convert('RGB')
+    max_x, max_y = img.size
+    rows = min(len(template), len(y_edges) - 1)
+    cols = min(max((len(line) for line in template), default=0),
+               len(x_edges) - 1)
+    if rows < 1 or cols < 1:
+        return img
+    ys = np.clip(np.round(np.array(y_edges[:rows + 1]) * scale), 0, max_y)
+    xs = np.clip(np.round(np.array(x_edges[:cols + 1]) * scale), 0, max_x)
+    ys, xs = ys.astype(int), xs.astype(int)
+
+    cells = np.array([list(line[:cols].ljust(cols))
+                      for line in template[:rows]])
+    is_char = cells == '#'
+    # Expand the cell matrix to one entry per pixel
+    mask = np.repeat(np.repeat(is_char, np.diff(ys), axis=0),
+                     np.diff(xs), axis=1)
+    fill = np.where(mask[..., np.newaxis],
+                    np.array(CHAR_FILL, dtype=np.uint16),
+                    np.array(WHITESPACE_FILL, dtype=np.uint16))
+    page = np.array(img)
+    area = page[ys[0]:ys[-1], xs[0]:xs[-1]].astype(np.uint16)
+    area = (area * (255 - FILL_ALPHA) + fill * FILL_ALPHA + 127) // 255
+    area = area.astype(np.uint8)
+    area[ys[:-1] - ys[0], :] = GRID_LINE
+    area[:, xs[:-1] - xs[0]] = GRID_LINE
+    page[ys[0]:ys[-1], xs[0]:xs[-1]] = area
+    return Image.fromarray(page)
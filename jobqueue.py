@@ -0,0 +1,323 @@
+"""A queue of page jobs kept in the project directory, so that worker
+processes on any host that mounts the project can share the work of a
+stage, with no server to run.
+
+Each job is a small JSON file naming the command, function and page to
+run. It moves between the directories of queue/ by being renamed, as
+a rename is atomic, even on network file systems, and only one of
+several workers renaming the same file can succeed:
+
+    pending/  jobs waiting for a worker
+    claimed/  jobs being run, with the worker's name added to the file
+              name
+    done/     jobs finished, with whether the page succeeded
+
+A worker holds a lease on each job it claims, which it renews by
+touching the claimed file every quarter of the lease while the job
+runs. A claimed file not touched for a whole lease belongs to a worker
+that has died or lost the file system, so any worker moves it back to
+pending/ for another to run. A page that has been claimed MAX_ATTEMPTS
+times without finishing counts as failed, rather than taking down
+every worker in turn. Stage outputs are written to a temporary file
+and renamed into place, so a page run twice, or a worker dying part
+way through, never leaves a partly written output.
+
+Workers compare the time of their own clock with the times of files
+on the shared file system, so the clocks of the hosts must agree to
+well within a lease.
+"""
+
+
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+from util import SOURCE_DIR, read_config, get_config_default
+from util import get_num_workers, run_page, show_progress, temp_name
+
+
+QUEUE_DIR = "queue"
+PENDING = "pending"
+CLAIMED = "claimed"
+DONE = "done"
+
+# Claims of a job before it is failed
+MAX_ATTEMPTS = 3
+
+# How often an idle worker looks for jobs, in seconds
+POLL_INTERVAL = 1.0
+
+
+def worker_name():
+    """Return the name of this worker process, unique across hosts."""
+    return f"{socket.gethostname()}.{os.getpid()}"
+
+
+def get_lease():
+    """Return the number of seconds a worker's claim on a job lasts
+    without a heartbeat."""
+    return get_config_default(read_config(), "jobs", "lease", 60)
+
+
+def job_name(stage, key):
+    """Return the file name of the job running stage for a page."""
+    return f"{stage}.{key}.json"
+
+
+def write_json(path, data):
+    """Write data to path as JSON, atomically."""
+    temp_path = temp_name(path)
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+def read_json_file(path):
+    """Return the data in the JSON file at path, or None if it has
+    gone or is not complete."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+class Job():
+    """A job claimed by a worker."""
+    def __init__(self, name, path, spec):
+        self.name = name
+        self.path = path
+        self.spec = spec
+
+
+class JobQueue():
+    """The work queue of a project."""
+    def __init__(self, queue_dir=QUEUE_DIR, lease=60.0):
+        self.queue_dir = queue_dir
+        self.lease = lease
+        for state in (PENDING, CLAIMED, DONE):
+            os.makedirs(os.path.join(queue_dir, state), exist_ok=True)
+
+    def path(self, state, name):
+        """Return the path of a job's file in state."""
+        return os.path.join(self.queue_dir, state, name)
+
+    def names(self, state):
+        """Return the file names of the jobs in state."""
+        names = os.listdir(os.path.join(self.queue_dir, state))
+        # Skip files still being written
+        return sorted(name for name in names
+                      if ".json" in name and ".tmp" not in name)
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def submit(self, stage, module_file, function_name, keys, page_args):
+        """Add a job calling function_name(key, *page_args) of the
+        command in module_file for each key. Return the job names."""
+        module = os.path.relpath(module_file, SOURCE_DIR) \
+            if module_file.startswith(SOURCE_DIR + os.sep) else module_file
+        running = {name.rsplit('@', 1)[0] for name in self.names(CLAIMED)}
+        names = []
+        for key in keys:
+            name = job_name(stage, key)
+            names.append(name)
+            try:
+                os.remove(self.path(DONE, name))
+            except FileNotFoundError:
+                pass
+            if name not in running:
+                write_json(self.path(PENDING, name),
+                           {"stage": stage, "module": module,
+                            "function": function_name, "key": key,
+                            "args": list(page_args), "attempts": 0})
+        return names
+
+    def claim(self, worker):
+        """Claim the first pending job for worker. Return the Job, or
+        None if no job is pending."""
+        for name in self.names(PENDING):
+            pending = self.path(PENDING, name)
+            claimed = self.path(CLAIMED, f"{name}@{worker}")
+            try:
+                # A rename keeps the time of the file, which starts the
+                # lease
+                os.utime(pending)
+                os.rename(pending, claimed)
+            except FileNotFoundError:
+                continue
+            spec = read_json_file(claimed)
+            if spec is None or os.path.exists(self.path(DONE, name)):
+                # Finished by a worker that had lost its lease
+                self.remove(claimed)
+                continue
+            spec["attempts"] += 1
+            job = Job(name, claimed, spec)
+            if spec["attempts"] > MAX_ATTEMPTS:
+                self.finish(job, False, 0.0,
+                            f"worker lost {MAX_ATTEMPTS} times")
+                continue
+            write_json(claimed, spec)
+            return job
+        return None
+
+    def heartbeat(self, job):
+        """Renew the lease on a job. Return False if it has been lost."""
+        try:
+            os.utime(job.path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def finish(self, job, ok, wall, error=None):
+        """Record the result of a job and drop the claim on it."""
+        result = dict(job.spec, ok=ok, wall=round(wall, 3),
+                      worker=job.path.rsplit('@', 1)[1])
+        if error is not None:
+            result["error"] = error
+        write_json(self.path(DONE, job.name), result)
+        self.remove(job.path)
+
+    def release(self, job):
+        """Give a job back without running it."""
+        try:
+            os.rename(job.path, self.path(PENDING, job.name))
+        except FileNotFoundError:
+            pass
+
+    def reclaim(self):
+        """Move jobs whose lease has run out back to pending. Return
+        the number moved."""
+        moved = 0
+        now = time.time()
+        for name in self.names(CLAIMED):
+            claimed = self.path(CLAIMED, name)
+            try:
+                if now - os.path.getmtime(claimed) < self.lease:
+                    continue
+                os.rename(claimed,
+                          self.path(PENDING, name.rsplit('@', 1)[0]))
+                moved += 1
+            except FileNotFoundError:
+                continue
+        return moved
+
+    def idle(self):
+        """Return True if no job is pending or being run."""
+        return not self.names(PENDING) and not self.names(CLAIMED)
+
+    def results(self, names):
+        """Return a dict of the results of the jobs in names that have
+        finished."""
+        finished = set(self.names(DONE)) & set(names)
+        results = {}
+        for name in finished:
+            result = read_json_file(self.path(DONE, name))
+            if result is not None:
+                results[name] = result
+        return results
+
+    def remove_results(self, names):
+        """Delete the results of the jobs in names."""
+        for name in names:
+            self.remove(self.path(DONE, name))
+
+    @staticmethod
+    def remove(path):
+        """Delete a job file if it is still there."""
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def keep_lease(queue, job, finished):
+    """Touch the job's claim until finished is set."""
+    while not finished.wait(queue.lease / 4):
+        if not queue.heartbeat(job):
+            print(f"Lost the lease on {job.name}", file=sys.stderr)
+            return
+
+
+def run_job(queue, job):
+    """Run a claimed job, keeping its lease while it runs."""
+    spec = job.spec
+    finished = threading.Event()
+    threading.Thread(target=keep_lease, args=(queue, job, finished),
+                     daemon=True).start()
+    start_time = time.time()
+    try:
+        _, ok = run_page(os.path.join(SOURCE_DIR, spec["module"]),
+                         spec["function"], spec["key"], spec["args"])
+    except KeyboardInterrupt:
+        finished.set()
+        queue.release(job)
+        raise
+    finished.set()
+    queue.finish(job, ok, time.time() - start_time)
+
+
+def work(queue, stop=None, exit_when_idle=False):
+    """Run jobs from the queue until stop is set or, if exit_when_idle
+    is set, until no job is pending or being run."""
+    worker = worker_name()
+    try:
+        while stop is None or not stop.is_set():
+            job = queue.claim(worker)
+            if job is not None:
+                run_job(queue, job)
+                continue
+            queue.reclaim()
+            if exit_when_idle and queue.idle():
+                return
+            if stop is None:
+                time.sleep(POLL_INTERVAL)
+            else:
+                stop.wait(POLL_INTERVAL)
+    except KeyboardInterrupt:
+        pass
+
+
+def start_workers(queue, count, stop=None, exit_when_idle=False):
+    """Start count worker processes on the queue. Return them."""
+    workers = [multiprocessing.Process(target=work,
+                                       args=(queue, stop, exit_when_idle))
+               for _ in range(count)]
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+def queue_task(keys, page_function, page_args=()):
+    """Call page_function(key, *page_args) for each key through the
+    project's work queue, in worker processes on this host and in any
+    gridlock worker on other hosts, showing progress on stderr. Return
+    the number of pages that failed."""
+    module_file = sys.modules[page_function.__module__].__file__
+    stage = os.path.basename(module_file).replace("gridlock_", "")
+    queue = JobQueue(lease=get_lease())
+    names = queue.submit(stage, module_file, page_function.__name__, keys,
+                         page_args)
+    stop = multiprocessing.Event()
+    workers = start_workers(queue, get_num_workers(), stop)
+    start_time = time.time()
+    results = {}
+    try:
+        while len(results) < len(names):
+            new = queue.results([name for name in names
+                                 if name not in results])
+            for name, result in sorted(new.items()):
+                results[name] = result
+                show_progress(len(results), len(names), start_time,
+                              result["key"])
+            if not new:
+                queue.reclaim()
+                time.sleep(POLL_INTERVAL / 4)
+    finally:
+        stop.set()
+        for worker in workers:
+            worker.join()
+    print(file=sys.stderr)
+    queue.remove_results(names)
+    return sum(1 for result in results.values() if not result["ok"])
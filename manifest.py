@@ -0,0 +1,307 @@
+"""Track what each output was made from, so only stale outputs are made
+again.
+
+For each page and stage the manifest records a hash of the stage's
+inputs - the files it reads, the config settings it uses and, where it
+matters, the page's grid - and a hash of the output it wrote. When a
+command runs again an output is:
+
+* current if its inputs hash is unchanged, so it is skipped
+* stale if its inputs have changed, so it is made again
+* edited if it no longer matches what gridlock wrote, ie it has been
+  changed by hand, so it is kept even if stale
+
+Outputs that have no entry yet, eg from a project started before the
+manifest existed, are taken as current and recorded. The split,
+segment and collect stages work on the whole document, and are
+recorded under the project prefix instead of a page key. Pages cropped
+and straightened in one step by gridlock crop --straighten are recorded
+as the fused stage.
+
+File hashes are cached against each file's size and modification time
+so unchanged files are not read again. If the project keeps its
+artifacts in the artifact store, the manifest is kept in the store's
+file too, and outputs in the store are hashed from there.
+"""
+
+
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from util import SPLIT_DIR, CROPPED_DIR, PAGES_DIR, TEMPLATES_DIR, TEXT_DIR
+from util import MERGED_DIR, PROMPT_FILE, read_config, get_config
+from util import get_config_default, get_attrs_file_name
+from util import read_cached, read_json, stored_name, read_output
+from util import output_exists, delete_output, list_keys, store_enabled
+from ocr_image import uses_grid
+from store import STORE_FILE
+
+
+MANIFEST_FILE = "manifest.sqlite"
+
+CURRENT = "current"
+STALE = "stale"
+EDITED = "edited"
+MISSING = "missing"
+
+# The file each stage writes, from the page key or, for whole document
+# stages, the prefix
+STAGE_OUTPUTS = {
+    'crop': f"{CROPPED_DIR}/{{}}.png",
+    'straighten': f"{PAGES_DIR}/{{}}.png",
+    'fused': f"{PAGES_DIR}/{{}}.png",
+    'segment': "{}.json",
+    'templates': f"{TEMPLATES_DIR}/{{}}.txt",
+    'text': f"{TEXT_DIR}/{{}}.txt",
+    'merge': f"{MERGED_DIR}/{{}}.txt",
+    'collect': "{}.txt",
+}
+
+# The files each page stage reads
+STAGE_INPUTS = {
+    'crop': [f"{SPLIT_DIR}/{{}}.png"],
+    'straighten': [f"{CROPPED_DIR}/{{}}.png"],
+    'fused': [f"{SPLIT_DIR}/{{}}.png"],
+    'templates': [f"{PAGES_DIR}/{{}}.png"],
+    'text': [f"{PAGES_DIR}/{{}}.png", PROMPT_FILE],
+    'merge': [f"{TEMPLATES_DIR}/{{}}.txt", f"{TEXT_DIR}/{{}}.txt"],
+}
+
+# The config settings each stage uses, as (section, key), where a key
+# of None means the whole section
+STAGE_CONFIG = {
+    'split': [('split', 'first_page'), ('split', 'last_page')],
+    'crop': [('crop', None)],
+    'straighten': [('straighten', None)],
+    'fused': [('crop', None), ('straighten', None)],
+    'segment': [('segment', None)],
+    'templates': [('grid', 'variance_threshold'),
+                  ('grid', 'template_engine'), ('template', None)],
+    'text': [('text', 'ocr_system'), ('text', 'gemini_model'),
+             ('text', 'ocr_strategy'), ('text', 'strip_rows'),
+             ('text', 'image_mode'), ('text', 'pixels_per_char'),
+             ('text', 'trim_margins')],
+    'merge': [('merge', 'engine')],
+    'collect': [],
+}
+
+
+def hash_file(path):
+    """Return the SHA-256 digest of the file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def stage_input_files(stage, key, config):
+    """Return the files the stage reads for the page or document key."""
+    if stage == 'split':
+        return [get_config(config, "split", "input")]
+    if stage == 'segment':
+        # Only the pages already segmented, so that segmenting pages as
+        # they arrive does not make the earlier ones stale
+        attrs_file = get_attrs_file_name(key)
+        if os.path.exists(attrs_file):
+            return [f"{PAGES_DIR}/{page_key}.png" for page_key in
+                    sorted(read_cached(attrs_file, read_json))]
+        return sorted(glob.glob(f"{PAGES_DIR}/{key}-*.png"))
+    if stage == 'collect':
+        return [f"{MERGED_DIR}/{page_key}.txt"
+                for page_key in list_keys(MERGED_DIR, key, "txt")]
+    return [pattern.format(key) for pattern in STAGE_INPUTS[stage]]
+
+
+def uses_page_attrs(stage, config):
+    """Return True if the stage reads the page's grid from PREFIX.json."""
+    return stage == 'templates' or \
+        (stage == 'text' and
+         (get_config_default(config, "text", "ocr_strategy", "page") ==
+          'strips' or uses_grid(config)))
+
+
+class Manifest():
+    """The manifest of a project, stored in an SQLite file."""
+    def __init__(self, file_name=MANIFEST_FILE):
+        self.db = sqlite3.connect(file_name, timeout=60)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS outputs ("
+                            "stage TEXT, key TEXT, inputs TEXT, "
+                            "output TEXT, PRIMARY KEY (stage, key))")
+            self.db.execute("CREATE TABLE IF NOT EXISTS hashes ("
+                            "path TEXT PRIMARY KEY, size INTEGER, "
+                            "mtime INTEGER, digest TEXT)")
+
+    def file_digest(self, path):
+        """Return the hash of the file at path, or None if it does not
+        exist, reading the file only if it changed since last hashed."""
+        if stored_name(path) is not None:
+            text = read_output(path)
+            if text is None:
+                return None
+            return hashlib.sha256(text.encode('utf-8')).hexdigest()
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        row = self.db.execute("SELECT size, mtime, digest FROM hashes "
+                              "WHERE path = ?", (path,)).fetchone()
+        if row is not None and row[:2] == (stat.st_size, stat.st_mtime_ns):
+            return row[2]
+        digest = hash_file(path)
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO hashes "
+                            "VALUES (?, ?, ?, ?)",
+                            (path, stat.st_size, stat.st_mtime_ns, digest))
+        return digest
+
+    def input_digest(self, stage, key, config):
+        """Return a hash of everything the stage reads for key."""
+        parts = {}
+        for path in stage_input_files(stage, key, config):
+            parts[path] = self.file_digest(path)
+        for section, name in STAGE_CONFIG[stage]:
+            if name is None:
+                value = config.get(section)
+            else:
+                value = get_config_default(config, section, name, None)
+            parts[f"{section}.{name or '*'}"] = value
+        attrs_file = get_attrs_file_name(key.split('-')[0])
+        if uses_page_attrs(stage, config) and os.path.exists(attrs_file):
+            attrs = dict(read_cached(attrs_file, read_json).get(key, {}))
+            attrs.pop("page_file", None)
+            parts["attrs"] = attrs
+        text = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def output_digest(self, stage, key):
+        """Return the hash of the stage's output for key, or None if it
+        has no single output file or the output does not exist."""
+        if stage not in STAGE_OUTPUTS:
+            return None
+        return self.file_digest(STAGE_OUTPUTS[stage].format(key))
+
+    def record(self, stage, key, config):
+        """Record that the stage's output for key was made from its
+        current inputs."""
+        inputs = self.input_digest(stage, key, config)
+        output = self.output_digest(stage, key)
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO outputs "
+                            "VALUES (?, ?, ?, ?)",
+                            (stage, key, inputs, output))
+
+    def inputs_changed(self, stage, key, config):
+        """Return True if the stage's inputs for key have changed since
+        its output was recorded."""
+        row = self.db.execute("SELECT inputs FROM outputs "
+                              "WHERE stage = ? AND key = ?",
+                              (stage, key)).fetchone()
+        return row is None or row[0] != self.input_digest(stage, key, config)
+
+    def forget(self, stage, key):
+        """Remove the entry for the stage's output for key."""
+        with self.db:
+            self.db.execute("DELETE FROM outputs WHERE stage = ? AND key = ?",
+                            (stage, key))
+
+    def status(self, stage, key, config):
+        """Return whether the stage's output for key is CURRENT, STALE,
+        EDITED or MISSING. An existing output with no entry is recorded
+        and taken as current."""
+        if stage in STAGE_OUTPUTS and \
+           not output_exists(STAGE_OUTPUTS[stage].format(key)):
+            return MISSING
+        row = self.db.execute("SELECT inputs, output FROM outputs "
+                              "WHERE stage = ? AND key = ?",
+                              (stage, key)).fetchone()
+        if row is None:
+            self.record(stage, key, config)
+            return CURRENT
+        if row[1] != self.output_digest(stage, key):
+            return EDITED
+        if self.inputs_changed(stage, key, config):
+            return STALE
+        return CURRENT
+
+    def close(self):
+        """Close the manifest file."""
+        self.db.close()
+
+
+# One manifest per project, process and thread, as SQLite connections
+# cannot be shared with forked pool workers or other threads
+_manifest = {}
+
+
+def get_manifest():
+    """Return the manifest of the project in the current directory."""
+    owner = (os.getcwd(), os.getpid(), threading.get_ident())
+    if owner not in _manifest:
+        _manifest[owner] = Manifest(STORE_FILE if store_enabled()
+                                    else MANIFEST_FILE)
+    return _manifest[owner]
+
+
+def needs_build(stage, key, force=False):
+    """Return True if the stage's output for key is missing, stale or
+    forced. A stale output is deleted so it is made again. An output
+    edited by hand is kept, and reported if its inputs have changed."""
+    if force:
+        return True
+    manifest = get_manifest()
+    config = read_config()
+    status = manifest.status(stage, key, config)
+    if status == STALE:
+        if stage in STAGE_OUTPUTS:
+            delete_output(STAGE_OUTPUTS[stage].format(key))
+        manifest.forget(stage, key)
+        return True
+    if status == EDITED and manifest.inputs_changed(stage, key, config):
+        print(f"Keeping {STAGE_OUTPUTS[stage].format(key)} as it was "
+              "edited by hand; use -f to make it again")
+    if status == MISSING:
+        manifest.forget(stage, key)
+        return True
+    return False
+
+
+def record_output(stage, key):
+    """Record that the stage has just made its output for key."""
+    get_manifest().record(stage, key, read_config())
+
+
+def output_keys(stage, prefix):
+    """Return the keys of the pages that have output from the stage."""
+    directory, name = os.path.split(STAGE_OUTPUTS[stage])
+    return list_keys(directory, prefix, os.path.splitext(name)[1][1:])
+
+
+def remove_stale(stage, prefix, force=False):
+    """Delete the stage's outputs for pages whose inputs have changed,
+    so the stage makes them again. If force is set, forget all of the
+    stage's outputs, as they are all about to be made again."""
+    keys = output_keys(stage, prefix)
+    if force:
+        for key in keys:
+            get_manifest().forget(stage, key)
+        return
+    stale = [key for key in keys if needs_build(stage, key)]
+    if stale:
+        print(f"Making {stage} output again for {len(stale)} changed pages")
+
+
+def record_new(stage, prefix):
+    """Record the stage's outputs that are not in the manifest yet, ie
+    those it has just made."""
+    manifest = get_manifest()
+    config = read_config()
+    recorded = {row[0] for row in manifest.db.execute(
+        "SELECT key FROM outputs WHERE stage = ?", (stage,))}
+    for key in output_keys(stage, prefix):
+        if key not in recorded:
+            manifest.record(stage, key, config)
@@ -1,25 +1,36 @@
 """Functions to merge text and templates."""
 
 
+import os
 import sys
 from abc import ABC
+import numpy as np
+from align import align_rows
 from columns import find_columns, get_column, paste_columns
+from occupancy import Occupancy, load_occupancy, WHITESPACE, LAST_CODE
+from metrics import measure
+from util import write_output, write_outputs, output_source, get_file_key
+
+
+MERGE_ENGINES = ('align', 'rows')
 
 
 class MergedLine():
     """Holds a single line of template and text. If they are mergable,
     status is set to True and merged contains the results, else error
     gives a diagnostic."""
-    def __init__(self, template, text):
-        """Create the object from a text string and a template string."""
+    def __init__(self, template, text, merged=None):
+        """Create the object from a text string and a template string,
+        or record merged as their merge if already done."""
         self.template = template
         self.text = text
         self.template_nonws = self.template.replace(' ', '')
         self.text_nonws = self.text.replace(' ', '')
-        self.status = False
-        self.merged = ""
+        self.status = merged is not None
+        self.merged = merged or ""
         self.error = ""
-        self.merge()
+        if merged is None:
+            self.merge()
 
     def merge(self):
         """If the two lines are merge-able (they have the same number
@@ -38,15 +49,10 @@ class MergedLine():
 
     def merge_line(self):
         """Merge two lines with same number of characters together."""
-        line = ""
-        text_index = 0
-        for template_char in self.template:
-            if template_char.isspace():
-                line += template_char
-            else:
-                line += self.text_nonws[text_index]
-                text_index += 1
-        return line
+        text_chars = iter(self.text_nonws)
+        return "".join([template_char if template_char.isspace()
+                        else next(text_chars)
+                        for template_char in self.template])
 
 
 class MergedPage(ABC):
@@ -55,6 +61,11 @@ class MergedPage(ABC):
         """Common base class init function."""
         self.text = MergedPage.load(text)
         self.template = MergedPage.load(template)
+        self.unaligned = 0
+        # Templates made by gridlock templates have a saved occupancy
+        self.template_occupancy = None
+        if not isinstance(template, list):
+            self.template_occupancy = load_occupancy(template, self.template)
         self.merged_rows = []
         self.status = False
 
@@ -115,6 +126,76 @@ class MergedPageRows(MergedPage):
         return status
 
 
+class MergedPageAligned(MergedPage):
+    """Treat the page as a collection of rows, pairing template and text
+    rows by aligning their character counts, so a line dropped or added
+    in the text only affects that line."""
+    def __init__(self, template, text):
+        super().__init__(template, text)
+        self.status = self.merge_aligned()
+
+    def merge_aligned(self):
+        """Merge each pair of aligned rows. A template row with no text
+        is kept if blank, else fails; a text row with no template row is
+        dropped if blank, else fails and is counted in unaligned, as it
+        may be a line the model made up, and keeping it would put the
+        following merged rows out of line with the template."""
+        template_occupancy = self.template_occupancy or \
+            Occupancy.from_lines(self.template)
+        template_counts = template_occupancy.row_counts.tolist()
+        text_counts = Occupancy.from_lines(self.text).row_counts.tolist()
+        pairs = align_rows(template_counts, text_counts)
+        matched = [(template_index, text_index)
+                   for template_index, text_index in pairs
+                   if template_index is not None and text_index is not None
+                   and template_counts[template_index] ==
+                   text_counts[text_index]]
+        joined = iter(join_rows([self.template[i] for i, _ in matched],
+                                [self.text[j] for _, j in matched]))
+        status = True
+        for template_index, text_index in pairs:
+            if text_index is None:
+                template_line = self.template[template_index]
+                merged = MergedLine(template_line,
+                                    '\n' if template_line.isspace() else '')
+            elif template_index is None:
+                text_line = self.text[text_index]
+                if text_line.isspace():
+                    continue
+                self.unaligned += 1
+                merged = MergedLine('', text_line)
+            elif template_counts[template_index] == text_counts[text_index]:
+                merged = MergedLine(self.template[template_index],
+                                    self.text[text_index], next(joined))
+            else:
+                merged = MergedLine(self.template[template_index],
+                                    self.text[text_index])
+            status = status and merged.status
+            self.merged_rows.append(merged)
+        return status
+
+
+def join_rows(template_rows, text_rows):
+    """Merge each template row with the text row with the same number of
+    characters, all in one step: the characters of the text, in order,
+    replace the characters of the template. Return the merged rows."""
+    if not template_rows:
+        return []
+    codes = np.frombuffer("".join(template_rows).encode('utf-32-le'),
+                          dtype=np.uint32).copy()
+    text_codes = np.frombuffer("".join(text_rows).encode('utf-32-le'),
+                               dtype=np.uint32)
+    cells = ~WHITESPACE[np.minimum(codes, LAST_CODE)]
+    codes[cells] = text_codes[~WHITESPACE[np.minimum(text_codes, LAST_CODE)]]
+    merged = codes.tobytes().decode('utf-32-le')
+    rows = []
+    start = 0
+    for template_row in template_rows:
+        rows.append(merged[start:start + len(template_row)])
+        start += len(template_row)
+    return rows
+
+
 class MergedPageColumns(MergedPage):
     """Treat the page as a column."""
     def __init__(self, template, text):
@@ -149,18 +230,93 @@ class MergedPageColumns(MergedPage):
         return status
 
 
-def merge(template, text, margin=2, debug=False, by_row_only=False):
-    """Factory function to create a MergedPage object."""
-    by_rows = MergedPageRows(template, text)
+def merge(template, text, margin=2, debug=False, by_row_only=False,
+          engine='rows'):
+    """Factory function to create a MergedPage object. engine 'rows'
+    pairs the nth template row with the nth text row, 'align' aligns
+    them first. If that fails, try merging column by column unless
+    by_row_only is set."""
+    status, report, _ = merge_with_details(template, text, margin, debug,
+                                           by_row_only, engine)
+    return status, report
+
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+def merge_with_details(template, text, margin=2, debug=False,
+                       by_row_only=False, engine='rows'):
+    """As merge, but also return a dict of details for reports: the
+    strategy that worked ('rows', 'align', 'columns' or None if none
+    did), the number of rows that did not match when merging by rows
+    and the number of text rows with no template row."""
+    if engine == 'align':
+        by_rows = MergedPageAligned(template, text)
+    else:
+        by_rows = MergedPageRows(template, text)
+    details = {
+        "strategy": engine if by_rows.status else None,
+        "mismatched_rows": sum(1 for line in by_rows.merged_rows
+                               if not line.status),
+        "unaligned_rows": by_rows.unaligned,
+    }
     if not by_rows.status and not by_row_only:
         by_cols_status, by_cols_report = try_merge_by_columns(by_rows,
                                                               margin, debug)
         if by_cols_report:
-            return by_cols_status, by_cols_report
+            if by_cols_status:
+                details["strategy"] = "columns"
+            return by_cols_status, by_cols_report, details
     report = by_rows.report(debug)
     if debug:
         report = box_it(report)
-    return by_rows.status, report
+    return by_rows.status, report, details
+
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+def merge_files(template_file, text_file, merged_file, margin=2,
+                by_row_only=False, engine='rows', outputs=None):
+    """Merge the template and text files, writing merged_file if they
+    merged, or adding its text to the dict outputs if given so it can be
+    written later with others. Return the details of the merge as for
+    merge_with_details, with "status" added, and "error" if an input is
+    missing."""
+    sources = [output_source(path) for path in (template_file, text_file)]
+    missing = [path for path, source in zip((template_file, text_file),
+                                            sources)
+               if isinstance(source, str) and not os.path.exists(source)]
+    if missing:
+        # Only this page fails, not the rest of the batch
+        return {"strategy": None, "mismatched_rows": 0,
+                "unaligned_rows": 0, "status": False,
+                "error": f"File not found - {missing[0]}"}
+    status, report, details = merge_with_details(*sources, margin, False,
+                                                 by_row_only, engine)
+    if status:
+        if outputs is None:
+            write_output(merged_file, "".join(report))
+        else:
+            outputs[merged_file] = "".join(report)
+    details["status"] = status
+    return details
+
+
+def merge_batch(jobs, margin=2, by_row_only=False, engine='rows',
+                metrics=False):
+    """Merge a list of (template_file, text_file, merged_file) jobs in
+    this process, recording the metrics of each if metrics is set. The
+    merged files are written together at the end, in one transaction if
+    they are kept in the artifact store. Return a list of the details
+    of each merge."""
+    results = []
+    outputs = {}
+    for job in jobs:
+        with measure('merge', get_file_key(job[2]), metrics) as record:
+            details = merge_files(*job, margin=margin,
+                                  by_row_only=by_row_only, engine=engine,
+                                  outputs=outputs)
+            record["ok"] = details["status"]
+        results.append(details)
+    write_outputs(outputs)
+    return results
 
 
 def box_it(report):
@@ -185,7 +341,8 @@ def box_it(report):
 def try_merge_by_columns(rows, margin, debug):
     """Try the column merge approach."""
     text_cols_extents = find_columns(rows.text, margin)
-    template_cols_extents = find_columns(rows.template, margin)
+    template_cols_extents = find_columns(
+        rows.template_occupancy or rows.template, margin)
     if len(text_cols_extents) != len(template_cols_extents):
         report = column_merge_diagnostic(text_cols_extents,
                                          rows.text,
@@ -0,0 +1,206 @@
+"""Record how long each stage takes for each page, and what it costs.
+
+Each time a stage finishes a page a record is appended to
+metrics.jsonl in the project directory, one JSON object a line, with:
+
+* time: when the page finished, in seconds since the epoch
+* stage and key: the stage and the page key
+* ok: whether the stage succeeded for the page
+* wall: elapsed time in seconds
+* cpu: CPU time used by the process in seconds
+* peak_rss_mb: the peak resident memory of the process so far, which
+  for a pool worker may have been reached on an earlier page
+* read_bytes and write_bytes: bytes read and written by the process,
+  including from the page cache, or None where /proc/self/io is not
+  available
+
+OCR records have input_tokens, output_tokens and total_tokens spent on
+requests for the page, the number of retries and the number of
+requests answered from the OCR cache, which spend no tokens. Several
+pages are OCRed at once in one process, so OCR records have no CPU,
+memory or I/O figures.
+
+Records are appended with a single write each, so pool workers can
+share the file. gridlock stats summarises the file.
+"""
+
+
+import json
+import os
+import resource
+import time
+from contextlib import contextmanager
+import numpy as np
+
+
+METRICS_FILE = "metrics.jsonl"
+
+PERCENTILES = (50, 90, 99)
+
+
+def io_counters():
+    """Return the (read, written) byte counts of this process, or
+    (None, None) if they are not available."""
+    counters = {}
+    try:
+        with open("/proc/self/io", 'r', encoding='ascii') as f:
+            for line in f:
+                name, value = line.split(':')
+                counters[name] = int(value)
+    except (OSError, ValueError):
+        return None, None
+    return counters.get("rchar"), counters.get("wchar")
+
+
+def peak_rss_mb():
+    """Return the peak resident memory of this process in MB, over its
+    whole life rather than the current page."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux gives kB
+    return round(peak / 1024, 1)
+
+
+def write_record(record, metrics_file=METRICS_FILE):
+    """Append record to the metrics file as one line."""
+    line = json.dumps(record) + "\n"
+    fd = os.open(metrics_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line.encode('utf-8'))
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def measure(stage, key, enabled=True, process=True):
+    """Record the metrics of the stage for page key, for the code run
+    in the with block. The record is yielded so more fields, eg tokens,
+    can be added to it. If process is not set the CPU, memory and I/O
+    figures are left out, as other pages are running in the same
+    process. The block can set the record's ok to False for a page
+    that failed without raising an error. Nothing is recorded if
+    enabled is not set."""
+    record = {"stage": stage, "key": key}
+    if not enabled:
+        yield record
+        return
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    start_read, start_write = io_counters()
+    ok = False
+    try:
+        yield record
+        ok = True
+    except SystemExit as e:
+        ok = e.code in (None, 0)
+        raise
+    finally:
+        record["time"] = round(time.time(), 3)
+        record["ok"] = ok and record.get("ok", True)
+        record["wall"] = round(time.perf_counter() - start_wall, 6)
+        if process:
+            read, written = io_counters()
+            record["cpu"] = round(time.process_time() - start_cpu, 6)
+            record["peak_rss_mb"] = peak_rss_mb()
+            record["read_bytes"] = None if read is None \
+                else read - start_read
+            record["write_bytes"] = None if written is None \
+                else written - start_write
+        write_record(record)
+
+
+def read_metrics(metrics_file=METRICS_FILE):
+    """Return the list of records in the metrics file, skipping any
+    line that was cut short."""
+    records = []
+    try:
+        with open(metrics_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    except FileNotFoundError:
+        return []
+    return records
+
+
+def percentiles(values):
+    """Return a dict of the PERCENTILES of values, and the max."""
+    values = np.array(values, dtype=float)
+    summary = {f"p{p}": float(np.percentile(values, p)) for p in PERCENTILES}
+    summary["max"] = float(values.max())
+    return summary
+
+
+def summarise_stages(records):
+    """Return a dict of stage to a summary of its records: pages,
+    failures, wall and CPU time percentiles, peak memory and total
+    bytes read and written."""
+    stages = {}
+    for record in records:
+        stages.setdefault(record["stage"], []).append(record)
+    summary = {}
+    for stage, stage_records in stages.items():
+        cpu = [r["cpu"] for r in stage_records if r.get("cpu") is not None]
+        rss = [r["peak_rss_mb"] for r in stage_records
+               if r.get("peak_rss_mb") is not None]
+        summary[stage] = {
+            "pages": len(stage_records),
+            "failed": sum(1 for r in stage_records if not r["ok"]),
+            "wall": percentiles([r["wall"] for r in stage_records]),
+            "cpu": percentiles(cpu) if cpu else None,
+            "peak_rss_mb": max(rss) if rss else None,
+            "read_bytes": sum(r.get("read_bytes") or 0
+                              for r in stage_records),
+            "write_bytes": sum(r.get("write_bytes") or 0
+                               for r in stage_records),
+        }
+    return summary
+
+
+def slowest_pages(records, count):
+    """Return the count records with the longest wall time."""
+    return sorted(records, key=lambda r: r["wall"], reverse=True)[:count]
+
+
+def ocr_cost(records, input_price=0.0, output_price=0.0):
+    """Return a summary of the tokens spent on OCR, from the text
+    records, with the cost given prices per million tokens."""
+    text = [r for r in records if "total_tokens" in r]
+    if not text:
+        return None
+    input_tokens = sum(r["input_tokens"] for r in text)
+    output_tokens = sum(r["output_tokens"] for r in text)
+    cost = (input_tokens * input_price + output_tokens * output_price) / 1e6
+    return {
+        "pages": len(text),
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "total_tokens": sum(r["total_tokens"] for r in text),
+        "tokens_per_page": percentiles([r["total_tokens"] for r in text]),
+        "retries": sum(r.get("retries", 0) for r in text),
+        "cached": sum(r.get("cached", 0) for r in text),
+        # Pages sent whole are counted before and after their image
+        # was prepared
+        "images": {name: sum(r.get(name, 0) for r in text)
+                   for name in ("image_bytes", "sent_bytes",
+                                "image_tokens", "sent_tokens")},
+        "cost": cost,
+        "cost_per_page": cost / len(text),
+    }
+
+
+def timeline(records, interval=60):
+    """Return a list of (start, {stage: pages}) for each interval
+    seconds from the first record to the last, counting the pages each
+    stage finished in it. start is seconds from the first record."""
+    if not records:
+        return []
+    first = min(r["time"] for r in records)
+    last = max(r["time"] for r in records)
+    buckets = [(n * interval, {})
+               for n in range(int((last - first) // interval) + 1)]
+    for record in records:
+        counts = buckets[int((record["time"] - first) // interval)][1]
+        counts[record["stage"]] = counts.get(record["stage"], 0) + 1
+    return buckets
@@ -0,0 +1,119 @@
+"""Which character cells of a page hold a character, as a bit matrix.
+
+Merging only needs to know which cells of a template or text are not
+whitespace, eg to find the gaps between columns. An Occupancy holds
+that as a matrix packed 8 cells to a byte, with the number of
+characters in each row and each pole (character column) worked out
+once, so columns are found from the pole counts without looking at
+every character again.
+
+gridlock templates saves the occupancy of each template in
+templates/KEY.occ next to the text, with the size and modification
+time of the text it was made from, so a template edited by hand is
+read from its text again. Text is converted when it is loaded.
+"""
+
+
+import os
+import numpy as np
+from util import temp_name
+
+
+# True for each whitespace character code. Every character for which
+# str.isspace() is true lies below U+3001, so codes above that are
+# looked up as U+3001, which is not whitespace.
+LAST_CODE = 0x3001
+WHITESPACE = np.array([chr(code).isspace() for code in range(LAST_CODE + 1)])
+
+
+class Occupancy():
+    """The occupied cells of a page of rows x poles characters."""
+    def __init__(self, bits, shape, row_counts=None, pole_counts=None):
+        """Create from a packed bit matrix, one row of bytes per row of
+        the page, and the (rows, poles) shape of the page. The row and
+        pole counts are worked out unless given."""
+        self.bits = bits
+        self.shape = tuple(int(n) for n in shape)
+        if row_counts is None or pole_counts is None:
+            cells = self.cells()
+            row_counts = cells.sum(axis=1, dtype=np.int32)
+            pole_counts = cells.sum(axis=0, dtype=np.int32)
+        self.row_counts = row_counts
+        self.pole_counts = pole_counts
+
+    @classmethod
+    def from_lines(cls, lines):
+        """Return the occupancy of a list of strings, where a cell is
+        occupied if it is not whitespace. Short lines are treated as
+        padded with spaces."""
+        num_poles = max((len(line) for line in lines), default=0)
+        if not lines or num_poles == 0:
+            return cls(np.zeros((len(lines), 0), dtype=np.uint8),
+                       (len(lines), num_poles))
+        text = "".join(line.ljust(num_poles) for line in lines)
+        codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+        cells = ~WHITESPACE[np.minimum(codes, LAST_CODE)]
+        cells = cells.reshape(len(lines), num_poles)
+        return cls(np.packbits(cells, axis=1), cells.shape,
+                   cells.sum(axis=1, dtype=np.int32),
+                   cells.sum(axis=0, dtype=np.int32))
+
+    def cells(self):
+        """Return the occupancy as a 2D bool array."""
+        return np.unpackbits(self.bits, axis=1, count=self.shape[1]) \
+            .astype(bool)
+
+    def pole_occupied(self):
+        """Return a bool array, True for each pole with any character."""
+        return self.pole_counts > 0
+
+
+def occupancy_file_name(template_file):
+    """Return the name of the occupancy file saved with a template."""
+    return os.path.splitext(template_file)[0] + ".occ"
+
+
+def text_stamp(text_file):
+    """Return the size and modification time of text_file."""
+    stat = os.stat(text_file)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def save_occupancy(occupancy, file_name, stamp):
+    """Save an occupancy with the stamp of the text it came from."""
+    temp_file = temp_name(file_name)
+    with open(temp_file, 'wb') as f:
+        np.savez(f, bits=occupancy.bits, shape=np.array(occupancy.shape),
+                 row_counts=occupancy.row_counts,
+                 pole_counts=occupancy.pole_counts,
+                 stamp=np.array(stamp, dtype=np.int64))
+    os.replace(temp_file, file_name)
+
+
+def load_occupancy(text_file, lines=None):
+    """Return the occupancy of text_file, from its saved occupancy file
+    if that is up to date, otherwise from lines, or the file's text if
+    lines is not given."""
+    try:
+        with np.load(occupancy_file_name(text_file)) as data:
+            if tuple(data["stamp"]) == text_stamp(text_file):
+                return Occupancy(data["bits"], data["shape"],
+                                 data["row_counts"], data["pole_counts"])
+    except (FileNotFoundError, ValueError, KeyError, OSError):
+        pass
+    if lines is None:
+        with open(text_file, 'r', encoding='utf8') as f:
+            lines = list(f)
+    return Occupancy.from_lines(lines)
+
+
+def write_template_occupancy(template_file):
+    """Save the occupancy of a template file next to it, without
+    trailing blank lines as they are removed when merging."""
+    with open(template_file, 'r', encoding='utf8') as f:
+        lines = list(f)
+    while lines and lines[-1].strip() == "":
+        lines.pop()
+    occupancy = Occupancy.from_lines(lines)
+    save_occupancy(occupancy, occupancy_file_name(template_file),
+                   text_stamp(template_file))
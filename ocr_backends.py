@@ -0,0 +1,92 @@
+"""The OCR systems text can be extracted with, chosen by the
+text.ocr_system setting.
+
+Each system is a backend for the OCR engine: an object with a model
+attribute, an async ocr(image, prompt) method returning an OcrResponse,
+and an is_retryable(error) method. image is either an image file name
+or PNG bytes.
+
+* gemini: Google Gemini, see ocr_gemini.py
+* fake: answers with text already known instead of calling a model,
+  see ocr_fake.py. It needs no network or API key, so OCR scheduling,
+  concurrency and retries can be tried out and tuned offline.
+
+Backends are only imported when used, so the fake system works without
+the Gemini client installed.
+"""
+
+
+import os
+import sys
+from collections import namedtuple
+from util import get_config, get_config_default
+
+
+# HTTP status codes worth retrying: rate limited or server trouble
+RETRY_CODES = {408, 429, 500, 502, 503, 504}
+
+# What a backend returns for a request: the text and a dict of token
+# usage with input_tokens, output_tokens and total_tokens
+OcrResponse = namedtuple("OcrResponse", ["text", "usage"])
+
+
+def make_usage(input_tokens=0, output_tokens=0, total_tokens=None):
+    """Return a usage dict. total_tokens defaults to the sum of input
+    and output tokens."""
+    if total_tokens is None:
+        total_tokens = input_tokens + output_tokens
+    return {"input_tokens": input_tokens, "output_tokens": output_tokens,
+            "total_tokens": total_tokens}
+
+
+def gemini_backend(config):
+    """Return a Gemini backend for the model set in the config."""
+    # pylint: disable=import-outside-toplevel
+    from ocr_gemini import GeminiOcr
+    inline_max_kb = get_config_default(config, "text", "inline_max_kb", 2048)
+    return GeminiOcr(get_config(config, "text", "gemini_model"),
+                     inline_max_kb * 1024)
+
+
+def fake_backend(config):
+    """Return a fake backend with the fake_ settings in the config."""
+    # pylint: disable=import-outside-toplevel
+    from ocr_cache import OcrCache
+    from ocr_fake import FakeOcr
+    replay = None
+    replay_model = get_config_default(config, "text", "fake_replay_model", "")
+    if replay_model:
+        cache_dir = get_config_default(config, "text", "cache_dir",
+                                       ".ocr_cache")
+        max_mb = get_config_default(config, "text", "cache_max_mb", 200)
+        replay = OcrCache(os.path.expanduser(cache_dir),
+                          max_mb * 1024 * 1024)
+    return FakeOcr(
+        text_dir=get_config_default(config, "text", "fake_text_dir", "."),
+        replay=replay, replay_model=replay_model,
+        latency=get_config_default(config, "text", "fake_latency", 2.0),
+        error_rate=get_config_default(config, "text", "fake_error_rate",
+                                      0.0),
+        requests_per_minute=get_config_default(
+            config, "text", "fake_requests_per_minute", 0),
+        seed=get_config_default(config, "text", "fake_seed", 0))
+
+
+OCR_SYSTEMS = {
+    'gemini': gemini_backend,
+    'fake': fake_backend,
+}
+
+
+def check_ocr_system(config):
+    """Exit if the OCR system set in the config is not supported."""
+    ocr_system = get_config(config, "text", "ocr_system")
+    if ocr_system not in OCR_SYSTEMS:
+        print(f"OCR system {ocr_system} not supported")
+        sys.exit(1)
+
+
+def make_backend(config):
+    """Return the backend of the OCR system set in the config."""
+    check_ocr_system(config)
+    return OCR_SYSTEMS[get_config(config, "text", "ocr_system")](config)
@@ -0,0 +1,102 @@
+"""A persistent cache of OCR results.
+
+Results are keyed on a hash of the image bytes, the model and the
+prompt, so a page is only sent again if one of these changes. Each
+entry keeps the token usage of the request that produced it. The
+cache is an SQLite file with a size limit; when it is full the least
+recently used entries are removed. Pointing several projects at the
+same cache directory lets them share results.
+"""
+
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+
+CACHE_FILE = "ocr_cache.sqlite"
+
+
+def file_hash(file_path):
+    """Return the SHA-256 digest of the file's contents."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_key(image, model, prompt):
+    """Return the cache key for an OCR request. image is either the
+    image file name or the image bytes."""
+    if isinstance(image, bytes):
+        image_hash = hashlib.sha256(image).hexdigest()
+    else:
+        image_hash = file_hash(image)
+    digest = hashlib.sha256()
+    for part in (image_hash, model, prompt):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class OcrCache():
+    """OCR results stored in an SQLite file in cache_dir, limited to
+    max_bytes of text."""
+    def __init__(self, cache_dir, max_bytes):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(os.path.join(cache_dir, CACHE_FILE),
+                                  timeout=60)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS entries ("
+                            "key TEXT PRIMARY KEY, text TEXT, usage TEXT, "
+                            "size INTEGER, last_used REAL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS entries_last_used "
+                            "ON entries (last_used)")
+
+    def get(self, key):
+        """Return (text, usage) stored for key, or None."""
+        row = self.db.execute("SELECT text, usage FROM entries WHERE key = ?",
+                              (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        with self.db:
+            self.db.execute("UPDATE entries SET last_used = ? WHERE key = ?",
+                            (time.time(), key))
+        return row[0], json.loads(row[1])
+
+    def put(self, key, text, usage):
+        """Store the result for key, then trim the cache to size."""
+        size = len(text.encode('utf-8'))
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO entries "
+                            "VALUES (?, ?, ?, ?, ?)",
+                            (key, text, json.dumps(usage), size, time.time()))
+            self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until under the limit."""
+        total = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self.db.execute("SELECT key, size FROM entries "
+                               "ORDER BY last_used")
+        remove = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            remove.append((key,))
+            total -= size
+        self.db.executemany("DELETE FROM entries WHERE key = ?", remove)
+
+    def close(self):
+        """Close the cache file."""
+        self.db.close()
@@ -0,0 +1,232 @@
+"""Run OCR requests concurrently with asyncio.
+
+The engine keeps a limited number of requests in flight, holds them
+to a requests and tokens per minute budget, and retries transient
+errors with jittered exponential backoff. Each page is handed back as
+soon as it is done so it can be saved straight away.
+
+The backend is any object with a model attribute, an async
+ocr(image, prompt) method returning (text, usage), eg an OcrResponse,
+and an is_retryable(error) method. image is either an image file name
+or PNG bytes, and usage is a dict with input_tokens, output_tokens and
+total_tokens. The backends of the OCR systems gridlock supports are in
+ocr_backends.py.
+
+If a cache is given, requests it already has an answer for are
+returned from it without touching the backend or the rate limits.
+
+If metrics is set, the time, tokens, retries and cache hits of each
+page are recorded in the metrics file.
+"""
+
+
+import asyncio
+import contextvars
+import random
+import sys
+import time
+from metrics import measure
+from ocr_cache import make_key
+from util import show_progress
+
+
+# The retry, cache hit, token and image size counts of the page being
+# OCRed, set for each page so that pages OCRed at the same time are
+# counted apart
+_page_counts = contextvars.ContextVar("page_counts", default=None)
+
+
+def count_for_page(name, amount=1):
+    """Add amount to the named count of the page being OCRed, if any."""
+    counts = _page_counts.get()
+    if counts is not None:
+        counts[name] = counts.get(name, 0) + amount
+
+
+class TokenBucket():
+    """Rate limiter allowing per_minute units a minute, refilled
+    continuously. A per_minute of 0 means no limit."""
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self):
+        """Add the tokens earned since the last refill."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        """Wait until amount tokens are available and take them."""
+        if self.rate <= 0:
+            return
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            self.refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self.refill()
+            self.tokens -= amount
+
+    def available(self, amount=1):
+        """Return True if amount tokens could be taken now, for callers
+        that cannot wait. Take them with adjust."""
+        if self.rate <= 0:
+            return True
+        self.refill()
+        return self.tokens >= min(amount, self.capacity)
+
+    def adjust(self, amount):
+        """Take amount more tokens (or give back if negative), once the
+        real cost of a request is known. This can leave the bucket in
+        debt, which delays later requests."""
+        if self.rate > 0:
+            self.tokens -= amount
+
+
+class OcrJob():
+    """One page to OCR."""
+    def __init__(self, key, image_file):
+        self.key = key
+        self.image_file = image_file
+        # The sizes of the image before and after it was prepared
+        self.image_report = None
+
+
+async def ocr_whole_page(engine, job, prompt):
+    """OCR the job's image in one request."""
+    return await engine.ocr(job.image_file, prompt)
+
+
+class OcrEngine():
+    """Send OCR requests to a backend concurrently within limits."""
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(self, backend, concurrency=8, requests_per_minute=0,
+                 tokens_per_minute=0, max_retries=5, token_estimate=3000,
+                 cache=None, metrics=False):
+        self.backend = backend
+        self.cache = cache
+        self.metrics = metrics
+        self.concurrency = concurrency
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.token_estimate = token_estimate
+        self.semaphore = None
+        # A budget shared with other engines, with acquire(estimate) and
+        # release(estimate, used) coroutines, that requests must fit in
+        self.budget = None
+        self.retries = 0
+        # Tokens actually spent on requests sent by this engine
+        self.usage = {"input_tokens": 0, "output_tokens": 0,
+                      "total_tokens": 0}
+        self.base_delay = 1.0
+        self.max_delay = 60.0
+
+    def backoff(self, attempt):
+        """Return the delay before retry attempt, with jitter so
+        requests that failed together do not retry together."""
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return delay * random.uniform(0.5, 1.5)
+
+    async def ocr(self, image, prompt):
+        """OCR one image, waiting for a free slot and rate budget, and
+        retrying transient errors. Return (text, usage)."""
+        key = None
+        if self.cache is not None:
+            key = make_key(image, self.backend.model, prompt)
+            cached = self.cache.get(key)
+            if cached is not None:
+                count_for_page("cached")
+                return cached
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        attempt = 0
+        while True:
+            async with self.semaphore:
+                await self.requests.acquire()
+                estimate = self.token_estimate
+                await self.tokens.acquire(estimate)
+                if self.budget is not None:
+                    await self.budget.acquire(estimate)
+                used = 0
+                try:
+                    text, usage = await self.backend.ocr(image, prompt)
+                except Exception as e:  # pylint: disable=broad-except
+                    if attempt >= self.max_retries or \
+                       not self.backend.is_retryable(e):
+                        raise
+                    error = e
+                else:
+                    used = usage["total_tokens"]
+                    self.tokens.adjust(used - estimate)
+                    for name in self.usage:
+                        self.usage[name] += usage[name]
+                        count_for_page(name, usage[name])
+                    if key is not None:
+                        self.cache.put(key, text, usage)
+                    if usage["total_tokens"]:
+                        # Keep a running estimate for the next request
+                        self.token_estimate = \
+                            (self.token_estimate + usage["total_tokens"]) // 2
+                    return text, usage
+                finally:
+                    if self.budget is not None:
+                        await self.budget.release(estimate, used)
+            attempt += 1
+            self.retries += 1
+            count_for_page("retries")
+            delay = self.backoff(attempt)
+            print(f"Retrying after {error!r} in {delay:.1f}s",
+                  file=sys.stderr)
+            await asyncio.sleep(delay)
+
+    async def ocr_job(self, ocr_page, job, prompt):
+        """Return ocr_page(self, job, prompt), recording the page's
+        metrics if set. This must be awaited in a task of its own, as
+        asyncio tasks are, so the page's counts are kept apart."""
+        if not self.metrics:
+            return await ocr_page(self, job, prompt)
+        # Only the tokens of requests sent are counted, so a page
+        # answered from the cache costs nothing
+        counts = {"retries": 0, "cached": 0, "input_tokens": 0,
+                  "output_tokens": 0, "total_tokens": 0}
+        _page_counts.set(counts)
+        with measure('text', job.key, process=False) as record:
+            text, usage = await ocr_page(self, job, prompt)
+            record.update(counts)
+        return text, usage
+
+    async def run(self, jobs, prompt, on_result, ocr_page=None):
+        """OCR all jobs, calling on_result(job, text, usage) as each
+        finishes. By default each job's image is sent whole; ocr_page
+        can be given as an async function (engine, job, prompt)
+        returning (text, usage) to do something else, eg send several
+        requests for the page. Return the number of jobs that failed."""
+        start_time = time.time()
+        if ocr_page is None:
+            ocr_page = ocr_whole_page
+
+        async def one_job(job):
+            try:
+                return job, await self.ocr_job(ocr_page, job, prompt), None
+            except Exception as e:  # pylint: disable=broad-except
+                return job, None, e
+
+        failed = 0
+        tasks = [one_job(job) for job in jobs]
+        for done, task in enumerate(asyncio.as_completed(tasks), start=1):
+            job, result, error = await task
+            if error is None:
+                on_result(job, *result)
+            else:
+                print(f"\nOCR failed for {job.key}: {error!r}",
+                      file=sys.stderr)
+                failed += 1
+            show_progress(done, len(jobs), start_time, job.key)
+        print(file=sys.stderr)
+        return failed
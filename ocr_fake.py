@@ -0,0 +1,127 @@
+"""A fake OCR system, for trying out OCR settings without a model.
+
+Instead of calling a model the fake answers each request with text
+already known:
+
+* if a model to replay is set, the answer that model gave for the
+  same image and prompt, from the OCR cache
+* otherwise for a page image file KEY.png, or an image prepared from
+  it, the text in KEY.txt in the text directory, eg the checked text
+  of an earlier run or the tutorial's original-text
+
+Requests take a random time around the set latency, a set fraction of
+them fail with a server error, and requests beyond a requests per
+minute quota are refused as rate limited, as a real service would. The
+same seed gives the same errors and delays. Token usage is estimated
+from the image size and the lengths of the prompt and text.
+"""
+
+
+import asyncio
+import collections
+import io
+import math
+import os
+import random
+import time
+from PIL import Image
+from ocr_backends import RETRY_CODES, OcrResponse, make_usage
+from ocr_cache import make_key
+from ocr_image import tile_tokens
+
+# Rough number of characters in a token
+TOKEN_CHARS = 4
+
+
+class FakeOcrError(Exception):
+    """An error response from the fake OCR system, with its HTTP status
+    code."""
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+def image_tokens(image):
+    """Return the estimated input tokens of an image file or PNG
+    bytes."""
+    if isinstance(image, bytes):
+        image = io.BytesIO(image)
+    with Image.open(image) as im:
+        return tile_tokens(*im.size)
+
+
+def text_tokens(text):
+    """Return the estimated tokens of text."""
+    return math.ceil(len(text) / TOKEN_CHARS)
+
+
+class FakeOcr():
+    """Answer OCR requests from text files or recorded answers."""
+    # pylint: disable=too-many-arguments,too-many-instance-attributes
+    def __init__(self, text_dir=".", replay=None, replay_model="",
+                 latency=2.0, error_rate=0.0, requests_per_minute=0,
+                 seed=0):
+        self.model = "fake"
+        self.text_dir = text_dir
+        self.replay = replay
+        self.replay_model = replay_model
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests_per_minute = requests_per_minute
+        self.rng = random.Random(seed)
+        # When the requests of the last minute were accepted
+        self.accepted = collections.deque()
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+
+    def answer(self, image, prompt):
+        """Return the known text for the image and prompt."""
+        if self.replay is not None:
+            cached = self.replay.get(make_key(image, self.replay_model,
+                                              prompt))
+            if cached is not None:
+                return cached[0]
+        # A prepared page image remembers the page it was made from
+        image = getattr(image, "file_name", image)
+        if not isinstance(image, bytes):
+            key = os.path.splitext(os.path.basename(image))[0]
+            text_file = os.path.join(self.text_dir, f"{key}.txt")
+            if os.path.exists(text_file):
+                with open(text_file, 'r', encoding='utf-8') as f:
+                    return f.read().rstrip("\n")
+        raise FakeOcrError(404, "no text known for this image")
+
+    def check_rate(self):
+        """Raise a rate limit error if the quota for the last minute is
+        used up, else count the request against it."""
+        if self.requests_per_minute <= 0:
+            return
+        now = time.monotonic()
+        while self.accepted and self.accepted[0] <= now - 60:
+            self.accepted.popleft()
+        if len(self.accepted) >= self.requests_per_minute:
+            self.rate_limited += 1
+            raise FakeOcrError(429, "rate limit exceeded")
+        self.accepted.append(now)
+
+    async def ocr(self, image, prompt):
+        """Return the known text of the image after a delay, or fail as
+        set."""
+        self.requests += 1
+        self.check_rate()
+        await asyncio.sleep(self.latency * self.rng.uniform(0.5, 1.5))
+        if self.rng.random() < self.error_rate:
+            self.errors += 1
+            raise FakeOcrError(503, "service unavailable")
+        text = self.answer(image, prompt)
+        return OcrResponse(text, make_usage(
+            image_tokens(image) + text_tokens(prompt), text_tokens(text)))
+
+    @staticmethod
+    def is_retryable(error):
+        """Return True if the request that raised error may work if
+        tried again."""
+        if isinstance(error, FakeOcrError):
+            return error.code in RETRY_CODES
+        return False
@@ -1,36 +1,26 @@
 """Use a Gemini LLM to extract text from an image."""
 
 
+import io
 import os
 import sys
-import time
+import httpx
 from google import genai
+from google.genai import errors, types
+from ocr_backends import RETRY_CODES, OcrResponse, make_usage
 
 
-def ocr_gemini(image_file, model, prompt, debug):
-    """Extract text from the guven image file.."""
+def get_api_key():
+    """Return the Gemini API key from the environment, or exit."""
     key = os.environ.get("GEMINI_API_KEY")
     if key is None:
         print('Please set GEMINI_API_KEY')
         sys.exit(1)
+    return key
 
-    # exceptions: raise ServerError
-    start_time = time.time()
-    end_time = start_time
-    text = ""
-    client = genai.Client(api_key=key)
-    image = client.files.upload(file=image_file)
-    response = client.models.generate_content(
-        model=model,
-        contents=[image, prompt])
-    end_time = time.time()
-    if response.text:
-        text = response.text
-    else:
-        if debug:
-            print('No text in response. Response was:', file=sys.stderr)
-            print(response, file=sys.stderr)
 
+def clean_text(text):
+    """Tidy up the text returned by the model."""
     # Remove markdown quotes, if any
     text = "\n".join(
         line for line in text.splitlines() if not line.startswith("```")
@@ -38,9 +28,56 @@ def ocr_gemini(image_file, model, prompt, debug):
     # Remove trailing blank line if any
     if len(text) > 2 and text[-1] == '\n' and text[-2] == '\n':
         text = text[0:-1]
-    if debug:
-        print(f"Model: {model}", file=sys.stderr)
-        print("Tokens: ", response.usage_metadata, file=sys.stderr)
-        elapsed_time = end_time - start_time
-        print(f"Elapsed time: {elapsed_time:.2f} s", file=sys.stderr)
     return text
+
+
+def get_usage(response):
+    """Return the token counts from a response as a dict."""
+    usage = response.usage_metadata
+    if usage is None:
+        return make_usage()
+    return make_usage(usage.prompt_token_count or 0,
+                      usage.candidates_token_count or 0,
+                      usage.total_token_count or 0)
+
+
+class GeminiOcr():
+    """Extract text from images with one Gemini client shared by all
+    requests, using the asyncio interface."""
+    def __init__(self, model, inline_max_bytes=2 * 1024 * 1024):
+        """Create the client for the given model."""
+        self.client = genai.Client(api_key=get_api_key())
+        self.model = model
+        self.inline_max_bytes = inline_max_bytes
+
+    async def ocr(self, image, prompt):
+        """Extract text from the image, given as a PNG file name or PNG
+        bytes. Images up to inline_max_bytes are sent in the request,
+        larger ones are uploaded with the Files API first. Return an
+        OcrResponse."""
+        if not isinstance(image, bytes) and \
+           os.path.getsize(image) <= self.inline_max_bytes:
+            with open(image, 'rb') as f:
+                image = f.read()
+        if not isinstance(image, bytes):
+            part = await self.client.aio.files.upload(file=image)
+        elif len(image) <= self.inline_max_bytes:
+            part = types.Part.from_bytes(data=image, mime_type="image/png")
+        else:
+            part = await self.client.aio.files.upload(
+                file=io.BytesIO(image),
+                config=types.UploadFileConfig(mime_type="image/png"))
+        response = await self.client.aio.models.generate_content(
+            model=self.model,
+            contents=[part, prompt])
+        return OcrResponse(clean_text(response.text or ""),
+                           get_usage(response))
+
+    @staticmethod
+    def is_retryable(error):
+        """Return True if the request that raised error may work if
+        tried again."""
+        if isinstance(error, errors.APIError):
+            return error.code in RETRY_CODES
+        return isinstance(error, (httpx.TransportError, ConnectionError,
+                                  TimeoutError))
@@ -0,0 +1,160 @@
+"""Prepare page images to send for OCR.
+
+A straightened page is a full size PNG scanned for people to read, but
+the model only has to tell printed characters apart, and the input
+tokens of an image grow with its size: Gemini charges TILE_TOKENS for
+each IMAGE_TILE pixel square tile of it. Before a page is sent whole
+it can be
+
+* reduced to grey levels, or to black and white with Otsu's threshold,
+  which compresses to a much smaller PNG
+* scaled down so a character cell is pixels_per_char pixels wide,
+  using the grid spacing found by gridlock segment
+* trimmed to the character cells found by the templates, keeping a
+  margin of blank cells, so blank paper is not sent
+
+The prepared image is PNG bytes, which the backends send in the
+request itself if it is small enough instead of uploading it first.
+The bytes and estimated tokens of the page before and after are
+counted in the page's metrics, for gridlock stats.
+"""
+
+
+import asyncio
+import io
+import math
+import os
+import sys
+import numpy as np
+from PIL import Image
+from grid import cell_edges
+from ocr_engine import count_for_page
+from raster import page_raster
+from segment import otsu_threshold
+from util import read_config, get_config, get_config_default, get_page_attrs
+from variances import page_variances
+
+
+IMAGE_MODES = ('original', 'gray', 'binary')
+
+# Gemini charges a fixed number of tokens for each tile of an image
+IMAGE_TILE = 768
+TILE_TOKENS = 258
+
+# Blank cells kept around the characters when trimming, so characters
+# at the edge are not cut
+TRIM_MARGIN = 1
+
+
+class PageImage(bytes):
+    """The PNG bytes of a prepared page image, with the name of the
+    file it was made from."""
+    def __new__(cls, data, file_name):
+        image = super().__new__(cls, data)
+        image.file_name = file_name
+        return image
+
+
+def tile_tokens(width, height):
+    """Return the estimated input tokens of an image of the given
+    size."""
+    return TILE_TOKENS * math.ceil(width / IMAGE_TILE) * \
+        math.ceil(height / IMAGE_TILE)
+
+
+def check_image_config(config):
+    """Exit if the image mode in the config is not supported."""
+    mode = get_config_default(config, "text", "image_mode", "original")
+    if mode not in IMAGE_MODES:
+        print(f"Image mode {mode} not supported")
+        sys.exit(1)
+
+
+def uses_grid(config):
+    """Return True if preparing page images needs the grid of each
+    page."""
+    return get_config_default(config, "text", "pixels_per_char", 0) > 0 or \
+        get_config_default(config, "text", "trim_margins", False)
+
+
+def trim_box(occupied, pa, width, height, margin=TRIM_MARGIN):
+    """Return the (left, top, right, bottom) pixel box of the occupied
+    cells of a page, given as a rows x columns bool array, with margin
+    cells round them, or the whole page if no cell is occupied."""
+    rows = np.flatnonzero(occupied.any(axis=1))
+    columns = np.flatnonzero(occupied.any(axis=0))
+    if len(rows) == 0:
+        return 0, 0, width, height
+    x_edges = cell_edges(pa["x_offset"], pa["grid_x_spacing"], width)
+    y_edges = cell_edges(pa["y_offset"], pa["grid_y_spacing"], height)
+    left = x_edges[max(0, columns[0] - margin)]
+    right = x_edges[min(len(x_edges) - 1, columns[-1] + 1 + margin)]
+    top = y_edges[max(0, rows[0] - margin)]
+    bottom = y_edges[min(len(y_edges) - 1, rows[-1] + 1 + margin)]
+    return max(0, left), max(0, top), min(width, right), min(height, bottom)
+
+
+def prepare_image(img, mode, pa=None, pixels_per_char=0, occupied=None):
+    """Return the PIL image img made ready for OCR: trimmed to the
+    occupied cells if given, scaled down to pixels_per_char pixels a
+    cell if set, and in grey levels or black and white if mode asks.
+    The grid attributes pa are needed to trim or scale."""
+    if occupied is not None:
+        img = img.crop(trim_box(occupied, pa, img.width, img.height))
+    if mode != 'original' and img.mode != 'L':
+        img = img.convert('L')
+    if pixels_per_char > 0:
+        scale = pixels_per_char / pa["grid_x_spacing"]
+        if scale < 1:
+            size = (max(1, round(img.width * scale)),
+                    max(1, round(img.height * scale)))
+            img = img.resize(size, Image.Resampling.LANCZOS)
+    if mode == 'binary':
+        pixels = np.asarray(img)
+        img = Image.fromarray(pixels > otsu_threshold(pixels))
+    return img
+
+
+def prepare_page(key, image_file, config):
+    """Return the image to send for a page, as the config asks, with a
+    dict of the bytes and estimated tokens of the page before and
+    after. The image is the file name if it is sent as it is, otherwise
+    PageImage bytes. Trimming and scaling need the page's grid."""
+    mode = get_config_default(config, "text", "image_mode", "original")
+    with Image.open(image_file) as img:
+        size = img.size
+    report = {"image_bytes": os.path.getsize(image_file),
+              "image_tokens": tile_tokens(*size)}
+    if mode == 'original' and not uses_grid(config):
+        report.update(sent_bytes=report["image_bytes"],
+                      sent_tokens=report["image_tokens"])
+        return image_file, report
+    pa = get_page_attrs(key) if uses_grid(config) else None
+    occupied = None
+    if get_config_default(config, "text", "trim_margins", False):
+        occupied = page_variances(key, pa) > \
+            get_config(config, "grid", "variance_threshold")
+    if mode == 'original':
+        with Image.open(image_file) as img:
+            img.load()
+    else:
+        # The grey levels, from the raster cache
+        img = Image.fromarray(page_raster(image_file, True))
+    img = prepare_image(img, mode, pa, get_config_default(
+        config, "text", "pixels_per_char", 0), occupied)
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG", optimize=mode == 'binary')
+    image = PageImage(buffer.getvalue(), image_file)
+    report.update(sent_bytes=len(image), sent_tokens=tile_tokens(*img.size))
+    return image, report
+
+
+async def ocr_prepared_page(engine, job, prompt):
+    """OCR the job's page in one request, preparing its image first as
+    the config asks, and count the bytes and tokens saved."""
+    image, report = await asyncio.to_thread(prepare_page, job.key,
+                                            job.image_file, read_config())
+    job.image_report = report
+    for name, amount in report.items():
+        count_for_page(name, amount)
+    return await engine.ocr(image, prompt)
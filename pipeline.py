@@ -0,0 +1,448 @@
+"""Run every stage of gridlock on each page as soon as the page is
+ready for it.
+
+Each page moves through split, crop, straighten, segment, templates,
+text and merge. Instead of finishing a stage for every page before
+starting the next, a stage is started for a page as soon as the stages
+it needs are done for that page, so OCR of the first pages runs while
+later pages are still being straightened. CPU bound stages run in a
+pool of worker processes, with pages further along the pipeline going
+first, and OCR requests run on an event loop in a thread, limited by
+the OCR engine settings. A stage whose output for a page is up to date
+in the manifest is not run again, as with the separate commands.
+
+The grid spacing is the same for all pages, so it is estimated once
+from the first pages straightened; each page is then segmented on its
+own.
+
+Run by gridlock batch, the pipeline is given a share of the batch's
+CPU slots and OCR budget (see batch.py): it asks for a slot before
+handing each job to its pool, and reports its progress to the batch
+instead of showing it.
+"""
+
+
+import asyncio
+import glob
+import heapq
+import os
+import queue
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from manifest import needs_build, record_output
+from batch import POLL_INTERVAL
+from ocr_engine import OcrJob
+from ocr_image import ocr_prepared_page, uses_grid
+from segment import combine_pitches, file_pitch
+from util import SPLIT_DIR, CROPPED_DIR, PAGES_DIR, ATTRIB_DIR
+from util import TEMPLATES_DIR, TEXT_DIR, MERGED_DIR, SOURCE_DIR
+from util import get_config, get_config_default, get_num_pages, read_json
+from util import get_attrs_file_name, get_command, get_file_key
+from util import get_num_workers, init_worker, run_page, mkdir
+from util import output_not_empty, write_output, _file_cache
+
+
+STAGES = ('split', 'crop', 'straighten', 'segment', 'templates', 'text',
+          'merge')
+
+# The file each stage writes for a page
+STAGE_OUTPUTS = {
+    'split': f"{SPLIT_DIR}/{{}}.png",
+    'crop': f"{CROPPED_DIR}/{{}}.png",
+    'straighten': f"{PAGES_DIR}/{{}}.png",
+    'segment': f"{ATTRIB_DIR}/{{}}.txt",
+    'templates': f"{TEMPLATES_DIR}/{{}}.txt",
+    'text': f"{TEXT_DIR}/{{}}.txt",
+    'merge': f"{MERGED_DIR}/{{}}.txt",
+}
+
+
+def stage_deps(ocr_strategy, image_grid=False):
+    """Return a dict of the stages each stage needs done for a page
+    first. Whole page OCR only needs the straightened page, but OCR by
+    strips needs the grid, as does trimming or scaling the page image
+    if image_grid is set."""
+    needs_grid = ocr_strategy == 'strips' or image_grid
+    return {
+        'crop': ('split',),
+        'straighten': ('crop',),
+        'segment': ('straighten',),
+        'templates': ('segment',),
+        'text': ('segment',) if needs_grid else ('straighten',),
+        'merge': ('templates', 'text'),
+    }
+
+
+def job_priority(stage, key):
+    """Return the sort order of a CPU job: later stages first, so pages
+    finish rather than every page being cropped first, then by page."""
+    return (-STAGES.index(stage), key)
+
+
+def sample_pitch(page_files):
+    """Return the (x, y) grid pitch estimated from page_files."""
+    return combine_pitches([file_pitch(page_file)
+                            for page_file in page_files])
+
+
+class Pipeline():
+    """Move each page of a project through all the stages."""
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, config, share=None):
+        self.config = config
+        self.share = share
+        self.prefix = get_config(config, "split", "prefix")
+        self.expected_pages = get_num_pages(config)
+        self.by_strips = get_config(config, "text", "ocr_strategy") == \
+            'strips'
+        self.deps = stage_deps(get_config(config, "text", "ocr_strategy"),
+                               uses_grid(config))
+        self.native_segment = get_config_default(
+            config, "segment", "engine", "native") == "native"
+        self.sample_pages = get_config_default(config, "segment",
+                                               "sample_pages", 8)
+        self.grids = get_config_default(config, "grid", "grid_images",
+                                        "preview")
+        self.commands = {name: get_command(f"gridlock_{name}")
+                         for name in ('split', 'crop', 'straighten',
+                                      'segment', 'templates', 'text',
+                                      'merge', 'collect')}
+        self.events = queue.Queue()
+        self.done = {stage: set() for stage in STAGES}
+        self.started = {stage: set() for stage in STAGES}
+        self.failed = {stage: set() for stage in STAGES}
+        self.ready = []
+        self.cpu_jobs = []
+        self.cpu_running = 0
+        self.workers = share.workers if share else get_num_workers()
+        self.cpu_limit = 2 * self.workers
+        self.outstanding = 0
+        self.split_finished = False
+        self.attrs = {}
+        self.attrs_changed = False
+        self.pitch = None
+        self.pitch_pending = False
+        self.pitch_failed = False
+        self.external_done = False
+        self.cpu = None
+        self.loop = None
+        self.engine = None
+        self.prompt = None
+
+    def load_attrs(self):
+        """Read the grid of pages already segmented, if any."""
+        attrs_file = get_attrs_file_name(self.prefix)
+        if os.path.exists(attrs_file) and \
+           not needs_build('segment', self.prefix):
+            self.attrs = read_json(attrs_file)
+        if self.attrs:
+            first = next(iter(self.attrs.values()))
+            self.pitch = (first["grid_x_spacing"], first["grid_y_spacing"])
+
+    def output_exists(self, stage, key):
+        """Return True if the stage has already been done for the page."""
+        if stage == 'segment':
+            return key in self.attrs
+        return output_not_empty(STAGE_OUTPUTS[stage].format(key))
+
+    def up_to_date(self, stage, key):
+        """Return True if the stage's output for the page exists and its
+        inputs have not changed, or it has been edited by hand."""
+        if stage == 'segment':
+            return key in self.attrs
+        return self.output_exists(stage, key) and not needs_build(stage, key)
+
+    def cpu_args(self, stage):
+        """Return the command, function name and arguments after the page
+        key to run a CPU stage for a page."""
+        if stage == 'crop':
+            return 'crop', 'crop_one_page', (False,)
+        if stage == 'straighten':
+            return 'straighten', 'straighten_one_page', (False,)
+        if stage == 'segment':
+            return 'segment', 'segment_one_page', self.pitch
+        if stage == 'templates':
+            return 'templates', 'make_one_template', (False, self.grids)
+        return 'merge', 'merge_one_page', (False, False)
+
+    def try_start(self, stage, key):
+        """Queue the stage for the page if everything it needs is done."""
+        if key in self.started[stage] or \
+           not all(key in self.done[dep] for dep in self.deps[stage]):
+            return
+        if stage == 'segment' and (self.pitch is None or
+                                   not self.native_segment):
+            if key not in self.attrs:
+                return
+        self.started[stage].add(key)
+        self.ready.append((stage, key))
+
+    def start(self, stage, key):
+        """Start the stage for the page, or count it as done at once if
+        its output already exists."""
+        self.outstanding += 1
+        if self.up_to_date(stage, key):
+            self.events.put((stage, key, True, 'skip'))
+        elif stage == 'text':
+            future = asyncio.run_coroutine_threadsafe(self.ocr_page(key),
+                                                      self.loop)
+            future.add_done_callback(
+                lambda f: self.events.put(('text', key, ocr_ok(f, key),
+                                           None)))
+        else:
+            heapq.heappush(self.cpu_jobs, (job_priority(stage, key), stage))
+
+    def submit_cpu_jobs(self):
+        """Hand queued CPU jobs to the pool, keeping only a few more
+        than there are workers in flight, so a page that becomes ready
+        for a later stage does not wait behind every queued crop."""
+        while self.cpu_jobs and self.cpu_running < self.cpu_limit:
+            if self.share is not None and not self.share.try_cpu():
+                break
+            (_, key), stage = heapq.heappop(self.cpu_jobs)
+            command, function_name, args = self.cpu_args(stage)
+            module_file = os.path.join(SOURCE_DIR, f"gridlock_{command}")
+            future = self.cpu.submit(run_page, module_file, function_name,
+                                     key, args)
+            future.add_done_callback(
+                lambda f, stage=stage, key=key:
+                self.events.put((stage, key, cpu_ok(f), 'cpu')))
+            self.cpu_running += 1
+
+    async def ocr_page(self, key):
+        """OCR one page and save its text."""
+        job = OcrJob(key, f"{PAGES_DIR}/{key}.png")
+        if self.by_strips:
+            ocr_function = self.commands['text'].ocr_page_strips
+        else:
+            ocr_function = ocr_prepared_page
+        text, _ = await self.engine.ocr_job(ocr_function, job, self.prompt)
+        write_output(f"{TEXT_DIR}/{key}.txt", text + "\n")
+
+    def check_pitch(self, idle):
+        """Start estimating the grid pitch once enough pages have been
+        straightened, or when nothing else is left to do."""
+        if self.pitch is not None or self.pitch_pending or \
+           self.pitch_failed or not self.native_segment or \
+           not self.done['straighten']:
+            return
+        wanted = min(self.sample_pages, self.expected_pages)
+        if len(self.done['straighten']) < wanted and not idle:
+            return
+        page_files = [STAGE_OUTPUTS['straighten'].format(key)
+                      for key in sorted(self.done['straighten'])[:wanted]]
+        self.pitch_pending = True
+        self.outstanding += 1
+        future = self.cpu.submit(sample_pitch, page_files)
+        future.add_done_callback(
+            lambda f: self.events.put(('pitch', None, pitch_result(f),
+                                       'cpu')))
+        self.cpu_running += 1
+
+    def finish_pitch(self, pitch):
+        """Record the grid pitch and start segmenting waiting pages.
+        If it could not be found the pages cannot be segmented, so they
+        fail instead of the estimate being tried again."""
+        self.pitch_pending = False
+        if pitch is None:
+            print("\nCould not find the grid spacing", file=sys.stderr)
+            self.pitch_failed = True
+            self.failed['segment'] |= self.done['straighten']
+            return
+        self.pitch = pitch
+        for key in sorted(self.done['straighten']):
+            self.try_start('segment', key)
+
+    def finish(self, stage, key, ok, ran=True):
+        """Record the result of a stage for a page and queue the stages
+        that can now run for it. If ran is set the stage made the output
+        just now, so it is recorded in the manifest."""
+        if stage == 'segment' and ok and key not in self.attrs:
+            _, attr = self.commands['segment'].read_attributes_file(
+                STAGE_OUTPUTS['segment'].format(key))
+            self.attrs[key] = attr
+            self.attrs_changed = True
+        if not ok or not self.output_exists(stage, key):
+            self.failed[stage].add(key)
+            return
+        if ran and stage not in ('split', 'segment'):
+            record_output(stage, key)
+        self.done[stage].add(key)
+        if stage == 'straighten':
+            if self.pitch_failed:
+                self.failed['segment'].add(key)
+            self.check_pitch(False)
+        for next_stage, needs in self.deps.items():
+            if stage in needs:
+                self.try_start(next_stage, key)
+
+    def handle(self, event):
+        """Handle one event from the split thread or a finished job."""
+        stage, key, result, source = event
+        if source == 'cpu':
+            self.cpu_running -= 1
+            if self.share is not None and stage != 'pitch':
+                self.share.release_cpu()
+        if stage == 'split-done':
+            self.split_finished = True
+            for split_file in sorted(glob.glob(
+                    f"{SPLIT_DIR}/{self.prefix}-*.png")):
+                split_key = get_file_key(split_file)
+                if split_key not in self.done['split']:
+                    self.finish('split', split_key, True)
+            return
+        if stage != 'split':
+            self.outstanding -= 1
+        if stage == 'pitch':
+            self.finish_pitch(result)
+        else:
+            self.finish(stage, key, result, source != 'skip')
+
+    def segment_external(self):
+        """Segment all straightened pages with the external segmenter,
+        which needs every page at once."""
+        segment = self.commands['segment']
+        print(file=sys.stderr)
+        segment.prescan_grid(self.prefix)
+        segment.prepare_grid_attributes(self.prefix)
+        segment.write_page_config(self.prefix)
+        record_output('segment', self.prefix)
+        self.load_attrs()
+        for key in sorted(self.done['straighten']):
+            self.try_start('segment', key)
+
+    def run_split(self):
+        """Split the PDF, posting each page as it is extracted."""
+        split = self.commands['split']
+        config = self.config
+        try:
+            split.split_page_images(
+                get_config(config, "split", "input"),
+                get_config(config, "split", "first_page"),
+                get_config(config, "split", "last_page"),
+                self.prefix, self.expected_pages, False,
+                on_page=lambda key: self.events.put(('split', key, True,
+                                                     None)))
+        except SystemExit:
+            pass
+        self.events.put(('split-done', None, True, None))
+
+    def show_progress(self):
+        """Show how many pages have been through each stage on stderr,
+        or report them to the batch."""
+        if self.share is not None:
+            self.share.report({stage: len(self.done[stage])
+                               for stage in STAGES})
+            return
+        counts = " ".join(f"{stage} {len(self.done[stage])}"
+                          for stage in STAGES)
+        print(f"\r{counts} of {self.expected_pages}", end='',
+              file=sys.stderr, flush=True)
+
+    def step(self):
+        """Handle all waiting events, then start what is ready. Return
+        False when there is nothing left to do."""
+        try:
+            # Jobs waiting for a slot of the batch are tried again soon
+            self.handle(self.events.get(
+                timeout=POLL_INTERVAL if self.cpu_jobs and self.share
+                else None))
+        except queue.Empty:
+            pass
+        while not self.events.empty():
+            self.handle(self.events.get())
+        if self.attrs_changed:
+            # Workers read the grid of each page from PREFIX.json
+            self.commands['segment'].save_page_config(self.prefix,
+                                                      self.attrs)
+            record_output('segment', self.prefix)
+            self.attrs_changed = False
+        for stage, key in self.ready:
+            self.start(stage, key)
+        self.ready = []
+        self.submit_cpu_jobs()
+        self.show_progress()
+        if self.outstanding > 0 or not self.split_finished:
+            return True
+        # Nothing running: pages may be waiting on the grid pitch
+        if self.pitch is None and self.native_segment and \
+           not self.pitch_failed:
+            self.check_pitch(True)
+            return self.pitch_pending
+        waiting = self.done['straighten'] - self.started['segment']
+        if waiting and not self.native_segment and not self.external_done:
+            self.external_done = True
+            self.segment_external()
+            for stage, key in self.ready:
+                self.start(stage, key)
+            self.ready = []
+            self.submit_cpu_jobs()
+            return self.outstanding > 0
+        return False
+
+    def run(self):
+        """Run the pipeline for all pages. Return True if every page was
+        merged."""
+        for stage_dir in (SPLIT_DIR, CROPPED_DIR, PAGES_DIR, ATTRIB_DIR,
+                          TEMPLATES_DIR, TEXT_DIR, MERGED_DIR):
+            mkdir(stage_dir)
+        text = self.commands['text']
+        text.check_ocr_config(self.config)
+        self.prompt = text.get_prompt()
+        self.load_attrs()
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        # The OCR cache must be opened in the thread that uses it
+        self.engine = asyncio.run_coroutine_threadsafe(
+            make_engine(text, self.config), self.loop).result()
+        if self.share is not None:
+            self.share.use_budget(self.engine)
+        split_thread = threading.Thread(target=self.run_split, daemon=True)
+        with ProcessPoolExecutor(max_workers=self.workers,
+                                 initializer=init_worker,
+                                 initargs=(dict(_file_cache),)) as self.cpu:
+            split_thread.start()
+            while self.step():
+                pass
+        print(file=sys.stderr)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        text.report_cache(self.engine.cache)
+        for stage in STAGES:
+            if self.failed[stage]:
+                print(f"{stage} failed for {len(self.failed[stage])} pages: " +
+                      " ".join(sorted(self.failed[stage])))
+        return len(self.done['merge']) == self.expected_pages
+
+
+async def make_engine(text, config):
+    """Make the OCR engine in the event loop's thread."""
+    return text.make_engine(config)
+
+
+def cpu_ok(future):
+    """Return True if a CPU job completed without error."""
+    try:
+        return future.result()[1]
+    except Exception:  # pylint: disable=broad-exception-caught
+        return False
+
+
+def pitch_result(future):
+    """Return the grid pitch estimated by a CPU job, or None if it
+    failed."""
+    try:
+        return future.result()
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        print(f"\nGrid pitch estimate failed: {e!r}", file=sys.stderr)
+        return None
+
+
+def ocr_ok(future, key):
+    """Return True if an OCR job completed without error."""
+    try:
+        future.result()
+        return True
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        print(f"\nOCR failed for {key}: {e!r}", file=sys.stderr)
+        return False
@@ -0,0 +1,123 @@
+"""A cache of decoded page images shared by the stages that read them.
+
+Decoding a large PNG scan takes longer than most of the work done on
+it, and the same page is read by segment, templates and text. The
+first stage to read a page saves its grey levels (the band read by
+grid.read_page) uncompressed in rasters/KEY.gray, and later reads map
+that file into memory instead of decoding the PNG again. The file
+starts with a small header giving the array shape and the size and
+modification time of the PNG it came from, so a changed page is
+decoded again.
+
+The cell variances are measured on the first band, as ImageStat and
+magick do, but the images made from a page for people or for OCR use
+its luminance. For a grey page these are the same; for a colour page
+the luminance is saved as well, in rasters/KEY.luma.
+"""
+
+
+import os
+import struct
+import numpy as np
+from PIL import Image
+from grid import read_page, read_luminance
+from util import RASTERS_DIR, read_config, get_config_default, mkdir
+from util import delete_files, temp_name
+
+
+# Rasters of earlier versions have no luminance, so are made again
+MAGIC = b"GLRASTR2"
+# Magic, height, width, source size, source mtime in nanoseconds
+HEADER = struct.Struct("<8sIIqq")
+HEADER_SIZE = 32
+
+# Suffix of the luminance raster of a colour page
+LUMINANCE = "luma"
+
+
+def raster_file_name(page_file, raster_dir=RASTERS_DIR, suffix="gray"):
+    """Return the name of the raster cache file for page_file."""
+    key = os.path.splitext(os.path.basename(page_file))[0]
+    return f"{raster_dir}/{key}.{suffix}"
+
+
+def source_stamp(page_file):
+    """Return the size and modification time of page_file, used to
+    tell if a raster is out of date."""
+    stat = os.stat(page_file)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def read_header(raster_file):
+    """Return (height, width, size, mtime) from the raster header, or
+    None if the file is missing or not a raster."""
+    try:
+        with open(raster_file, 'rb') as f:
+            data = f.read(HEADER_SIZE)
+    except FileNotFoundError:
+        return None
+    if len(data) < HEADER.size:
+        return None
+    magic, height, width, size, mtime = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        return None
+    return height, width, size, mtime
+
+
+def write_raster(page, stamp, raster_file):
+    """Save the 2D uint8 array page with its source stamp."""
+    header = HEADER.pack(MAGIC, page.shape[0], page.shape[1], *stamp)
+    temp_file = temp_name(raster_file)
+    with open(temp_file, 'wb') as f:
+        f.write(header.ljust(HEADER_SIZE, b'\0'))
+        f.write(np.ascontiguousarray(page, dtype=np.uint8).tobytes())
+    os.replace(temp_file, raster_file)
+
+
+def decode_page(page_file, stamp, raster_dir):
+    """Decode page_file and save its rasters. The luminance is only
+    saved if it differs from the band, ie for a colour page."""
+    with Image.open(page_file) as img:
+        page = read_page(img)
+        luminance = read_luminance(img)
+    mkdir(raster_dir)
+    luminance_file = raster_file_name(page_file, raster_dir, LUMINANCE)
+    if np.array_equal(page, luminance):
+        delete_files(luminance_file)
+    else:
+        write_raster(luminance, stamp, luminance_file)
+    write_raster(page, stamp, raster_file_name(page_file, raster_dir))
+
+
+def load_raster(page_file, raster_dir=RASTERS_DIR, luminance=False):
+    """Return the grey levels of page_file as a read only 2D uint8
+    array mapped from the raster cache, decoding the PNG and saving
+    the raster first if it is missing or out of date. The grey levels
+    are the band the cell variances are measured on, or the luminance
+    if luminance is set."""
+    raster_file = raster_file_name(page_file, raster_dir)
+    stamp = source_stamp(page_file)
+    header = read_header(raster_file)
+    if header is None or header[2:] != stamp:
+        decode_page(page_file, stamp, raster_dir)
+        header = read_header(raster_file)
+    if luminance:
+        luminance_file = raster_file_name(page_file, raster_dir, LUMINANCE)
+        luminance_header = read_header(luminance_file)
+        # Written with the band, so a grey page has none
+        if luminance_header is not None and luminance_header[2:] == stamp:
+            raster_file, header = luminance_file, luminance_header
+    height, width = header[:2]
+    return np.memmap(raster_file, dtype=np.uint8, mode='r',
+                     offset=HEADER_SIZE, shape=(height, width))
+
+
+def page_raster(page_file, luminance=False):
+    """Return the grey levels of page_file, from the raster cache unless
+    it is turned off in the config. The grey levels are the band the
+    cell variances are measured on, or the luminance if luminance is
+    set."""
+    if get_config_default(read_config(), "jobs", "raster_cache", True):
+        return load_raster(page_file, luminance=luminance)
+    with Image.open(page_file) as img:
+        return read_luminance(img) if luminance else read_page(img)
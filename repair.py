@@ -0,0 +1,105 @@
+"""Repair the text of a page that failed to merge by OCRing again just
+the rows that do not match the template.
+
+A row merge tells us which lines have a different number of
+characters in the template and the text. The template gives the
+number of characters expected on each of those lines, and the grid
+gives where the line is on the page image, so each line can be sent
+on its own with the expected count in the prompt.
+"""
+
+
+import asyncio
+from collect import cells_origin, occupied
+from grid import cell_variances
+from merge import MergedPageRows
+from ocr_engine import OcrJob
+from strips import strip_images
+
+
+REPAIR_PROMPT = """
+**Line Instructions:** The image is a single line cut from a page of
+source code. It contains exactly {count} characters that are not
+spaces. Output only that one line.
+"""
+
+
+class RepairJob(OcrJob):
+    """A page with rows to OCR again. text is the current text lines
+    and mismatched the (row, count) pairs to repair."""
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(self, key, image_file, template, text, mismatched):
+        super().__init__(key, image_file)
+        self.template = template
+        self.text = text
+        self.mismatched = mismatched
+        self.repaired = 0
+
+
+def mismatched_rows(template, text):
+    """Return a list of (row, count) for each line where the template
+    and text have a different number of characters, where count is the
+    number of characters the template expects, and the text lines.
+    Lines the template says are blank are left out, as there is
+    nothing to OCR."""
+    rows = MergedPageRows(template, text)
+    mismatched = []
+    for row, line in enumerate(rows.merged_rows):
+        count = len(line.template_nonws.strip())
+        if not line.status and count > 0:
+            mismatched.append((row, count))
+    return mismatched, rows.text
+
+
+def first_text_row(page, pa, variance_threshold, template):
+    """Return the grid row the template starts at, and the number of
+    grid rows. The template may have been made with a threshold chosen
+    for the page, or edited by hand, so rather than taking the first
+    row with a character on it, the template is lined up with the
+    character cells found with variance_threshold."""
+    cells = cell_variances(page, pa) > variance_threshold
+    small = occupied([line.rstrip("\n") for line in template])
+    return max(0, cells_origin(small, cells)[0]), cells.shape[0]
+
+
+def pick_line(text, count):
+    """Return the line of the reply with count non-space characters, or
+    None if there isn't one."""
+    for line in text.splitlines():
+        if len(line.replace(' ', '')) == count:
+            return line
+    return None
+
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+async def repair_text(engine, page, pa, variance_threshold, template,
+                      mismatched, text, prompt):
+    """OCR the page rows for each (row, count) in mismatched, with all
+    rows in flight at once. page is the page's grey levels as a 2D
+    uint8 array and template the page's template lines. Return the
+    text lines with the rows that now have the right number of
+    characters patched in, the number of rows repaired and the total
+    usage."""
+    offset, num_rows = first_text_row(page, pa, variance_threshold,
+                                      template)
+    # A hand edited template may have rows past the end of the grid
+    mismatched = [(row, count) for row, count in mismatched
+                  if offset + row < num_rows]
+    strips = [[offset + row] for row, _ in mismatched]
+    images = strip_images(page, pa, strips)
+    results = await asyncio.gather(*[
+        engine.ocr(image, prompt + REPAIR_PROMPT.format(count=count))
+        for (_, count), image in zip(mismatched, images)])
+    lines = [line.rstrip('\n') for line in text]
+    usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+    repaired = 0
+    for (row, count), (reply, row_usage) in zip(mismatched, results):
+        for name in usage:
+            usage[name] += row_usage[name]
+        line = pick_line(reply, count)
+        if line is not None:
+            lines[row] = line
+            repaired += 1
+    while lines and lines[-1].strip() == "":
+        lines.pop()
+    return lines, repaired, usage
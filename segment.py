@@ -0,0 +1,157 @@
+"""Find the character grid of a page from its ink projection profiles.
+
+Summing the ink in each pixel row of a line printer page gives a
+profile that repeats once per text line, and summing each pixel
+column gives one that repeats once per character. The autocorrelation
+of a profile peaks at its repeat distance, which gives the grid pitch.
+With the pitch known, the grid offset is where the cell edges fall on
+the least ink, ie in the gaps between lines and characters.
+"""
+
+
+import numpy as np
+from raster import page_raster
+
+
+MIN_PITCH = 4
+MAX_PITCH = 250
+
+
+def otsu_threshold(values, bins=256):
+    """Return the threshold that best splits values into two classes,
+    using Otsu's method on their histogram."""
+    values = np.asarray(values, dtype=np.float64).ravel()
+    if values.size == 0 or values.min() == values.max():
+        return float(values.max()) if values.size else 0.0
+    hist, edges = np.histogram(values, bins=bins)
+    centres = (edges[:-1] + edges[1:]) / 2
+    weight1 = np.cumsum(hist)
+    weight2 = weight1[-1] - weight1
+    sum1 = np.cumsum(hist * centres)
+    mean1 = sum1 / np.maximum(weight1, 1)
+    mean2 = (sum1[-1] - sum1) / np.maximum(weight2, 1)
+    between = weight1 * weight2 * (mean1 - mean2) ** 2
+    # With an empty gap between the classes every split in the gap is
+    # as good, so take the middle of the gap
+    best = np.flatnonzero(between >= between.max() * (1 - 1e-9))
+    return float((edges[best[0] + 1] + edges[best[-1] + 1]) / 2)
+
+
+def ink_profiles(page):
+    """Return the row and column ink profiles of a 2D uint8 page."""
+    ink = page < otsu_threshold(page)
+    return ink.sum(axis=1).astype(np.float64), \
+        ink.sum(axis=0).astype(np.float64)
+
+
+def autocorrelation(profile):
+    """Return the normalised autocorrelation of profile for each lag."""
+    values = profile - profile.mean()
+    size = len(values)
+    spectrum = np.fft.rfft(values, 2 * size)
+    corr = np.fft.irfft(spectrum * np.conj(spectrum))[:size]
+    return corr / corr[0] if corr[0] > 0 else corr
+
+
+def peak_near(corr, lag, width=2):
+    """Return the position of the highest point of corr within width of
+    lag, refined to a fraction of a pixel by fitting a parabola."""
+    low = max(1, int(round(lag)) - width)
+    high = min(len(corr) - 1, int(round(lag)) + width + 1)
+    if low >= high:
+        return float(lag)
+    top = low + int(np.argmax(corr[low:high]))
+    if 0 < top < len(corr) - 1:
+        left, mid, right = corr[top - 1], corr[top], corr[top + 1]
+        bend = left - 2 * mid + right
+        if bend < 0:
+            return top + min(0.5, max(-0.5, 0.5 * (left - right) / bend))
+    return float(top)
+
+
+def estimate_pitch(profile, min_pitch=MIN_PITCH, max_pitch=MAX_PITCH):
+    """Return the repeat distance of profile, or None if there is no
+    clear one."""
+    max_pitch = min(max_pitch, len(profile) // 2)
+    if max_pitch <= min_pitch:
+        return None
+    corr = autocorrelation(profile)
+    best = min_pitch + int(np.argmax(corr[min_pitch:max_pitch]))
+    if corr[best] <= 0:
+        return None
+    # The strongest peak may be a multiple of the pitch; prefer the
+    # smallest fraction of it that is nearly as strong
+    for divisor in range(5, 1, -1):
+        lag = best / divisor
+        if lag < min_pitch:
+            continue
+        top = int(round(peak_near(corr, lag)))
+        if corr[top - 1] < corr[top] > corr[top + 1] and \
+           corr[top] > 0.7 * corr[best]:
+            best = lag
+            break
+    pitch = peak_near(corr, best)
+    # Measuring a peak several pitches out gives a finer estimate
+    multiple = min(10, int((len(profile) // 2) / pitch))
+    if multiple > 1:
+        pitch = peak_near(corr, pitch * multiple) / multiple
+    return pitch
+
+
+def estimate_offset(profile, pitch, step=0.5):
+    """Return the offset in [0, pitch) that puts the cell edges on the
+    least ink. Where a range of offsets all land in the gaps, return
+    the middle of the range."""
+    smooth = np.convolve(profile, np.ones(3) / 3, mode='same')
+    offsets = np.arange(0, pitch, step)
+    costs = np.empty(len(offsets))
+    for i, offset in enumerate(offsets):
+        edges = np.round(np.arange(offset, len(smooth), pitch)).astype(int)
+        costs[i] = smooth[edges[edges < len(smooth)]].mean()
+    low = costs <= costs.min() + 0.02 * (costs.max() - costs.min())
+    # Find the longest run of low offsets, wrapping round from the end
+    # of the pitch to the start
+    best_start, best_length = 0, 0
+    start, length = 0, 0
+    for i in range(2 * len(low)):
+        if low[i % len(low)]:
+            if length == 0:
+                start = i
+            length += 1
+            if length > best_length and length <= len(low):
+                best_start, best_length = start, length
+        else:
+            length = 0
+    middle = best_start + (best_length - 1) / 2
+    return float(round((middle * step) % pitch, 1))
+
+
+def page_pitch(page):
+    """Return the (x, y) pitch estimated from one page."""
+    rows, cols = ink_profiles(page)
+    return estimate_pitch(cols), estimate_pitch(rows)
+
+
+def file_pitch(page_file):
+    """Return the (x, y) pitch estimated from one page image file."""
+    return page_pitch(page_raster(page_file))
+
+
+def combine_pitches(pitches):
+    """Return the median (x, y) pitch of the per page estimates, or
+    None if no page gave an estimate."""
+    x_pitches = [x for x, _ in pitches if x is not None]
+    y_pitches = [y for _, y in pitches if y is not None]
+    if not x_pitches or not y_pitches:
+        return None
+    return float(np.median(x_pitches)), float(np.median(y_pitches))
+
+
+def page_attributes(page, x_pitch, y_pitch):
+    """Return the grid attributes of one page for the given pitch, in
+    the form stored in PREFIX.json."""
+    rows, cols = ink_profiles(page)
+    return {"grid_x_spacing": round(float(x_pitch), 2),
+            "grid_y_spacing": round(float(y_pitch), 2),
+            "x_offset": estimate_offset(cols, x_pitch),
+            "y_offset": estimate_offset(rows, y_pitch)}
@@ -0,0 +1,121 @@
+"""Split a PDF into page images with several pdfimages runs at once.
+
+pdfimages numbers the images it extracts from 000 in the order they
+appear, so the page range is first listed to count the images on each
+page. The range is then cut into shards of a few pages, and each shard
+is extracted to its own temporary directory. When a shard finishes,
+its images are renamed to the numbers a single pdfimages run over the
+whole range would have given them, so page keys are the same either
+way.
+"""
+
+
+import glob
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from util import run_command
+
+
+def parse_image_list(text, first, last):
+    """Return the number of images on each page from first to last,
+    given the output of pdfimages -list."""
+    counts = [0] * (1 + last - first)
+    for line in text.splitlines()[2:]:
+        fields = line.split()
+        if fields and fields[0].isdigit():
+            page = int(fields[0])
+            if first <= page <= last:
+                counts[page - first] += 1
+    return counts
+
+
+def list_images(file_name, first, last):
+    """Return the number of images on each page from first to last, or
+    None if the PDF could not be listed."""
+    try:
+        result = subprocess.run(["pdfimages", "-list", "-f", str(first),
+                                 "-l", str(last), file_name],
+                                check=True, capture_output=True, text=True)
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+    return parse_image_list(result.stdout, first, last)
+
+
+def plan_shards(counts, first, shard_pages):
+    """Cut the pages into shards of at most shard_pages pages. Return a
+    list of (first_page, last_page, first_image, num_images) for each
+    shard that has images."""
+    shards = []
+    image = 0
+    for start in range(0, len(counts), shard_pages):
+        num_images = sum(counts[start:start + shard_pages])
+        if num_images > 0:
+            last_page = first + min(start + shard_pages, len(counts)) - 1
+            shards.append((first + start, last_page, image, num_images))
+        image += num_images
+    return shards
+
+
+def shard_keys(prefix, shard):
+    """Return the page keys of the images in shard."""
+    _, _, first_image, num_images = shard
+    return [f"{prefix}-{image:03d}"
+            for image in range(first_image, first_image + num_images)]
+
+
+def image_files(temp_dir):
+    """Return the images pdfimages wrote to temp_dir in the order it
+    numbered them, which is not name order past p-999."""
+    images = glob.glob(f"{temp_dir}/p-*.png")
+    return sorted(images, key=lambda image: int(
+        os.path.splitext(os.path.basename(image))[0].split('-')[-1]))
+
+
+def extract_shard(file_name, shard, prefix, dest_dir):
+    """Extract the images of one shard and move them into dest_dir with
+    their whole document numbers. Return their page keys, or None if
+    pdfimages did not produce the expected images."""
+    first_page, last_page, _, num_images = shard
+    temp_dir = tempfile.mkdtemp(prefix=".shard", dir=dest_dir)
+    try:
+        run_command(f"pdfimages -f {first_page} -l {last_page} -png " +
+                    f"{file_name} {temp_dir}/p")
+        images = image_files(temp_dir)
+        if len(images) != num_images:
+            return None
+        keys = shard_keys(prefix, shard)
+        for image, key in zip(images, keys):
+            os.replace(image, f"{dest_dir}/{key}.png")
+        return keys
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+def split_pages(file_name, shards, prefix, dest_dir, workers, force):
+    """Extract the shards with up to workers pdfimages processes at once.
+    Yield the page keys of each shard as soon as it is done, so later
+    stages can start on them. Shards whose pages already exist are not
+    extracted again unless force is set. A shard that fails yields
+    nothing; the caller should check the number of pages at the end."""
+    pending = []
+    for shard in shards:
+        keys = shard_keys(prefix, shard)
+        if not force and all(os.path.exists(f"{dest_dir}/{key}.png")
+                             for key in keys):
+            yield from keys
+        else:
+            pending.append(shard)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(extract_shard, file_name, shard, prefix,
+                               dest_dir): shard for shard in pending}
+        for future in as_completed(futures):
+            keys = future.result()
+            if keys is None:
+                first_page, last_page, _, _ = futures[future]
+                print(f"Failed to split pages {first_page}-{last_page}")
+                continue
+            yield from keys
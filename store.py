@@ -0,0 +1,108 @@
+"""Keep a project's page artifacts in one SQLite file.
+
+By default each stage writes a file for each page to a directory of
+its own. With many thousands of pages, especially on network storage,
+finding and reading all these small files takes much of the time. If
+jobs.store is set to "sqlite" in the config, the templates, text and
+merged pages are kept in gridlock.sqlite in the project directory
+instead, along with:
+
+* attrs: the grid attributes of each page, so a page's attributes are
+  looked up without reading the whole PREFIX.json
+* merge_results: the details of each page's last merge
+* the manifest's record of each stage's outputs for each page
+
+Each artifact is stored by kind and page key, with the kind the name
+of the directory it would otherwise be written to, so lookups by page
+are indexed and gridlock export can write the directories out for
+editing by hand. Page images stay in their directories.
+
+Pool workers each open their own connection. Writing several pages at
+once with put_many takes one transaction, so a worker holds the file
+locked only briefly.
+"""
+
+
+import json
+import sqlite3
+import time
+
+
+STORE_FILE = "gridlock.sqlite"
+
+# Kinds of artifact that are not files in a stage directory
+ATTRS = "attrs"
+MERGE_RESULTS = "merge_results"
+
+
+class ArtifactStore():
+    """The artifacts of a project, stored in an SQLite file."""
+    def __init__(self, file_name=STORE_FILE):
+        self.db = sqlite3.connect(file_name, timeout=60)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS artifacts ("
+                            "kind TEXT, key TEXT, content TEXT, "
+                            "updated REAL, PRIMARY KEY (kind, key)) "
+                            "WITHOUT ROWID")
+
+    def get(self, kind, key):
+        """Return the content of the artifact, or None if there is none."""
+        row = self.db.execute("SELECT content FROM artifacts "
+                              "WHERE kind = ? AND key = ?",
+                              (kind, key)).fetchone()
+        return None if row is None else row[0]
+
+    def put(self, kind, key, content):
+        """Store the content of the artifact, replacing any before."""
+        self.put_many(kind, {key: content})
+
+    def put_many(self, kind, contents):
+        """Store a dict of key to content of artifacts of one kind in a
+        single transaction."""
+        now = time.time()
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO artifacts "
+                                "VALUES (?, ?, ?, ?)",
+                                [(kind, key, content, now)
+                                 for key, content in contents.items()])
+
+    def delete(self, kind, key):
+        """Remove the artifact, if there is one."""
+        with self.db:
+            self.db.execute("DELETE FROM artifacts "
+                            "WHERE kind = ? AND key = ?", (kind, key))
+
+    def keys(self, kind, prefix):
+        """Return the sorted keys of the artifacts of the kind for pages
+        of the document prefix."""
+        # A range on the primary key rather than LIKE, so the index is
+        # used
+        return [row[0] for row in self.db.execute(
+            "SELECT key FROM artifacts WHERE kind = ? AND key > ? "
+            "AND key < ? ORDER BY key", (kind, f"{prefix}-", f"{prefix}."))]
+
+    def items(self, kind, prefix):
+        """Yield (key, content) of the artifacts of the kind for pages of
+        the document prefix, in key order."""
+        yield from self.db.execute(
+            "SELECT key, content FROM artifacts WHERE kind = ? AND key > ? "
+            "AND key < ? ORDER BY key", (kind, f"{prefix}-", f"{prefix}."))
+
+    def kinds(self):
+        """Return the kinds of artifact stored."""
+        return [row[0] for row in self.db.execute(
+            "SELECT DISTINCT kind FROM artifacts ORDER BY kind")]
+
+    def get_json(self, kind, key):
+        """Return the artifact decoded from JSON, or None."""
+        content = self.get(kind, key)
+        return None if content is None else json.loads(content)
+
+    def put_json_many(self, kind, values):
+        """Store a dict of key to value of artifacts as JSON."""
+        self.put_many(kind, {key: json.dumps(value, sort_keys=True)
+                             for key, value in values.items()})
+
+    def close(self):
+        """Close the store file."""
+        self.db.close()
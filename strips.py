@@ -0,0 +1,112 @@
+"""Cut a page into horizontal strips of text rows for OCR.
+
+The rows of the page grid that contain characters are grouped into
+strips of a few rows each. Each strip is sent to the LLM separately,
+and the text that comes back is placed on the rows it came from, so
+the page text lines up row for row with the template. Blank rows are
+never sent.
+"""
+
+
+import asyncio
+import io
+import numpy as np
+from PIL import Image
+from grid import cell_edges, cell_variances
+
+
+STRIP_PROMPT = """
+**Strip Instructions:** The image is a horizontal strip cut from a
+page of source code. It contains exactly {rows} lines of text. Output
+exactly {rows} lines, one for each line of text in the image, in order
+from top to bottom.
+"""
+
+
+def occupied_rows(variances, variance_threshold):
+    """Return a list of booleans, True for each grid row that has at
+    least one character cell."""
+    return [bool(row.any()) for row in variances > variance_threshold]
+
+
+def find_strips(occupied, rows_per_strip, max_gap=1):
+    """Group the occupied rows into strips of at most rows_per_strip
+    occupied rows. A run of more than max_gap blank rows also ends a
+    strip so large blank areas are not sent. Return a list of strips,
+    each a list of the occupied row indexes in it."""
+    strips = []
+    strip = []
+    gap = 0
+    for row, is_occupied in enumerate(occupied):
+        if not is_occupied:
+            gap += 1
+            continue
+        if strip and (len(strip) == rows_per_strip or gap > max_gap):
+            strips.append(strip)
+            strip = []
+        strip.append(row)
+        gap = 0
+    if strip:
+        strips.append(strip)
+    return strips
+
+
+def strip_images(page, pa, strips):
+    """Return the PNG bytes of the area of the 2D uint8 array page
+    covering each strip."""
+    height = page.shape[0]
+    y_edges = cell_edges(pa["y_offset"], pa["grid_y_spacing"], height)
+    images = []
+    for strip in strips:
+        top = max(0, y_edges[strip[0]])
+        bottom = min(height, y_edges[strip[-1] + 1])
+        buffer = io.BytesIO()
+        Image.fromarray(np.asarray(page[top:bottom])).save(buffer,
+                                                           format="PNG")
+        images.append(buffer.getvalue())
+    return images
+
+
+def stitch(strips, texts):
+    """Put the text from each strip back on the rows it came from and
+    return the page text. Rows run from the first to the last occupied
+    row, like the template. If a strip came back with the wrong number
+    of lines, its lines are placed in order from its first row, as long
+    as they fit on its rows. Lines never go on the rows of another
+    strip: if there are too many the strip's rows are left blank, so
+    they fail to merge rather than losing text silently."""
+    if not strips:
+        return ""
+    first_row = strips[0][0]
+    lines = [""] * (strips[-1][-1] - first_row + 1)
+    for strip, text in zip(strips, texts):
+        strip_lines = [line for line in text.splitlines() if line.strip()]
+        if len(strip_lines) == len(strip):
+            rows = strip
+        elif len(strip_lines) <= strip[-1] - strip[0] + 1:
+            rows = range(strip[0], strip[0] + len(strip_lines))
+        else:
+            continue
+        for row, line in zip(rows, strip_lines):
+            lines[row - first_row] = line
+    return "\n".join(lines)
+
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+async def ocr_strips(engine, page, pa, variance_threshold, rows_per_strip,
+                     prompt):
+    """OCR the page a strip at a time, with all strips of the page in
+    flight at once. page is the page's grey levels as a 2D uint8
+    array. Return the page text and total usage."""
+    variances = cell_variances(page, pa)
+    strips = find_strips(occupied_rows(variances, variance_threshold),
+                         rows_per_strip)
+    images = strip_images(page, pa, strips)
+    results = await asyncio.gather(*[
+        engine.ocr(image, prompt + STRIP_PROMPT.format(rows=len(strip)))
+        for strip, image in zip(strips, images)])
+    usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+    for _, strip_usage in results:
+        for name in usage:
+            usage[name] += strip_usage[name]
+    return stitch(strips, [text for text, _ in results]), usage
@@ -0,0 +1,196 @@
+"""Make synthetic line printer pages, for benchmarks.
+
+A page is a listing of random code-like text laid out in fixed columns,
+printed at 10 characters and 6 lines an inch in a simple stroke
+font, with optional skew and speckle noise. With each page comes what
+it was made from: its text, the grid of its characters and the
+template gridlock templates should find, so each step can be checked
+as well as timed.
+"""
+
+
+import random
+import numpy as np
+from PIL import Image
+from grid import cell_edges
+
+
+CHARS_PER_INCH = 10
+LINES_PER_INCH = 6
+PAPER = 235
+INK = 20
+
+# The part of its cell a character fills
+GLYPH_WIDTH = 0.6
+GLYPH_HEIGHT = 0.6
+
+# The strokes characters are made of, as (x1, y1, x2, y2) within the
+# glyph box, as on a sixteen segment display
+STROKES = [
+    (0, 0, 1, 0), (0, 0.5, 1, 0.5), (0, 1, 1, 1),
+    (0, 0, 0, 0.5), (0, 0.5, 0, 1), (1, 0, 1, 0.5), (1, 0.5, 1, 1),
+    (0.5, 0, 0.5, 0.5), (0.5, 0.5, 0.5, 1), (0, 0, 1, 1), (1, 0, 0, 1),
+]
+
+CHARSET = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789=+-*/(),.'$"
+
+# Column layouts, as (first character, width) of each column
+LAYOUTS = {
+    # Assembler: label, operation, operands and comment, sequence number
+    "listing": [(0, 8), (10, 6), (17, 50), (72, 8)],
+    # One wide column of code, as in a FORTRAN listing
+    "code": [(6, 66)],
+    # Two columns side by side
+    "columns": [(0, 36), (44, 36)],
+}
+
+# Chance that a line, or a column of a line, is blank
+BLANK_LINE = 0.05
+BLANK_COLUMN = 0.1
+
+
+class SyntheticPage():
+    """A synthetic page image with the text and grid it was made from."""
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(self, image, lines, attrs, origin, skew):
+        self.image = image
+        self.lines = lines
+        self.attrs = attrs
+        # The (column, row) of the grid cell the first line starts in
+        self.origin = origin
+        self.skew = skew
+
+    def template(self):
+        """Return the template of the whole page grid, as made by
+        gridlock templates before blank lines are trimmed."""
+        width, height = self.image.size
+        num_rows = len(cell_edges(self.attrs["y_offset"],
+                                  self.attrs["grid_y_spacing"], height)) - 1
+        num_cols = len(cell_edges(self.attrs["x_offset"],
+                                  self.attrs["grid_x_spacing"], width)) - 1
+        column, row = self.origin
+        template = [' ' * num_cols] * num_rows
+        for index, line in enumerate(self.lines):
+            cells = ''.join(' ' if char == ' ' else '#' for char in line)
+            template[row + index] = \
+                (' ' * column + cells).ljust(num_cols)[:num_cols]
+        return template
+
+    def ocr_text(self):
+        """Return the text as an OCR model would give it, without the
+        blank lines above and below."""
+        lines = list(self.lines)
+        while lines and not lines[0].strip():
+            lines.pop(0)
+        while lines and not lines[-1].strip():
+            lines.pop()
+        return "\n".join(lines)
+
+
+def glyph_strokes(char):
+    """Return the strokes of char, picked from its code so every
+    character has its own shape."""
+    rng = random.Random(ord(char))
+    return rng.sample(STROKES, rng.randint(3, 6))
+
+
+def glyph_image(char, width, height):
+    """Return a height x width bool array of the strokes of char."""
+    glyph = np.zeros((height, width), dtype=bool)
+    thickness = max(1, min(width, height) // 4)
+    steps = 2 * max(width, height)
+    for x1, y1, x2, y2 in glyph_strokes(char):
+        for step in range(steps + 1):
+            t = step / steps
+            x = int(round((x1 + (x2 - x1) * t) * (width - thickness)))
+            y = int(round((y1 + (y2 - y1) * t) * (height - thickness)))
+            glyph[y:y + thickness, x:x + thickness] = True
+    return glyph
+
+
+def random_field(rng, width):
+    """Return random words filling half to all of width characters."""
+    target = rng.randint(width // 2, width)
+    words = []
+    length = -1
+    while length < target:
+        word = "".join(rng.choice(CHARSET)
+                       for _ in range(rng.randint(1, 8)))
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:width].rstrip()
+
+
+def random_text(rng, num_lines, layout):
+    """Return num_lines lines of random text in the columns of layout."""
+    width = max(start + size for start, size in layout)
+    lines = []
+    for _ in range(num_lines):
+        if rng.random() < BLANK_LINE:
+            lines.append("")
+            continue
+        line = [' '] * width
+        for start, size in layout:
+            if rng.random() < BLANK_COLUMN:
+                continue
+            field = random_field(rng, size)
+            line[start:start + len(field)] = field
+        lines.append("".join(line).rstrip())
+    return lines
+
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+# pylint: disable=too-many-locals
+def render_page(lines, dpi=300, skew=0.0, noise=0.0, margin=0.5,
+                rng=None):
+    """Print lines on a page at dpi, with margin inches of paper round
+    the text, and return a SyntheticPage. The page is turned skew
+    degrees anticlockwise, and noise is the fraction of pixels changed
+    to a random grey."""
+    rng = rng or random.Random(0)
+    x_pitch = dpi / CHARS_PER_INCH
+    y_pitch = dpi / LINES_PER_INCH
+    width_chars = max([80] + [len(line) for line in lines])
+    margin_px = margin * dpi
+    width = int(round(2 * margin_px + width_chars * x_pitch))
+    height = int(round(2 * margin_px + len(lines) * y_pitch))
+    page = np.full((height, width), PAPER, dtype=np.uint8)
+    glyph_width = max(1, int(round(x_pitch * GLYPH_WIDTH)))
+    glyph_height = max(1, int(round(y_pitch * GLYPH_HEIGHT)))
+    glyphs = {}
+    for row, line in enumerate(lines):
+        top = int(round(margin_px + row * y_pitch +
+                        (y_pitch - glyph_height) / 2))
+        for column, char in enumerate(line):
+            if char == ' ':
+                continue
+            if char not in glyphs:
+                glyphs[char] = glyph_image(char, glyph_width, glyph_height)
+            left = int(round(margin_px + column * x_pitch +
+                             (x_pitch - glyph_width) / 2))
+            cell = page[top:top + glyph_height, left:left + glyph_width]
+            cell[glyphs[char]] = INK
+    if noise > 0:
+        noise_rng = np.random.default_rng(rng.randrange(2 ** 32))
+        speckles = noise_rng.random(page.shape) < noise
+        page[speckles] = noise_rng.integers(0, 256, int(speckles.sum()))
+    image = Image.fromarray(page)
+    if skew:
+        image = image.rotate(skew, resample=Image.Resampling.BICUBIC,
+                             fillcolor=PAPER)
+    x_offset = margin_px % x_pitch
+    y_offset = margin_px % y_pitch
+    attrs = {"grid_x_spacing": x_pitch, "grid_y_spacing": y_pitch,
+             "x_offset": x_offset, "y_offset": y_offset}
+    origin = (int(round((margin_px - x_offset) / x_pitch)),
+              int(round((margin_px - y_offset) / y_pitch)))
+    return SyntheticPage(image, lines, attrs, origin, skew)
+
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+def make_page(seed, dpi=300, num_lines=60, layout="listing", skew=0.0,
+              noise=0.0):
+    """Return a SyntheticPage of random text, the same for each seed."""
+    rng = random.Random(seed)
+    lines = random_text(rng, num_lines, LAYOUTS[layout])
+    return render_page(lines, dpi, skew, noise, rng=rng)
@@ -0,0 +1,39 @@
+"""Test align.py"""
+
+from align import align_rows
+
+# flake8: noqa
+# pylint: disable=invalid-name,missing-function-docstring
+
+
+def test_align_rows_equal():
+    assert align_rows([3, 0, 5], [3, 0, 5]) == [(0, 0), (1, 1), (2, 2)]
+
+
+def test_align_rows_dropped_line():
+    assert align_rows([3, 7, 0, 5], [3, 0, 5]) == \
+        [(0, 0), (1, None), (2, 1), (3, 2)]
+
+
+def test_align_rows_added_blank_line():
+    assert align_rows([3, 7, 5], [0, 3, 7, 5]) == \
+        [(None, 0), (0, 1), (1, 2), (2, 3)]
+
+
+def test_align_rows_mismatch():
+    # A row with a misread character stays paired with its template row
+    assert align_rows([3, 7, 5], [3, 8, 5]) == [(0, 0), (1, 1), (2, 2)]
+
+
+def test_align_rows_empty():
+    assert align_rows([], []) == []
+    assert align_rows([2], []) == [(0, None)]
+    assert align_rows([], [0, 4]) == [(None, 0), (None, 1)]
+
+
+def test_align_rows_band():
+    template = [4, 6] * 20
+    text = template[:30] + [0] * 3 + template[30:]
+    pairs = align_rows(template, text, band=1)
+    assert [pair for pair in pairs if None in pair] == \
+        [(None, 30), (None, 31), (None, 32)]
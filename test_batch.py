@@ -0,0 +1,86 @@
+"""Test batch.py"""
+
+import pytest
+from batch import BatchScheduler, format_status
+from pipeline import STAGES
+
+# flake8: noqa
+# pylint: disable=invalid-name,missing-function-docstring
+
+
+def make_scheduler(policy, workers=3, **limits):
+    scheduler = BatchScheduler(workers, 2, policy=policy, **limits)
+    scheduler.add_project("A", priority=1, expected_pages=4)
+    scheduler.add_project("B", priority=2, expected_pages=4)
+    return scheduler
+
+
+def take_all(scheduler, resource='cpu'):
+    # Both projects keep asking until no slot is left
+    taken = []
+    for _ in range(10):
+        for name in ("A", "B"):
+            if scheduler.try_acquire(name, resource):
+                taken.append(name)
+    return taken
+
+
+def test_fair_share():
+    scheduler = make_scheduler('fair')
+    assert sorted(take_all(scheduler)) == ["A", "A", "B"]
+    # Both wait for a slot
+    assert not scheduler.try_acquire("A", 'cpu')
+    assert not scheduler.try_acquire("B", 'cpu')
+    # A freed slot goes to the project furthest below its share
+    scheduler.release("A", 'cpu')
+    assert not scheduler.try_acquire("A", 'cpu')
+    assert scheduler.try_acquire("B", 'cpu')
+
+
+def test_priority():
+    scheduler = make_scheduler('priority')
+    assert sorted(take_all(scheduler)) == ["A", "A", "B"]
+    assert not scheduler.try_acquire("A", 'cpu')
+    assert not scheduler.try_acquire("B", 'cpu')
+    scheduler.release("A", 'cpu')
+    assert not scheduler.try_acquire("A", 'cpu')
+    assert scheduler.try_acquire("B", 'cpu')
+    scheduler.finish("B", True)
+    # Slots a project held when it finished are given back
+    assert scheduler.status()["in_use"]["cpu"] == 1
+    assert scheduler.try_acquire("A", 'cpu')
+
+
+@pytest.mark.parametrize("policy", ['fair', 'priority'])
+def test_idle_slots_shared(policy):
+    scheduler = make_scheduler(policy, workers=8)
+    # B holding a slot does not keep A from the idle ones
+    assert scheduler.try_acquire("B", 'cpu')
+    assert all(scheduler.try_acquire("A", 'cpu') for _ in range(7))
+    assert not scheduler.try_acquire("A", 'cpu')
+
+
+def test_ocr_budget():
+    scheduler = make_scheduler('fair', requests_per_minute=60,
+                               tokens_per_minute=6000)
+    assert scheduler.try_acquire("A", 'ocr', 4000)
+    # The second request would go over the tokens a minute
+    assert not scheduler.try_acquire("A", 'ocr', 4000)
+    # until the first turns out to need fewer than estimated
+    scheduler.release("A", 'ocr', 4000, 1000)
+    assert scheduler.try_acquire("A", 'ocr', 4000)
+    status = scheduler.status()
+    assert status["projects"]["A"]["tokens"] == 1000
+    assert status["in_use"]["ocr"] == 1
+
+
+def test_format_status():
+    scheduler = make_scheduler('fair')
+    scheduler.report("A", {stage: 4 for stage in STAGES})
+    scheduler.finish("A", True)
+    scheduler.report("B", {'split': 4, 'crop': 1})
+    lines = format_status(scheduler.status(), STAGES)
+    assert lines[2].startswith("A ") and lines[2].endswith("done")
+    assert "4/4" in lines[2]
+    assert lines[3].endswith("running") and "0/4" in lines[3]
+    assert lines[-1].startswith("total 4 pages merged")
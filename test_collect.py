@@ -0,0 +1,56 @@
+"""Test collect.py"""
+
+import json
+import numpy as np
+from collect import page_number, collect_text, write_index, read_page_at
+from collect import template_origin, page_layout, StructuredWriter
+from synthetic import make_page, INK
+
+# flake8: noqa
+# pylint: disable=invalid-name,missing-function-docstring
+
+
+def test_page_number():
+    keys = ["A-10", "A-9", "A-100", "A-009x"]
+    assert sorted(keys, key=page_number) == ["A-9", "A-10", "A-100", "A-009x"]
+
+
+def test_collect_text(tmp_path):
+    pages = {"A-1": "one\ntwo\n", "A-3": "three"}
+    output_file = str(tmp_path / "A.txt")
+    index = collect_text(["A-1", "A-2", "A-3"], pages.get, output_file)
+    with open(output_file, 'r', encoding='utf-8') as f:
+        assert f.read() == "one\ntwo\n[A-2 not merged yet]\nthree\n"
+    assert [(e["first_line"], e["lines"], e["merged"]) for e in index] == \
+        [(1, 2, True), (3, 1, False), (4, 1, True)]
+    assert read_page_at(output_file, index[2]) == "three\n"
+    write_index(str(tmp_path / "A.index.json"), "A.txt", index)
+    with open(tmp_path / "A.index.json", 'r', encoding='utf-8') as f:
+        assert json.load(f)["pages"][1]["offset"] == 8
+
+
+def test_template_origin():
+    raw = make_page(1, dpi=100, num_lines=20).template()
+    # Blank rows above removed and two columns of left margin kept
+    template = ["  " + line[3:] for line in raw[5:]]
+    assert raw[5].strip()
+    assert template_origin(template, raw) == (5, 1)
+    assert template_origin([], raw) == (0, 0)
+
+
+def test_page_layout(tmp_path):
+    page = make_page(2, dpi=100, num_lines=10)
+    column, row = page.origin
+    text = "\n".join(page.lines)
+    layout = page_layout("A-000", text, (row, column), page.attrs,
+                         page.image.size, "pages/A-000.png")
+    pixels = np.asarray(page.image)
+    first = layout["lines"][0]
+    assert first["text"] == page.lines[0].rstrip()
+    for char, _, _, x0, y0, x1, y1 in first["chars"]:
+        assert (pixels[y0:y1, x0:x1] == INK).any(), char
+    writer = StructuredWriter(str(tmp_path / "A.hocr"), 'hocr', "A")
+    writer.write(layout)
+    writer.close()
+    hocr = (tmp_path / "A.hocr").read_text()
+    assert 'class="ocr_page"' in hocr and "x_bboxes" in hocr
@@ -1,7 +1,10 @@
 """Test columns.py"""
 
+import numpy as np
 import pytest
 from columns import is_pole_whitespace, find_columns, get_column, paste_columns
+from columns import column_extents
+from occupancy import Occupancy
 
 # flake8: noqa
 # pylint: disable=invalid-name,missing-function-docstring
@@ -64,3 +67,20 @@ def test_paste_columns():
         cols.append(get_column(grid_no_short, extent))
     pasted = paste_columns(cols)
     assert grid_no_short == pasted
+
+
+@pytest.mark.parametrize("poles, margin, extents",
+                         [["  a  b ", 2, [[0, 3], [3, 6]]],
+                          ["  a  b ", 3, [[0, 6]]],
+                          ["a b", 1, [[0, 1], [1, 2]]],
+                          ["ab    ", 2, [[0, 5]]],
+                          ["     ", 2, []],
+                          ["a  b", 0, [[0, 3]]],
+                          ])
+def test_column_extents(poles, margin, extents):
+    occupied = np.array([c != ' ' for c in poles])
+    assert column_extents(occupied, margin) == extents
+
+
+def test_find_columns_occupancy():
+    assert find_columns(Occupancy.from_lines(grid1)) == find_columns(grid1)
@@ -0,0 +1,53 @@
+"""Test grid.py"""
+
+import pytest
+from PIL import Image
+from grid import cell_edges, numpy_template, pil_template, draw_grid
+
+# flake8: noqa
+# pylint: disable=invalid-name,missing-function-docstring
+
+
+def make_page(width, height, mode='RGB'):
+    """Make a noisy page with some dark blocks on it."""
+    img = Image.effect_noise((width, height), 40).convert(mode)
+    for i in range(0, width, 23):
+        img.paste((0,) * len(mode), (i, i % height, i + 9, i % height + 14))
+    return img
+
+
+def test_cell_edges():
+    assert cell_edges(3, 15, 50) == [3, 18, 33, 48]
+    assert cell_edges(0, 10.4, 32) == [0, 10, 21, 31]
+    assert cell_edges(0, 10, 5) == [0]
+
+
+@pytest.mark.parametrize("pa",
+                         [{"x_offset": 3.0, "y_offset": 11.0,
+                           "grid_x_spacing": 15.0, "grid_y_spacing": 25.0},
+                          {"x_offset": 2.5, "y_offset": 0.0,
+                           "grid_x_spacing": 14.7, "grid_y_spacing": 24.3},
+                          {"x_offset": 0.0, "y_offset": 500.0,
+                           "grid_x_spacing": 15.0, "grid_y_spacing": 25.0},
+                          ])
+@pytest.mark.parametrize("mode", ['RGB', 'L'])
+@pytest.mark.parametrize("threshold", [100, 1500, 3000])
+def test_engines_agree(pa, mode, threshold):
+    img = make_page(400, 300, mode)
+    assert numpy_template(img, pa, threshold) == \
+        pil_template(img, pa, threshold)
+
+
+def test_draw_grid():
+    img = Image.new('RGB', (100, 60), (255, 255, 255))
+    pa = {"x_offset": 0.0, "y_offset": 0.0,
+          "grid_x_spacing": 10.0, "grid_y_spacing": 20.0}
+    template = ["#" * 10, " " * 10, "# "]
+    grid = draw_grid(img, pa, template)
+    assert grid.size == img.size
+    assert grid.getpixel((0, 0)) == (255, 0, 0)
+    assert grid.getpixel((5, 5)) == (255, 255, 255)
+    assert grid.getpixel((5, 25)) == (128, 153, 128)
+    assert grid.getpixel((15, 45)) == (128, 153, 128)
+    preview = draw_grid(img, pa, template, scale=0.5)
+    assert preview.size == (50, 30)
@@ -0,0 +1,80 @@
+"""Test jobqueue.py"""
+
+import multiprocessing
+import os
+import yaml
+from jobqueue import MAX_ATTEMPTS, JobQueue, start_workers
+from util import page_task, write_file_atomic
+
+# flake8: noqa
+# pylint: disable=invalid-name,missing-function-docstring
+
+
+def write_page(key, text):
+    # The first worker to run A-002 dies, so another must take it over
+    if key == "A-002" and not os.path.exists("died"):
+        write_file_atomic("died", "")
+        os._exit(1)
+    write_file_atomic(f"out/{key}.txt", f"{text} {key}\n")
+
+
+def test_claim_and_finish(tmp_path):
+    queue = JobQueue(str(tmp_path / "queue"))
+    names = queue.submit("crop", "/usr/lib/gridlock_crop", "crop_one_page",
+                         ["A-000", "A-001"], (False,))
+    assert names == ["crop.A-000.json", "crop.A-001.json"]
+    first = queue.claim("host.1")
+    second = queue.claim("host.2")
+    assert (first.name, second.name) == tuple(names)
+    assert first.spec["args"] == [False] and first.spec["attempts"] == 1
+    assert queue.claim("host.3") is None
+    queue.finish(first, True, 1.5)
+    assert not queue.idle()
+    queue.finish(second, False, 0.5)
+    assert queue.idle()
+    results = queue.results(names)
+    assert results[names[0]]["ok"] and results[names[0]]["worker"] == "host.1"
+    assert not results[names[1]]["ok"]
+
+
+def test_reclaim(tmp_path):
+    queue = JobQueue(str(tmp_path / "queue"), lease=60)
+    names = queue.submit("crop", "gridlock_crop", "crop_one_page",
+                         ["A-000"], ())
+    job = queue.claim("host.1")
+    assert queue.heartbeat(job)
+    assert queue.reclaim() == 0
+    for attempt in range(2, MAX_ATTEMPTS + 2):
+        # The worker stops touching its claim
+        os.utime(job.path, (0, 0))
+        assert queue.reclaim() == 1
+        assert not queue.heartbeat(job)
+        job = queue.claim(f"host.{attempt}")
+        if attempt > MAX_ATTEMPTS:
+            assert job is None
+        else:
+            assert job.spec["attempts"] == attempt
+    result = queue.results(names)[names[0]]
+    assert not result["ok"] and "lost" in result["error"]
+    assert queue.idle()
+
+
+def test_workers(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    config = {"jobs": {"executor": "queue", "workers": 2, "lease": 1,
+                       "metrics": False}}
+    (tmp_path / "config.yaml").write_text(yaml.safe_dump(config))
+    (tmp_path / "out").mkdir()
+    keys = [f"A-00{n}" for n in range(6)]
+    # A worker that might be on another host
+    stop = multiprocessing.Event()
+    helper = start_workers(JobQueue(lease=1), 1, stop)
+    assert page_task(keys, write_page, ("page",)) == 0
+    stop.set()
+    helper[0].join()
+    for key in keys:
+        assert (tmp_path / "out" / f"{key}.txt").read_text() == \
+            f"page {key}\n"
+    assert (tmp_path / "died").exists()
+    queue = JobQueue()
+    assert queue.idle() and not queue.names("done")
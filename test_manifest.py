@@ -0,0 +1,120 @@
+"""Test manifest.py"""
+
+import json
+import os
+from manifest import Manifest, CURRENT, STALE, EDITED, MISSING
+from manifest import needs_build, record_output, remove_stale, record_new
+from manifest import output_keys
+
+# flake8: noqa
+# pylint: disable=invalid-name,missing-function-docstring
+
+
+CONFIG = """split:
+  prefix: "A"
+grid:
+  variance_threshold: 3000
+"""
+
+
+def make_project(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "config.yaml").write_text(CONFIG)
+    for name in ("templates", "text", "merged"):
+        (tmp_path / name).mkdir()
+    for key in ("A-001", "A-002"):
+        (tmp_path / "templates" / f"{key}.txt").write_text(f"{key} XX\n")
+        (tmp_path / "text" / f"{key}.txt").write_text(f"{key} AB\n")
+        (tmp_path / "merged" / f"{key}.txt").write_text(f"{key} AB\n")
+
+
+def touch(path, text):
+    """Change a file, moving its modification time on so the change is
+    seen even on file systems with coarse timestamps."""
+    mtime = os.stat(path).st_mtime_ns
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.utime(path, ns=(mtime + 10**9, mtime + 10**9))
+
+
+def test_status(tmp_path, monkeypatch):
+    make_project(tmp_path, monkeypatch)
+    config = {"grid": {"variance_threshold": 3000}}
+    manifest = Manifest()
+    assert manifest.status('merge', 'A-003', config) == MISSING
+    # Existing output with no entry is taken as current
+    assert manifest.status('merge', 'A-001', config) == CURRENT
+    touch("text/A-001.txt", "A-001 AC\n")
+    assert manifest.status('merge', 'A-001', config) == STALE
+    manifest.record('merge', 'A-001', config)
+    assert manifest.status('merge', 'A-001', config) == CURRENT
+    touch("merged/A-001.txt", "A-001 fixed by hand\n")
+    assert manifest.status('merge', 'A-001', config) == EDITED
+    manifest.close()
+
+
+def test_status_config_and_attrs(tmp_path, monkeypatch):
+    make_project(tmp_path, monkeypatch)
+    attrs = {"A-001": {"grid_x_spacing": 15.0, "page_file": "x"}}
+    (tmp_path / "A.json").write_text(json.dumps(attrs))
+    config = {"grid": {"variance_threshold": 3000}}
+    manifest = Manifest()
+    manifest.record('templates', 'A-001', config)
+    assert manifest.status('templates', 'A-001', config) == CURRENT
+    # Settings the stage does not use make no difference
+    other = dict(config, text={"gemini_model": "other"})
+    assert manifest.status('templates', 'A-001', other) == CURRENT
+    changed = {"grid": {"variance_threshold": 2000}}
+    assert manifest.status('templates', 'A-001', changed) == STALE
+    attrs["A-001"]["grid_x_spacing"] = 16.0
+    touch("A.json", json.dumps(attrs))
+    assert manifest.status('templates', 'A-001', config) == STALE
+    manifest.close()
+
+
+def test_file_digest_cached(tmp_path, monkeypatch):
+    make_project(tmp_path, monkeypatch)
+    manifest = Manifest()
+    digest = manifest.file_digest("text/A-001.txt")
+    assert manifest.file_digest("text/A-001.txt") == digest
+    assert manifest.file_digest("text/A-002.txt") != digest
+    assert manifest.file_digest("text/A-003.txt") is None
+    manifest.close()
+
+
+def test_needs_build(tmp_path, monkeypatch, capsys):
+    make_project(tmp_path, monkeypatch)
+    assert output_keys('merge', 'A') == ['A-001', 'A-002']
+    assert not needs_build('merge', 'A-001')
+    assert not needs_build('merge', 'A-002')
+    assert needs_build('merge', 'A-001', force=True)
+    assert needs_build('merge', 'A-003')
+    # A stale output is deleted
+    touch("templates/A-001.txt", "A-001 XY\n")
+    assert needs_build('merge', 'A-001')
+    assert not os.path.exists("merged/A-001.txt")
+    (tmp_path / "merged" / "A-001.txt").write_text("A-001 AB\n")
+    record_output('merge', 'A-001')
+    assert not needs_build('merge', 'A-001')
+    # An output edited by hand is kept even when its inputs change
+    touch("merged/A-002.txt", "A-002 fixed by hand\n")
+    touch("text/A-002.txt", "A-002 AC\n")
+    assert not needs_build('merge', 'A-002')
+    assert os.path.exists("merged/A-002.txt")
+    assert "edited by hand" in capsys.readouterr().out
+
+
+def test_remove_stale_record_new(tmp_path, monkeypatch):
+    make_project(tmp_path, monkeypatch)
+    remove_stale('merge', 'A')
+    touch("text/A-002.txt", "A-002 AC\n")
+    remove_stale('merge', 'A')
+    assert output_keys('merge', 'A') == ['A-001']
+    (tmp_path / "merged" / "A-002.txt").write_text("A-002 AC\n")
+    record_new('merge', 'A')
+    assert not needs_build('merge', 'A-002')
+    # Forced, all outputs are forgotten so they are recorded again
+    remove_stale('merge', 'A', force=True)
+    touch("merged/A-001.txt", "A-001 AB made again\n")
+    record_new('merge', 'A')
+    assert not needs_build('merge', 'A-001')
@@ -1,7 +1,7 @@
 """Tests merge.py"""
 
 import pytest
-from merge import merge
+from merge import merge, merge_with_details, merge_batch
 
 # flake8: noqa
 # pylint: disable=invalid-name,missing-function-docstring
@@ -53,3 +53,89 @@ def test_merge_page_shifted():
     result = ''.join(report)
     assert result == expected
     assert status
+
+
+def test_merge_aligned_dropped_blank_line():
+    template = ["## ###\n", "\n", "  ####\n", "#\n"]
+    text     = ["ab cde\n", "  fghi\n", "j\n"]
+    status, report = merge(template, text, engine='rows', by_row_only=True)
+    assert not status
+    status, report = merge(template, text, engine='align')
+    assert status
+    assert report == ["ab cde\n", "\n", "  fghi\n", "j\n"]
+
+
+def test_merge_aligned_extra_line():
+    # A line with no template row may be made up, so the page fails
+    template = ["## ###\n", "  ####\n"]
+    text     = ["ab cde\n", "x = 1\n", "  fghi\n"]
+    status, report, details = merge_with_details(
+        template, text, by_row_only=True, engine='align')
+    assert not status
+    assert report == ["ab cde\n", "  fghi\n"]
+    assert details == {"strategy": None, "mismatched_rows": 1,
+                       "unaligned_rows": 1}
+    # unless it is blank
+    status, _ = merge(template, ["ab cde\n", "\n", "  fghi\n"],
+                      engine='align', by_row_only=True)
+    assert status
+
+
+def test_merge_aligned_missing_text():
+    # A dropped line of text fails the page, but only on that row
+    template = ["## ###\n", "  ####\n", "#\n"]
+    text     = ["ab cde\n", "j\n"]
+    status, _, details = merge_with_details(template, text,
+                                            by_row_only=True, engine='align')
+    assert not status
+    assert details["mismatched_rows"] == 1
+
+
+def test_merge_aligned_columns_fallback():
+    # Rows that cannot be aligned still fall back to merging by columns
+    template = ["                      ##     ###       #### ###\n",
+                "  ### ######## ## ##        ####   ##  #### ###\n",
+                "                      ##   #####       #### ###\n",
+                "  #### ### ####               ###      #### ###\n"]
+    text     = ["  AND CONTINUE AT 96  97      E51      U126 015\n",
+                "                      96    30H0   96  U126 016\n",
+                "  FIND ITS DSCN            10X20       U126 019\n",
+                "                             J10       U126 020\n"]
+    status, report = merge(template, text, engine='align')
+    assert status
+    assert report == merge(template, text)[1]
+
+
+def test_merge_with_details():
+    _, _, details = merge_with_details(["## ###\n", "\n", "  ####\n"],
+                                       ["ab cde\n", "  fghi\n"],
+                                       engine='align')
+    assert details == {"strategy": "align", "mismatched_rows": 0,
+                       "unaligned_rows": 0}
+    status, _, details = merge_with_details(["### ###\n"], ["abc\n"])
+    assert not status
+    assert details == {"strategy": None, "mismatched_rows": 1,
+                       "unaligned_rows": 0}
+
+
+def test_merge_batch(tmp_path):
+    jobs = []
+    for key, text in (("A-001", "ab cde\n"), ("A-002", "abc\n")):
+        template_file = tmp_path / f"{key}.template"
+        text_file = tmp_path / f"{key}.text"
+        template_file.write_text("## ###\n")
+        text_file.write_text(text)
+        jobs.append((str(template_file), str(text_file),
+                     str(tmp_path / f"{key}.merged")))
+    results = merge_batch(jobs, engine='align')
+    assert [details["status"] for details in results] == [True, False]
+    assert (tmp_path / "A-001.merged").read_text() == "ab cde\n"
+    assert not (tmp_path / "A-002.merged").exists()
+    # A missing template fails its page only
+    jobs.append((str(tmp_path / "A-003.template"), jobs[0][1],
+                 str(tmp_path / "A-003.merged")))
+    (tmp_path / "A-001.merged").unlink()
+    results = merge_batch(jobs, engine='align')
+    assert [details["status"] for details in results] == [True, False, False]
+    assert "A-003.template" in results[2]["error"]
+    assert (tmp_path / "A-001.merged").exists()
@@ -0,0 +1,86 @@
+"""Test metrics.py"""
+
+import pytest
+from metrics import measure, read_metrics, summarise_stages, slowest_pages
+from metrics import ocr_cost, timeline
+
+# flake8: noqa
+# pylint: disable=invalid-name,missing-function-docstring
+
+
+def test_measure(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with measure('crop', 'A-001') as record:
+        (tmp_path / "out.txt").write_text("x" * 1000)
+    with measure('merge', 'A-002') as record:
+        record["ok"] = False
+    with pytest.raises(ValueError):
+        with measure('text', 'A-003', process=False):
+            raise ValueError("bad page")
+    with measure('crop', 'A-004', enabled=False):
+        pass
+    records = read_metrics()
+    assert [(r["stage"], r["key"], r["ok"]) for r in records] == \
+        [('crop', 'A-001', True), ('merge', 'A-002', False),
+         ('text', 'A-003', False)]
+    assert records[0]["wall"] >= 0 and records[0]["cpu"] >= 0
+    assert records[0]["peak_rss_mb"] > 0
+    if records[0]["write_bytes"] is not None:
+        assert records[0]["write_bytes"] >= 1000
+    assert "cpu" not in records[2]
+
+
+def test_read_metrics_skips_cut_lines(tmp_path):
+    metrics_file = tmp_path / "metrics.jsonl"
+    metrics_file.write_text('{"stage": "crop", "key": "A-001"}\n{"sta')
+    assert read_metrics(str(metrics_file)) == [{"stage": "crop",
+                                                "key": "A-001"}]
+    assert not read_metrics(str(tmp_path / "none.jsonl"))
+
+
+RECORDS = [
+    {"stage": "crop", "key": "A-001", "time": 100.0, "ok": True,
+     "wall": 1.0, "cpu": 0.5, "peak_rss_mb": 40.0, "read_bytes": 100,
+     "write_bytes": 10},
+    {"stage": "crop", "key": "A-002", "time": 130.0, "ok": False,
+     "wall": 3.0, "cpu": 1.5, "peak_rss_mb": 50.0, "read_bytes": None,
+     "write_bytes": None},
+    {"stage": "text", "key": "A-001", "time": 230.0, "ok": True,
+     "wall": 2.0, "input_tokens": 1000, "output_tokens": 200,
+     "total_tokens": 1200, "retries": 2, "cached": 0},
+    {"stage": "text", "key": "A-002", "time": 240.0, "ok": True,
+     "wall": 0.1, "input_tokens": 3000, "output_tokens": 600,
+     "total_tokens": 3600, "retries": 0, "cached": 1},
+]
+
+
+def test_summarise_stages():
+    summary = summarise_stages(RECORDS)
+    crop = summary["crop"]
+    assert crop["pages"] == 2 and crop["failed"] == 1
+    assert crop["wall"]["p50"] == 2.0 and crop["wall"]["max"] == 3.0
+    assert crop["cpu"]["p50"] == 1.0
+    assert crop["peak_rss_mb"] == 50.0
+    assert crop["read_bytes"] == 100
+    assert summary["text"]["cpu"] is None
+
+
+def test_slowest_pages():
+    assert [(r["stage"], r["key"]) for r in slowest_pages(RECORDS, 2)] == \
+        [('crop', 'A-002'), ('text', 'A-001')]
+
+
+def test_ocr_cost():
+    cost = ocr_cost(RECORDS, input_price=1.0, output_price=10.0)
+    assert cost["pages"] == 2
+    assert cost["input_tokens"] == 4000 and cost["output_tokens"] == 800
+    assert cost["retries"] == 2 and cost["cached"] == 1
+    assert cost["cost"] == pytest.approx(0.012)
+    assert cost["cost_per_page"] == pytest.approx(0.006)
+    assert ocr_cost(RECORDS[:2]) is None
+
+
+def test_timeline():
+    assert timeline(RECORDS, 60) == [(0, {"crop": 2}), (60, {}),
+                                     (120, {"text": 2})]
+    assert not timeline([])
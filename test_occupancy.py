@@ -0,0 +1,51 @@
+"""Test occupancy.py"""
+
+import os
+import numpy as np
+from occupancy import Occupancy, load_occupancy, write_template_occupancy
+from occupancy import occupancy_file_name
+
+# flake8: noqa
+# pylint: disable=invalid-name,missing-function-docstring
+
+
+page = [
+    " a aa  bb  \n",
+    "\n",
+    "  aa   b\tc\n",
+    ]
+
+
+def test_from_lines():
+    occupancy = Occupancy.from_lines(page)
+    assert occupancy.shape == (3, 12)
+    assert occupancy.bits.shape == (3, 2)
+    assert occupancy.row_counts.tolist() == [5, 0, 4]
+    assert np.flatnonzero(occupancy.pole_occupied()).tolist() == \
+        [1, 2, 3, 4, 7, 8, 9]
+    cells = occupancy.cells()
+    assert cells[0].tolist() == [not c.isspace() for c in page[0]]
+
+
+def test_from_lines_empty():
+    assert Occupancy.from_lines([]).shape == (0, 0)
+    occupancy = Occupancy.from_lines(["\n", "  \n"])
+    assert occupancy.row_counts.tolist() == [0, 0]
+    assert not occupancy.pole_occupied().any()
+
+
+def test_save_load(tmp_path):
+    template_file = str(tmp_path / "A-001.txt")
+    with open(template_file, 'w', encoding='utf-8') as f:
+        f.write("  ## #\n   ###\n\n   \n")
+    write_template_occupancy(template_file)
+    assert os.path.exists(occupancy_file_name(template_file))
+    occupancy = load_occupancy(template_file)
+    # Trailing blank lines are dropped
+    assert occupancy.shape == (2, 7)
+    assert occupancy.row_counts.tolist() == [3, 3]
+    assert occupancy.pole_counts.tolist() == [0, 0, 1, 2, 1, 2, 0]
+    # A template edited by hand is read from its text again
+    with open(template_file, 'w', encoding='utf-8') as f:
+        f.write("#\n")
+    assert load_occupancy(template_file).row_counts.tolist() == [1]
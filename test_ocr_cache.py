@@ -0,0 +1,41 @@
+"""Test ocr_cache.py"""
+
+from ocr_cache import OcrCache, make_key
+
+# flake8: noqa
+# pylint: disable=invalid-name,missing-function-docstring
+
+USAGE = {"input_tokens": 10, "output_tokens": 5, "total_tokens": 15}
+
+
+def test_make_key(tmp_path):
+    image = tmp_path / "A-000.png"
+    image.write_bytes(b"pixels")
+    key = make_key(str(image), "model", "prompt")
+    assert key == make_key(b"pixels", "model", "prompt")
+    assert key != make_key(b"pixels", "model2", "prompt")
+    assert key != make_key(b"pixels", "model", "prompt2")
+    assert key != make_key(b"pixels2", "model", "prompt")
+
+
+def test_get_put(tmp_path):
+    cache = OcrCache(str(tmp_path), 1000)
+    assert cache.get("a") is None
+    cache.put("a", "text", USAGE)
+    assert cache.get("a") == ("text", USAGE)
+    assert (cache.hits, cache.misses) == (1, 1)
+    # Still there when opened again
+    cache.close()
+    cache = OcrCache(str(tmp_path), 1000)
+    assert cache.get("a") == ("text", USAGE)
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = OcrCache(str(tmp_path), 25)
+    cache.put("a", "a" * 10, USAGE)
+    cache.put("b", "b" * 10, USAGE)
+    cache.get("a")
+    cache.put("c", "c" * 10, USAGE)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
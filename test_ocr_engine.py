@@ -0,0 +1,123 @@
+"""Test ocr_engine.py"""
+
+import asyncio
+import time
+from metrics import read_metrics
+from ocr_cache import OcrCache
+from ocr_engine import OcrEngine, OcrJob, TokenBucket
+
+# flake8: noqa
+# pylint: disable=invalid-name,missing-function-docstring
+
+
+class FlakyBackend():
+    """Backend that fails the first few calls for each image."""
+    def __init__(self, failures, retryable=True):
+        self.model = "flaky"
+        self.failures = failures
+        self.retryable = retryable
+        self.calls = {}
+
+    async def ocr(self, image_file, prompt):
+        self.calls[image_file] = self.calls.get(image_file, 0) + 1
+        if self.calls[image_file] <= self.failures:
+            raise ConnectionError("try again")
+        await asyncio.sleep(0.01)
+        return f"{prompt} {image_file}", {"input_tokens": 10,
+                                          "output_tokens": 5,
+                                          "total_tokens": 15}
+
+    def is_retryable(self, error):
+        return self.retryable
+
+
+def run_engine(engine, keys):
+    results = {}
+
+    def on_result(job, text, usage):
+        results[job.key] = text
+
+    jobs = [OcrJob(key, key.encode() if engine.cache else f"{key}.png")
+            for key in keys]
+    failed = asyncio.run(engine.run(jobs, "ocr", on_result))
+    return failed, results
+
+
+def test_engine_runs_all_jobs():
+    engine = OcrEngine(FlakyBackend(0), concurrency=3)
+    failed, results = run_engine(engine, ["A-000", "A-001", "A-002"])
+    assert failed == 0
+    assert results == {"A-000": "ocr A-000.png", "A-001": "ocr A-001.png",
+                       "A-002": "ocr A-002.png"}
+
+
+def test_engine_retries():
+    engine = OcrEngine(FlakyBackend(2), max_retries=2)
+    engine.base_delay = 0.001
+    failed, results = run_engine(engine, ["A-000", "A-001"])
+    assert failed == 0
+    assert len(results) == 2
+    assert engine.retries == 4
+
+
+def test_engine_gives_up():
+    engine = OcrEngine(FlakyBackend(3), max_retries=2)
+    engine.base_delay = 0.001
+    failed, results = run_engine(engine, ["A-000"])
+    assert failed == 1
+    assert not results
+    engine = OcrEngine(FlakyBackend(1, retryable=False))
+    failed, results = run_engine(engine, ["A-000"])
+    assert failed == 1
+    assert engine.retries == 0
+
+
+def test_engine_metrics(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    backend = FlakyBackend(1)
+    # Only A-000 fails once, so the retry is counted for it alone
+    backend.calls["A-001.png"] = 1
+    engine = OcrEngine(backend, max_retries=2, metrics=True)
+    engine.base_delay = 0.001
+    run_engine(engine, ["A-000", "A-001"])
+    records = {record["key"]: record for record in read_metrics()}
+    assert records["A-000"]["retries"] == 1
+    assert records["A-001"]["retries"] == 0
+    assert records["A-001"]["stage"] == "text"
+    assert records["A-001"]["total_tokens"] == 15
+    assert records["A-001"]["ok"]
+
+
+def test_token_bucket_paces_requests():
+    async def take(bucket, count):
+        for _ in range(count):
+            await bucket.acquire()
+
+    # 600 a minute is 10 a second; the first 600 are available at once
+    bucket = TokenBucket(600)
+    bucket.tokens = 0
+    start = time.monotonic()
+    asyncio.run(take(bucket, 3))
+    assert 0.25 < time.monotonic() - start < 1
+    unlimited = TokenBucket(0)
+    start = time.monotonic()
+    asyncio.run(take(unlimited, 1000))
+    assert time.monotonic() - start < 0.5
+
+
+def test_engine_cache(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache = OcrCache(str(tmp_path), 1000)
+    backend = FlakyBackend(0)
+    run_engine(OcrEngine(backend, cache=cache), ["A-000"])
+    engine = OcrEngine(backend, cache=cache, metrics=True)
+    failed, results = run_engine(engine, ["A-000", "A-001"])
+    assert failed == 0
+    assert len(results) == 2
+    assert backend.calls == {b"A-000": 1, b"A-001": 1}
+    assert engine.usage["total_tokens"] == 15
+    # A page from the cache spent no tokens
+    records = {record["key"]: record for record in read_metrics()}
+    assert records["A-000"]["cached"] == 1
+    assert records["A-000"]["total_tokens"] == 0
+    assert records["A-001"]["total_tokens"] == 15
@@ -0,0 +1,92 @@
+"""Test ocr_fake.py"""
+
+import asyncio
+import pytest
+from PIL import Image
+from ocr_backends import OCR_SYSTEMS, make_backend
+from ocr_cache import OcrCache, make_key
+from ocr_engine import OcrEngine, OcrJob
+from ocr_fake import FakeOcr, FakeOcrError
+from ocr_image import TILE_TOKENS
+
+# flake8: noqa
+# pylint: disable=invalid-name,missing-function-docstring
+
+
+def make_page(tmp_path, key, text):
+    image_file = tmp_path / f"{key}.png"
+    Image.new('L', (1000, 500), 255).save(image_file)
+    (tmp_path / "text").mkdir(exist_ok=True)
+    (tmp_path / "text" / f"{key}.txt").write_text(text + "\n")
+    return str(image_file)
+
+
+def test_answers_from_text_dir(tmp_path):
+    image_file = make_page(tmp_path, "A-000", "HELLO WORLD")
+    fake = FakeOcr(text_dir=str(tmp_path / "text"), latency=0)
+    text, usage = asyncio.run(fake.ocr(image_file, "prompt"))
+    assert text == "HELLO WORLD"
+    # Two tiles across, one down
+    assert usage["input_tokens"] == 2 * TILE_TOKENS + 2
+    assert usage["output_tokens"] == 3
+    assert usage["total_tokens"] == usage["input_tokens"] + 3
+    with pytest.raises(FakeOcrError) as e:
+        asyncio.run(fake.ocr(b"strip", "prompt"))
+    assert not fake.is_retryable(e.value)
+
+
+def test_replays_cache(tmp_path):
+    image_file = make_page(tmp_path, "A-000", "HELLO WORLD")
+    cache = OcrCache(str(tmp_path / "cache"), 1000)
+    cache.put(make_key(image_file, "gemini", "prompt"), "HELL0 WORLD",
+              {"input_tokens": 1, "output_tokens": 1, "total_tokens": 2})
+    fake = FakeOcr(text_dir=str(tmp_path / "text"), replay=cache,
+                   replay_model="gemini", latency=0)
+    assert asyncio.run(fake.ocr(image_file, "prompt")).text == "HELL0 WORLD"
+    # Not recorded for this prompt, so from the text file
+    assert asyncio.run(fake.ocr(image_file, "other")).text == "HELLO WORLD"
+
+
+def test_errors_are_retried(tmp_path):
+    keys = [f"A-{n:03d}" for n in range(10)]
+    jobs = [OcrJob(key, make_page(tmp_path, key, key)) for key in keys]
+    fake = FakeOcr(text_dir=str(tmp_path / "text"), latency=0,
+                   error_rate=0.3, seed=1)
+    engine = OcrEngine(fake, max_retries=20)
+    engine.base_delay = 0.001
+    results = {}
+
+    def on_result(job, text, _usage):
+        results[job.key] = text
+
+    failed = asyncio.run(engine.run(jobs, "prompt", on_result))
+    assert failed == 0
+    assert results == {key: key for key in keys}
+    assert fake.errors > 0
+    assert engine.retries == fake.errors
+
+
+def test_rate_limit(tmp_path):
+    image_file = make_page(tmp_path, "A-000", "HELLO")
+    fake = FakeOcr(text_dir=str(tmp_path / "text"), latency=0,
+                   requests_per_minute=2)
+    asyncio.run(fake.ocr(image_file, "prompt"))
+    asyncio.run(fake.ocr(image_file, "prompt"))
+    with pytest.raises(FakeOcrError) as e:
+        asyncio.run(fake.ocr(image_file, "prompt"))
+    assert e.value.code == 429
+    assert fake.is_retryable(e.value)
+    assert fake.rate_limited == 1
+
+
+def test_make_backend(tmp_path, capsys):
+    config = {"text": {"ocr_system": "fake", "fake_text_dir": str(tmp_path),
+                       "fake_latency": 0.5}}
+    backend = make_backend(config)
+    assert isinstance(backend, FakeOcr)
+    assert backend.latency == 0.5
+    assert set(OCR_SYSTEMS) == {"gemini", "fake"}
+    config["text"]["ocr_system"] = "tesseract"
+    with pytest.raises(SystemExit):
+        make_backend(config)
+    assert "OCR system tesseract not supported" in capsys.readouterr().out
@@ -0,0 +1,72 @@
+"""Test ocr_image.py"""
+
+import asyncio
+import json
+import numpy as np
+import yaml
+from grid import cell_variances, read_page
+from ocr_fake import FakeOcr
+from ocr_image import TILE_TOKENS, PageImage, tile_tokens, trim_box
+from ocr_image import prepare_image, prepare_page
+from synthetic import make_page
+
+# flake8: noqa
+# pylint: disable=invalid-name,missing-function-docstring
+
+
+def test_tile_tokens():
+    assert tile_tokens(768, 768) == TILE_TOKENS
+    assert tile_tokens(769, 10) == 2 * TILE_TOKENS
+
+
+def test_trim_box():
+    pa = {"x_offset": 0, "y_offset": 0, "grid_x_spacing": 10,
+          "grid_y_spacing": 10}
+    occupied = np.zeros((5, 6), dtype=bool)
+    assert trim_box(occupied, pa, 60, 50) == (0, 0, 60, 50)
+    occupied[1:3, 2:4] = True
+    # One blank cell is kept round the characters
+    assert trim_box(occupied, pa, 60, 50) == (10, 0, 50, 40)
+
+
+def test_prepare_image():
+    page = make_page(3, dpi=100, num_lines=10)
+    pa = page.attrs
+    grey = page.image.convert('L')
+    occupied = cell_variances(read_page(grey), pa) > 3000
+    img = prepare_image(grey, 'binary', pa, pa["grid_x_spacing"] / 2,
+                        occupied)
+    assert img.mode == '1'
+    # Trimmed to the text and then halved
+    assert img.width < grey.width / 2 and img.height < grey.height / 2
+    pixels = np.asarray(img)
+    assert not pixels.all() and pixels.any()
+    assert prepare_image(grey, 'gray').size == grey.size
+
+
+def test_prepare_page(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    page = make_page(4, dpi=150, num_lines=30)
+    config = {"split": {"prefix": "A"},
+              "grid": {"variance_threshold": 3000},
+              "text": {"image_mode": "binary", "pixels_per_char": 8,
+                       "trim_margins": True},
+              "jobs": {"raster_cache": False}}
+    (tmp_path / "config.yaml").write_text(yaml.safe_dump(config))
+    (tmp_path / "pages").mkdir()
+    (tmp_path / "templates").mkdir()
+    page.image.convert('RGB').save(tmp_path / "pages" / "A-000.png")
+    (tmp_path / "A.json").write_text(json.dumps({"A-000": page.attrs}))
+    image, report = prepare_page("A-000", "pages/A-000.png", config)
+    assert isinstance(image, PageImage)
+    assert report["sent_bytes"] == len(image) < report["image_bytes"] / 2
+    assert report["sent_tokens"] < report["image_tokens"]
+    # The fake still knows which page a prepared image came from
+    (tmp_path / "truth").mkdir()
+    (tmp_path / "truth" / "A-000.txt").write_text("HELLO\n")
+    fake = FakeOcr(text_dir="truth", latency=0)
+    text, usage = asyncio.run(fake.ocr(image, "prompt"))
+    assert text == "HELLO" and usage["input_tokens"] > 0
+    config["text"] = {"image_mode": "original"}
+    assert prepare_page("A-000", "pages/A-000.png", config)[0] == \
+        "pages/A-000.png"
@@ -0,0 +1,59 @@
+"""Test pipeline.py"""
+
+import heapq
+from concurrent.futures import Future
+from pipeline import STAGES, Pipeline, stage_deps, job_priority
+
+# flake8: noqa
+# pylint: disable=invalid-name,missing-function-docstring
+
+
+def test_stage_deps():
+    for strategy in ('page', 'strips'):
+        deps = stage_deps(strategy)
+        # Every stage but split waits on earlier stages only
+        assert set(deps) == set(STAGES) - {'split'}
+        for stage, needs in deps.items():
+            assert all(STAGES.index(need) < STAGES.index(stage)
+                       for need in needs)
+    assert stage_deps('page')['text'] == ('straighten',)
+    assert stage_deps('strips')['text'] == ('segment',)
+
+
+def test_job_priority():
+    jobs = []
+    for stage, key in [('crop', 'A-001'), ('merge', 'A-003'),
+                       ('crop', 'A-000'), ('straighten', 'A-002')]:
+        heapq.heappush(jobs, (job_priority(stage, key), stage))
+    order = [heapq.heappop(jobs) for _ in range(4)]
+    assert [(stage, key) for (_, key), stage in order] == \
+        [('merge', 'A-003'), ('straighten', 'A-002'),
+         ('crop', 'A-000'), ('crop', 'A-001')]
+
+
+class FailingPool():
+    def __init__(self):
+        self.submitted = 0
+
+    def submit(self, *_):
+        self.submitted += 1
+        future = Future()
+        future.set_exception(ValueError("no grid"))
+        return future
+
+
+def test_pitch_not_found():
+    config = {"split": {"prefix": "A", "num_pages": 2},
+              "text": {"ocr_strategy": "page"}}
+    pipeline = Pipeline(config)
+    pipeline.cpu = FailingPool()
+    pipeline.split_finished = True
+    pipeline.done['straighten'] = {"A-000", "A-001"}
+    pipeline.check_pitch(True)
+    steps = 0
+    while pipeline.step():
+        steps += 1
+        assert steps < 10
+    # The estimate is not tried again and the pages fail to segment
+    assert pipeline.cpu.submitted == 1
+    assert pipeline.failed['segment'] == {"A-000", "A-001"}
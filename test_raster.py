@@ -0,0 +1,67 @@
+"""Test raster.py"""
+
+import os
+import numpy as np
+from PIL import Image
+from grid import read_page, read_luminance
+from raster import load_raster, raster_file_name, read_header
+
+# flake8: noqa
+# pylint: disable=invalid-name,missing-function-docstring
+
+
+def make_png(file_name, level):
+    img = Image.effect_noise((60, 40), 40).convert('RGB')
+    img.paste((level, 0, 0), (5, 5, 20, 20))
+    img.save(file_name)
+    return img
+
+
+def test_load_raster(tmp_path):
+    page_file = str(tmp_path / "A-001.png")
+    raster_dir = str(tmp_path / "rasters")
+    img = make_png(page_file, 10)
+    page = load_raster(page_file, raster_dir)
+    assert isinstance(page, np.memmap)
+    assert page.shape == (40, 60)
+    assert np.array_equal(page, read_page(img))
+    assert read_header(raster_file_name(page_file, raster_dir))[:2] == (40, 60)
+    # A second read maps the same file
+    assert np.array_equal(load_raster(page_file, raster_dir), page)
+
+
+def test_load_raster_changed(tmp_path):
+    page_file = str(tmp_path / "A-001.png")
+    raster_dir = str(tmp_path / "rasters")
+    make_png(page_file, 10)
+    load_raster(page_file, raster_dir)
+    stat = os.stat(page_file)
+    img = make_png(page_file, 200)
+    os.utime(page_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    assert np.array_equal(load_raster(page_file, raster_dir), read_page(img))
+
+
+def test_load_raster_luminance(tmp_path):
+    page_file = str(tmp_path / "A-001.png")
+    raster_dir = str(tmp_path / "rasters")
+    # A colour page has a luminance raster as well as the band
+    img = make_png(page_file, 10)
+    page = load_raster(page_file, raster_dir, luminance=True)
+    assert np.array_equal(page, read_luminance(img))
+    assert not np.array_equal(page, read_page(img))
+    assert np.array_equal(load_raster(page_file, raster_dir), read_page(img))
+    # A grey page does not
+    img = img.convert('L').convert('RGB')
+    img.save(page_file)
+    stat = os.stat(page_file)
+    os.utime(page_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    page = load_raster(page_file, raster_dir, luminance=True)
+    assert np.array_equal(page, read_page(img))
+    assert not os.path.exists(raster_file_name(page_file, raster_dir, "luma"))
+
+
+def test_read_header_bad(tmp_path):
+    assert read_header(str(tmp_path / "missing.gray")) is None
+    bad_file = tmp_path / "bad.gray"
+    bad_file.write_bytes(b"not a raster file at all, really not")
+    assert read_header(str(bad_file)) is None
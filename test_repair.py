@@ -0,0 +1,61 @@
+"""Test repair.py"""
+
+import asyncio
+from PIL import Image
+from grid import read_page
+from repair import first_text_row, mismatched_rows, pick_line, repair_text
+
+# flake8: noqa
+# pylint: disable=invalid-name,missing-function-docstring
+
+
+def test_mismatched_rows():
+    template = ["### ###\n", "       \n", "## #\n", "#\n"]
+    text = ["abc def\n", "x\n", "ab\n"]
+    mismatched, lines = mismatched_rows(template, text)
+    assert mismatched == [(2, 3), (3, 1)]
+    assert len(lines) == 4
+
+
+def test_pick_line():
+    assert pick_line("\n  AB C\n", 3) == "  AB C"
+    assert pick_line("AB\n", 3) is None
+
+
+class LineEngine():
+    """Engine that answers with a line of the expected length."""
+    async def ocr(self, image, prompt):
+        count = int(prompt.split("exactly ")[1].split()[0])
+        return "  " + "X" * count, {"input_tokens": 1, "output_tokens": 1,
+                                    "total_tokens": 2}
+
+
+def test_repair_text():
+    img = Image.new('L', (100, 100), 255)
+    # Template starts on grid row 2
+    for row in [2, 3, 4]:
+        img.paste(0, (10, row * 10 + 2, 30, row * 10 + 8))
+    pa = {"x_offset": 0.0, "y_offset": 0.0,
+          "grid_x_spacing": 10.0, "grid_y_spacing": 10.0}
+    template = ["##\n", "##\n", "##\n"]
+    text = ["aa\n", "b\n", "cc\n"]
+    lines, repaired, usage = asyncio.run(repair_text(
+        LineEngine(), read_page(img), pa, 100, template, [(1, 2)], text,
+        "OCR"))
+    assert lines == ["aa", "  XX", "cc"]
+    assert repaired == 1
+    assert usage["total_tokens"] == 2
+
+
+def test_first_text_row():
+    img = Image.new('L', (100, 100), 255)
+    # A faint mark on row 1 that a higher threshold left out of the
+    # template, which has a short line on row 4
+    img.paste(200, (10, 12, 30, 18))
+    for row in [3, 4, 5]:
+        img.paste(0, (10, row * 10 + 2, 40 if row != 4 else 20, row * 10 + 8))
+    pa = {"x_offset": 0.0, "y_offset": 0.0,
+          "grid_x_spacing": 10.0, "grid_y_spacing": 10.0}
+    page = read_page(img)
+    template = ["###\n", "#\n", "###\n"]
+    assert first_text_row(page, pa, 100, template) == (3, 10)
@@ -0,0 +1,67 @@
+"""Test segment.py"""
+
+import numpy as np
+import pytest
+from segment import otsu_threshold, estimate_pitch, page_pitch
+from segment import combine_pitches, page_attributes, ink_profiles
+
+# flake8: noqa
+# pylint: disable=invalid-name,missing-function-docstring
+
+
+def make_page(x_pitch, y_pitch, x_offset, y_offset, width=900, height=1000):
+    """Make a page with a block of ink in most cells of a grid."""
+    rng = np.random.default_rng(1)
+    page = np.full((height, width), 230, dtype=np.uint8)
+    y = y_offset
+    while y + y_pitch < height:
+        x = x_offset
+        while x + x_pitch < width:
+            if rng.random() < 0.6:
+                page[int(y + y_pitch * 0.2):int(y + y_pitch * 0.75),
+                     int(x + x_pitch * 0.15):int(x + x_pitch * 0.8)] = 20
+            x += x_pitch
+        y += y_pitch
+    return page
+
+
+def test_otsu_threshold():
+    values = [10] * 50 + [200] * 50
+    assert 10 < otsu_threshold(values) <= 200
+    assert otsu_threshold([7, 7, 7]) == 7
+
+
+def test_estimate_pitch_flat():
+    assert estimate_pitch(np.ones(100)) is None
+
+
+@pytest.mark.parametrize("x_pitch,y_pitch,x_offset,y_offset",
+                         [(15.0, 25.0, 3.0, 11.0),
+                          (15.3, 25.0, 0.0, 5.0),
+                          (12.0, 20.4, 7.0, 0.0),
+                          (30.5, 50.2, 17.0, 40.0)])
+def test_page_pitch(x_pitch, y_pitch, x_offset, y_offset):
+    found_x, found_y = page_pitch(make_page(x_pitch, y_pitch,
+                                            x_offset, y_offset))
+    assert found_x == pytest.approx(x_pitch, abs=0.05)
+    assert found_y == pytest.approx(y_pitch, abs=0.05)
+
+
+@pytest.mark.parametrize("x_offset,y_offset", [(3.0, 11.0), (9.0, 2.0)])
+def test_page_attributes(x_offset, y_offset):
+    page = make_page(15.0, 25.0, x_offset, y_offset)
+    attrs = page_attributes(page, 15.0, 25.0)
+    assert attrs["grid_x_spacing"] == 15.0
+    assert attrs["grid_y_spacing"] == 25.0
+    # Every cell edge should fall in a gap between characters
+    rows, cols = ink_profiles(page)
+    for profile, offset, pitch in [(cols, attrs["x_offset"], 15.0),
+                                   (rows, attrs["y_offset"], 25.0)]:
+        edges = np.round(np.arange(offset, len(profile), pitch)).astype(int)
+        assert profile[edges[edges < len(profile)]].max() == 0
+
+
+def test_combine_pitches():
+    assert combine_pitches([(15.0, 25.0), (15.2, None), (None, 25.4),
+                            (15.1, 25.1)]) == (15.1, 25.1)
+    assert combine_pitches([(None, 25.0)]) is None
@@ -0,0 +1,40 @@
+"""Test split.py"""
+
+from split import image_files, parse_image_list, plan_shards, shard_keys
+
+# flake8: noqa
+# pylint: disable=invalid-name,missing-function-docstring
+
+
+IMAGE_LIST = """page   num  type   width height color comp bpc  enc interp  object ID x-ppi y-ppi size ratio
+--------------------------------------------------------------------------------------------
+   3     0 image    2550  3300  gray    1   8  jpeg   no        12  0   300   300  455K 5.5%
+   4     1 image    2550  3300  gray    1   8  jpeg   no        17  0   300   300  460K 5.6%
+   4     2 smask    2550  3300  gray    1   8  image  no        17  0   300   300 1024B 0.0%
+   6     3 image    2550  3300  gray    1   8  jpeg   no        22  0   300   300  470K 5.7%
+"""
+
+
+def test_parse_image_list():
+    assert parse_image_list(IMAGE_LIST, 3, 6) == [1, 2, 0, 1]
+    assert parse_image_list(IMAGE_LIST, 4, 4) == [2]
+    assert parse_image_list("", 1, 2) == [0, 0]
+
+
+def test_plan_shards():
+    assert plan_shards([1, 2, 0, 1], 3, 2) == [(3, 4, 0, 3), (5, 6, 3, 1)]
+    assert plan_shards([1, 1, 1], 10, 5) == [(10, 12, 0, 3)]
+    # Shards with no images are left out but keep the numbering
+    assert plan_shards([1, 0, 0, 1], 1, 1) == [(1, 1, 0, 1), (4, 4, 1, 1)]
+
+
+def test_shard_keys():
+    assert shard_keys("ABC", (5, 6, 3, 2)) == ["ABC-003", "ABC-004"]
+    assert shard_keys("ABC", (5, 6, 999, 2)) == ["ABC-999", "ABC-1000"]
+
+
+def test_image_files(tmp_path):
+    for number in (999, 1000, 2):
+        (tmp_path / f"p-{number:03d}.png").write_bytes(b"")
+    assert [name.rsplit("/", 1)[1] for name in image_files(str(tmp_path))] \
+        == ["p-002.png", "p-999.png", "p-1000.png"]
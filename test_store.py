@@ -0,0 +1,79 @@
+"""Test store.py"""
+
+import yaml
+from merge import merge_batch
+from store import ArtifactStore
+from util import TEMPLATES_DIR, TEXT_DIR, MERGED_DIR, get_command
+from util import write_output, read_output, output_exists, list_keys
+from util import pending_keys, output_source
+
+# flake8: noqa
+# pylint: disable=invalid-name,missing-function-docstring
+
+
+def use_store(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    config = {"split": {"prefix": "A"}, "jobs": {"store": "sqlite"}}
+    (tmp_path / "config.yaml").write_text(yaml.safe_dump(config))
+
+
+def test_store(tmp_path):
+    store = ArtifactStore(str(tmp_path / "gridlock.sqlite"))
+    assert store.get("text", "A-000") is None
+    store.put_many("text", {"A-001": "one\n", "A-000": "zero\n",
+                            "AB-000": "other document\n"})
+    store.put("templates", "A-000", "####\n")
+    assert store.get("text", "A-000") == "zero\n"
+    assert store.keys("text", "A") == ["A-000", "A-001"]
+    assert list(store.items("text", "A")) == [("A-000", "zero\n"),
+                                              ("A-001", "one\n")]
+    store.delete("text", "A-000")
+    assert store.keys("text", "A") == ["A-001"]
+    store.put_json_many("attrs", {"A-000": {"x_offset": 1.5}})
+    assert store.get_json("attrs", "A-000") == {"x_offset": 1.5}
+    assert store.kinds() == ["attrs", "templates", "text"]
+
+
+def test_outputs_in_store(tmp_path, monkeypatch):
+    use_store(tmp_path, monkeypatch)
+    (tmp_path / "pages").mkdir()
+    for n in range(3):
+        (tmp_path / "pages" / f"A-00{n}.png").write_bytes(b"")
+    write_output(f"{TEXT_DIR}/A-001.txt", "HELLO\n")
+    write_output("notes.txt", "a file\n")
+    assert not (tmp_path / TEXT_DIR / "A-001.txt").exists()
+    assert (tmp_path / "notes.txt").read_text() == "a file\n"
+    assert read_output(f"{TEXT_DIR}/A-001.txt") == "HELLO\n"
+    assert read_output(f"{TEXT_DIR}/A-002.txt") is None
+    assert output_exists(f"{TEXT_DIR}/A-001.txt")
+    assert output_source(f"{TEXT_DIR}/A-001.txt") == ["HELLO\n"]
+    assert output_source(f"{TEXT_DIR}/A-002.txt") == f"{TEXT_DIR}/A-002.txt"
+    assert list_keys(TEXT_DIR, "A", "txt") == ["A-001"]
+    assert pending_keys("A", "pages", "png", TEXT_DIR, "txt", False) == \
+        ["A-000", "A-002"]
+
+
+def test_merge_batch_in_store(tmp_path, monkeypatch):
+    use_store(tmp_path, monkeypatch)
+    write_output(f"{TEMPLATES_DIR}/A-000.txt", "  ### ##\n")
+    write_output(f"{TEXT_DIR}/A-000.txt", "abc de\n")
+    results = merge_batch([(f"{TEMPLATES_DIR}/A-000.txt",
+                            f"{TEXT_DIR}/A-000.txt",
+                            f"{MERGED_DIR}/A-000.txt")], margin=1)
+    assert results[0]["status"]
+    assert read_output(f"{MERGED_DIR}/A-000.txt") == "  abc de\n"
+
+
+def test_export_import(tmp_path, monkeypatch):
+    use_store(tmp_path, monkeypatch)
+    write_output(f"{TEXT_DIR}/A-000.txt", "HELLO\n")
+    write_output(f"{MERGED_DIR}/A-000.txt", "  HELLO\n")
+    export = get_command("gridlock_export")
+    store = ArtifactStore()
+    assert export.export_artifacts(store, "A") == 2
+    assert (tmp_path / TEXT_DIR / "A-000.txt").read_text() == "HELLO\n"
+    # Only changed files are written again
+    assert export.export_artifacts(store, "A") == 0
+    (tmp_path / TEXT_DIR / "A-000.txt").write_text("HELL0\n")
+    assert export.import_artifacts(store, "A") == 2
+    assert read_output(f"{TEXT_DIR}/A-000.txt") == "HELL0\n"
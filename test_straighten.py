@@ -0,0 +1,60 @@
+"""Test straighten.py"""
+
+import os
+import numpy as np
+import pytest
+from PIL import Image
+from straighten import crop_image, find_skew, rotate_image, straighten_image
+
+# flake8: noqa
+# pylint: disable=invalid-name,missing-function-docstring
+
+
+def make_page(angle=0.0):
+    """Make a page of lines of characters, rotated anticlockwise by
+    angle degrees."""
+    rng = np.random.default_rng(1)
+    page = np.full((900, 700), 230, dtype=np.uint8)
+    for y in range(40, 860, 25):
+        for x in range(30, 670, 15):
+            if rng.random() < 0.6:
+                page[y + 5:y + 19, x + 2:x + 12] = 20
+    return rotate_image(Image.fromarray(page), angle)
+
+
+def test_crop_image():
+    img = crop_image(make_page(), [10, 20], [110, 70])
+    assert img.size == (100, 50)
+    # The default crop_to of [0, 0] keeps the whole page
+    assert crop_image(make_page(), [0, 0], [0, 0]).size == (700, 900)
+    assert crop_image(make_page(), [100, 0], [100, 0]).size == (600, 900)
+    # A box past the edge is not padded
+    img = crop_image(make_page(), [600, 800], [800, 1000])
+    assert img.size == (100, 100)
+
+
+@pytest.mark.parametrize("angle", [-3.0, -1.2, 0.0, 0.4, 2.5])
+def test_find_skew(angle):
+    assert find_skew(make_page(angle)) == pytest.approx(angle, abs=0.1)
+
+
+@pytest.mark.parametrize("angle", [-4.0, -2.3, 2.0, 3.0])
+def test_find_skew_scan(angle):
+    # A real page, where the lines are close enough that a shear of a
+    # line pitch could look level
+    page_file = os.path.join(os.path.dirname(__file__), "tutorial",
+                             "ELIZA-000-1st.png")
+    with Image.open(page_file) as img:
+        page = rotate_image(img, angle)
+    assert find_skew(page) == pytest.approx(angle, abs=0.1)
+
+
+def test_find_skew_blank():
+    assert find_skew(Image.new('L', (100, 100), 255)) == 0.0
+
+
+def test_straighten_image():
+    img = straighten_image(make_page(1.5))
+    assert img.size == (700, 900)
+    assert img.mode == 'RGB'
+    assert find_skew(img) == pytest.approx(0.0, abs=0.1)
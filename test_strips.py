@@ -0,0 +1,63 @@
+"""Test strips.py"""
+
+import asyncio
+import io
+import pytest
+from PIL import Image
+from grid import read_page
+from strips import find_strips, stitch, ocr_strips
+
+# flake8: noqa
+# pylint: disable=invalid-name,missing-function-docstring
+
+
+@pytest.mark.parametrize("occupied, rows_per_strip, expected",
+                         [[[True] * 5, 2, [[0, 1], [2, 3], [4]]],
+                          [[False, True, False, True, True], 8,
+                           [[1, 3, 4]]],
+                          [[True, False, False, True, True], 8,
+                           [[0], [3, 4]]],
+                          [[False, False], 8, []],
+                          ])
+def test_find_strips(occupied, rows_per_strip, expected):
+    assert find_strips(occupied, rows_per_strip) == expected
+
+
+def test_stitch():
+    strips = [[1, 3], [6]]
+    assert stitch(strips, ["  a\n  b\n", "c"]) == "  a\n\n  b\n\n\nc"
+    # Wrong number of lines are placed from the start of the strip
+    assert stitch(strips, ["  a\n", "c"]) == "  a\n\n\n\n\nc"
+    assert stitch(strips, ["a\nb\nc\n", "d"]) == "a\nb\nc\n\n\nd"
+    # but never on the rows of the next strip or past the last
+    assert stitch(strips, ["a\nb\nc\nd\n", "e"]) == "\n\n\n\n\ne"
+    assert stitch(strips, ["a\n\nb", "c\nd"]) == "a\n\nb\n\n\n"
+    assert stitch([], []) == ""
+
+
+class StripEngine():
+    """Engine that answers with one line per text row in the strip."""
+    def __init__(self):
+        self.heights = []
+
+    async def ocr(self, image, prompt):
+        height = Image.open(io.BytesIO(image)).height
+        self.heights.append(height)
+        rows = int(prompt.split("exactly ")[1].split()[0])
+        text = "\n".join(f"row{height}" for _ in range(rows))
+        return text, {"input_tokens": 1, "output_tokens": 1,
+                      "total_tokens": 2}
+
+
+def test_ocr_strips():
+    img = Image.new('L', (100, 100), 255)
+    # Text on rows 1, 2 and 4 of a 10 pixel grid
+    for row in [1, 2, 4]:
+        img.paste(0, (10, row * 10 + 2, 30, row * 10 + 8))
+    pa = {"x_offset": 0.0, "y_offset": 0.0,
+          "grid_x_spacing": 10.0, "grid_y_spacing": 10.0}
+    engine = StripEngine()
+    text, usage = asyncio.run(ocr_strips(engine, read_page(img), pa, 100, 2, "OCR"))
+    assert sorted(engine.heights) == [10, 20]
+    assert text == "row20\nrow20\n\nrow10"
+    assert usage["total_tokens"] == 4
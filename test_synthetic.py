@@ -0,0 +1,40 @@
+"""Test synthetic.py"""
+
+import random
+import numpy as np
+import pytest
+from grid import numpy_template
+from synthetic import LAYOUTS, make_page, random_text
+
+# flake8: noqa
+# pylint: disable=invalid-name,missing-function-docstring
+
+
+@pytest.mark.parametrize("layout", sorted(LAYOUTS))
+def test_random_text_layout(layout):
+    lines = random_text(random.Random(1), 40, LAYOUTS[layout])
+    width = max(start + size for start, size in LAYOUTS[layout])
+    assert len(lines) == 40
+    assert all(len(line) <= width for line in lines)
+    assert sum(1 for line in lines if line.strip()) > 30
+
+
+def test_same_page_for_seed():
+    first = make_page(3, dpi=100, num_lines=10)
+    second = make_page(3, dpi=100, num_lines=10)
+    assert first.lines == second.lines
+    assert np.array_equal(np.asarray(first.image), np.asarray(second.image))
+    assert make_page(4, dpi=100, num_lines=10).lines != first.lines
+
+
+@pytest.mark.parametrize("dpi,noise", [(150, 0.0), (300, 0.005)])
+def test_template_matches_page(dpi, noise):
+    page = make_page(1, dpi=dpi, num_lines=20, noise=noise)
+    assert page.attrs["grid_x_spacing"] == dpi / 10
+    assert numpy_template(page.image, page.attrs, 3000) == page.template()
+
+
+def test_ocr_text():
+    page = make_page(2, dpi=100, num_lines=12)
+    page.lines = ["", "A B", "", "C", ""]
+    assert page.ocr_text() == "A B\n\nC"
@@ -0,0 +1,101 @@
+"""Test variances.py"""
+
+import json
+import os
+import numpy as np
+import yaml
+from PIL import Image
+from grid import cell_variances, read_page
+from raster import source_stamp
+from variances import save_variances, load_variances, page_variances
+from util import get_command
+from variances import variances_file_name, auto_threshold
+
+# flake8: noqa
+# pylint: disable=invalid-name,missing-function-docstring
+
+
+PA = {"x_offset": 3.0, "y_offset": 11.0,
+      "grid_x_spacing": 15.0, "grid_y_spacing": 25.0}
+
+
+def test_save_load_variances(tmp_path):
+    file_name = str(tmp_path / "A-001.npz")
+    variances = np.array([[0.0, 3000.25], [12.5, 16256.0]])
+    save_variances(file_name, variances, PA, (100, 200))
+    loaded = load_variances(file_name, PA, (100, 200))
+    assert loaded.dtype == np.float32
+    assert np.array_equal(loaded, variances)
+    # Out of date if the page or the grid has changed
+    assert load_variances(file_name, PA, (100, 201)) is None
+    assert load_variances(file_name, dict(PA, x_offset=4.0),
+                          (100, 200)) is None
+    assert load_variances(str(tmp_path / "missing.npz"), PA,
+                          (100, 200)) is None
+
+
+def test_page_variances(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "config.yaml").write_text("jobs:\n  raster_cache: true\n")
+    (tmp_path / "pages").mkdir()
+    (tmp_path / "templates").mkdir()
+    img = Image.effect_noise((200, 150), 40).convert('L')
+    img.paste(0, (20, 20, 30, 40))
+    img.save("pages/A-001.png")
+    variances = page_variances("A-001", PA)
+    expected = cell_variances(read_page(img), PA).astype(np.float32)
+    assert np.array_equal(variances, expected)
+    assert np.array_equal(load_variances(variances_file_name("A-001"), PA,
+                                         source_stamp("pages/A-001.png")),
+                          expected)
+
+
+def test_auto_threshold():
+    rng = np.random.default_rng(1)
+    blank = rng.uniform(50, 400, size=300)
+    chars = rng.uniform(2500, 9000, size=200)
+    threshold = auto_threshold(np.concatenate([blank, chars]))
+    assert 400 < threshold < 2500
+
+
+def test_rethreshold_keeps_edited(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    config = {"split": {"prefix": "A"}, "grid": {"variance_threshold": 100},
+              "template": {"char_left_margin": 0, "char_rigjt_pad": 0}}
+    (tmp_path / "config.yaml").write_text(yaml.safe_dump(config))
+    (tmp_path / "A.json").write_text(json.dumps({"A-001": PA}))
+    (tmp_path / "pages").mkdir()
+    (tmp_path / "templates").mkdir()
+    img = Image.new('L', (200, 150), 255)
+    img.paste(0, (20, 20, 30, 40))
+    img.save("pages/A-001.png")
+    templates = get_command("gridlock_templates")
+    assert templates.rethreshold_one_page("A-001", False) == 100
+    template_file = tmp_path / "templates" / "A-001.txt"
+    made = template_file.read_text()
+    # A hand edit is kept unless forced
+    template_file.write_text("# edited\n")
+    os.utime(template_file, ns=(0, 10**9))
+    assert templates.rethreshold_one_page("A-001", False) is None
+    assert template_file.read_text() == "# edited\n"
+    assert templates.rethreshold_one_page("A-001", False, True) == 100
+    assert template_file.read_text() == made
+
+
+def test_grid_from_saved_variances(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    config = {"split": {"prefix": "A"}, "grid": {"variance_threshold": 100},
+              "template": {"char_left_margin": 0, "char_rigjt_pad": 0}}
+    (tmp_path / "config.yaml").write_text(yaml.safe_dump(config))
+    (tmp_path / "A.json").write_text(json.dumps({"A-001": PA}))
+    (tmp_path / "pages").mkdir()
+    img = Image.new('L', (200, 150), 255)
+    img.paste(0, (20, 20, 30, 40))
+    img.save("pages/A-001.png")
+    templates = get_command("gridlock_templates")
+    templates.make_one_template("A-001", False, "none")
+    assert not os.path.exists("grids/A-001.jpg")
+    # Drawing the grid later reuses the saved variances
+    monkeypatch.setattr("variances.cell_variances", None)
+    templates.make_one_template("A-001", False, "preview")
+    assert os.path.exists("grids/A-001.jpg")
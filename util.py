@@ -2,13 +2,25 @@
 
 
 import glob
+import importlib.util
 import json
 import os
+import socket
 import subprocess
 import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from importlib.machinery import SourceFileLoader
 import yaml
+from PIL import Image
+from metrics import measure
+from store import ATTRS, STORE_FILE, ArtifactStore
 
 
+# Directory holding the gridlock commands
+SOURCE_DIR = os.path.dirname(os.path.realpath(__file__))
+
 CONFIG_FILE = "config.yaml"
 PROMPT_FILE = "prompt.md"
 PRESCAN_FILE = "prescan.results"
@@ -21,6 +33,23 @@ SPLIT_DIR = "split"
 TEMPLATES_DIR = "templates"
 TEXT_DIR = "text"
 MERGED_DIR = "merged"
+RASTERS_DIR = "rasters"
+
+# Stage directories whose files are kept in the artifact store instead
+# when jobs.store is "sqlite"
+STORED_DIRS = (TEMPLATES_DIR, TEXT_DIR, MERGED_DIR)
+
+# Parsed copies of files we read often, keyed by absolute path, so a
+# process only parses each once. Entries are (mtime, data) so that a
+# file changed on disk is read again.
+_file_cache = {}
+
+# Command modules loaded by pool workers, keyed by file path
+_loaded_commands = {}
+
+# One artifact store per project, process and thread, as SQLite
+# connections cannot be shared with forked pool workers or other threads
+_store = {}
 
 
 def read_yaml(file_path):
@@ -37,9 +66,25 @@ def read_yaml(file_path):
             sys.exit(1)
 
 
+def read_cached(file_path, reader):
+    """Return the result of reader(file_path), reusing the last result
+    for this file if it has not changed since."""
+    full_path = os.path.abspath(file_path)
+    try:
+        mtime = os.stat(full_path).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    cached = _file_cache.get(full_path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    data = reader(file_path)
+    _file_cache[full_path] = (mtime, data)
+    return data
+
+
 def read_config():
     """Read the main config file."""
-    return read_yaml(CONFIG_FILE)
+    return read_cached(CONFIG_FILE, read_yaml)
 
 
 def get_config(config, section, key):
@@ -53,6 +98,15 @@ def get_config(config, section, key):
     return section[key]
 
 
+def get_config_default(config, section, key, default):
+    """Get an optional value from the config map based on section and
+    key, or return default if it is not there. This allows projects
+    created before a setting was added to keep working."""
+    if section not in config or config[section] is None:
+        return default
+    return config[section].get(key, default)
+
+
 def get_num_pages(config):
     """Get the number of pages expected to be produced from the config."""
     if "split" in config and "num_pages" in config["split"]:
@@ -112,6 +166,26 @@ def single_task(ensure_dirs, input_file,
         sys.exit(1)
 
 
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+def image_task(ensure_dirs, input_file, output_file, action, transform,
+               force):
+    """Read the image in input_file, apply transform to it and save the
+    result as output_file, all in this process."""
+    for ensure_dir in ensure_dirs:
+        mkdir(ensure_dir)
+    if force:
+        delete_files(output_file)
+    if count_files(output_file) == 1:
+        print("Skipping")
+        return
+    try:
+        with Image.open(input_file) as img:
+            save_image_atomic(transform(img), output_file)
+    except (OSError, ValueError) as e:
+        print(f"Error doing {action} for {input_file} to {output_file}: {e}")
+        sys.exit(1)
+
+
 def get_file_key(file_path):
     """Find the page key from a file name, eg for a/b/XXX-123.txt it
     would be 123."""
@@ -121,39 +195,154 @@ def get_file_key(file_path):
 
 
 # pylint: disable=too-many-arguments,too-many-positional-arguments
-def parallel_task(prefix, input_dir, input_ext, output_dir, output_ext,
-                  action, command, force):
-    """Run several shell commands in parallel."""
+def pending_keys(prefix, input_dir, input_ext, output_dir, output_ext, force):
+    """Return the keys of the input files that have no output file yet.
+    If force is set, delete existing output and return all keys."""
     for ensure_dir in [input_dir, output_dir]:
         mkdir(ensure_dir)
-    input_files = glob.glob(f"{input_dir}/{prefix}-*.{input_ext}")
-    if len(input_files) == 0:
+    input_keys = list_keys(input_dir, prefix, input_ext)
+    if len(input_keys) == 0:
         print("No input files to process.")
         sys.exit(1)
-    output_files = []
-    keys = ""
-    for input_file in input_files:
-        key = get_file_key(input_file)
-        output_file = f"{output_dir}/{key}.{output_ext}"
-        if force:
-            delete_files(output_file)
-        if force or count_files(output_file) == 0:
-            output_files.append(output_file)
-            keys += key + " "
-    if len(output_files) == 0:
+    if force:
+        for key in input_keys:
+            delete_output(f"{output_dir}/{key}.{output_ext}")
+        return input_keys
+    done = set(list_keys(output_dir, prefix, output_ext))
+    return [key for key in input_keys if key not in done]
+
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+def parallel_task(prefix, input_dir, input_ext, output_dir, output_ext,
+                  action, command, force, page_function=None, page_args=()):
+    """Run a task on each pending page in parallel. If page_function
+    is given and the config asks for the pool or queue executor, call
+    page_function(key, *page_args) for each page with page_task,
+    otherwise run 'command key' for each page with GNU parallel."""
+    keys = pending_keys(prefix, input_dir, input_ext, output_dir, output_ext,
+                        force)
+    if len(keys) == 0:
         print("Skipping as all files processed")
         return
-    print(f"Running {action} for {len(output_files)} files")
-    # Note: command line length limits may cause problems
-    # if more than 100,000 files
-    run_command(f"parallel --bar {command} {{}} ::: {keys}",
-                silent_if_fail=True)
-    done = sum((count_files(item) for item in output_files))
-    if done < len(output_files):
-        print(f"Failed {action} for {len(output_files) - done} files""")
+    print(f"Running {action} for {len(keys)} files")
+    config = read_config()
+    executor = get_config_default(config, "jobs", "executor", "pool")
+    if page_function is not None and executor in ("pool", "queue"):
+        page_task(keys, page_function, page_args)
+    else:
+        # Note: command line length limits may cause problems
+        # if more than 100,000 files
+        run_command(f"parallel --bar {command} {{}} ::: {' '.join(keys)}",
+                    silent_if_fail=True)
+    done = set(list_keys(output_dir, prefix, output_ext))
+    failed = sum(1 for key in keys if key not in done)
+    if failed:
+        print(f"Failed {action} for {failed} files""")
         sys.exit(1)
 
 
+def get_num_workers():
+    """Return the number of worker processes to use for the pool."""
+    workers = get_config_default(read_config(), "jobs", "workers", 0)
+    return workers if workers > 0 else os.cpu_count()
+
+
+def page_task(keys, page_function, page_args=()):
+    """Call page_function(key, *page_args) for each key in a pool of
+    worker processes or, if the config asks for the queue executor,
+    through the project's work queue. Return the number of pages that
+    failed."""
+    executor = get_config_default(read_config(), "jobs", "executor", "pool")
+    if executor == "queue":
+        # Imported here as the queue needs the functions of this module
+        # pylint: disable=import-outside-toplevel
+        from jobqueue import queue_task
+        return queue_task(keys, page_function, page_args)
+    return pool_task(keys, page_function, page_args)
+
+
+def pool_task(keys, page_function, page_args=()):
+    """Call page_function(key, *page_args) for each key in a pool of
+    worker processes, showing progress on stderr. The config and page
+    attributes already read by this process are handed to the workers
+    so they do not need to read them again. Return the number of
+    pages that failed."""
+    module_file = sys.modules[page_function.__module__].__file__
+    function_name = page_function.__name__
+    attrs_file = get_attrs_file_name(keys[0].split('-')[0])
+    if os.path.exists(attrs_file) and not store_enabled():
+        read_cached(attrs_file, read_json)
+    start_time = time.time()
+    failed = 0
+    with ProcessPoolExecutor(max_workers=get_num_workers(),
+                             initializer=init_worker,
+                             initargs=(dict(_file_cache),)) as pool:
+        futures = [pool.submit(run_page, module_file, function_name,
+                               key, page_args) for key in keys]
+        for done, future in enumerate(as_completed(futures), start=1):
+            key, status = future.result()
+            if not status:
+                failed += 1
+            show_progress(done, len(keys), start_time, key)
+    print(file=sys.stderr)
+    return failed
+
+
+def show_progress(done, total, start_time, key):
+    """Show a progress bar line on stderr, in the style of GNU parallel."""
+    elapsed = time.time() - start_time
+    percent = 100 * done // total
+    print(f"\r{percent}% {done}:{total - done}={elapsed:.0f}s {key}",
+          end='', file=sys.stderr, flush=True)
+
+
+def init_worker(file_cache):
+    """Set up a pool worker process with files already read by the
+    parent process."""
+    _file_cache.update(file_cache)
+
+
+def load_command(module_file):
+    """Load the gridlock command or module in module_file, as pool
+    workers cannot import commands that have no .py extension."""
+    if module_file not in _loaded_commands:
+        name = os.path.splitext(os.path.basename(module_file))[0]
+        loader = SourceFileLoader(name, module_file)
+        spec = importlib.util.spec_from_loader(name, loader)
+        module = importlib.util.module_from_spec(spec)
+        loader.exec_module(module)
+        _loaded_commands[module_file] = module
+    return _loaded_commands[module_file]
+
+
+def get_command(name):
+    """Load the gridlock command called name, eg 'gridlock_merge', so
+    its functions can be called from another command."""
+    return load_command(os.path.join(SOURCE_DIR, name))
+
+
+def metrics_enabled():
+    """Return True if the metrics of each page should be recorded."""
+    return get_config_default(read_config(), "jobs", "metrics", True)
+
+
+def run_page(module_file, function_name, key, page_args):
+    """Run one page in a pool worker, recording its metrics under the
+    command's stage. Return the key and whether the page function
+    completed without error."""
+    stage = os.path.basename(module_file).replace("gridlock_", "")
+    try:
+        page_function = getattr(load_command(module_file), function_name)
+        with measure(stage, key, metrics_enabled()):
+            page_function(key, *page_args)
+        return key, True
+    except SystemExit as e:
+        return key, e.code in (None, 0)
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        print(f"Error processing {key}: {e}", file=sys.stderr)
+        return key, False
+
+
 def count_files(pattern):
     """Count the number of files matching pattern."""
     return len(glob.glob(pattern))
@@ -177,6 +366,30 @@ def mkdir(path):
         sys.exit(1)
 
 
+def temp_name(path):
+    """Return the name to write path to before renaming it into place,
+    unique to this process even among workers on other hosts sharing
+    the project directory."""
+    return f"{path}.tmp{os.getpid()}.{socket.gethostname()}"
+
+
+def write_file_atomic(path, text):
+    """Write text to path so that readers, or a run that is
+    interrupted, never see a partly written file."""
+    temp_path = temp_name(path)
+    with open(temp_path, "w", encoding='utf-8') as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+
+def save_image_atomic(img, path, image_format="PNG", **params):
+    """Save img as a PNG, or image_format, to path so that readers, or
+    a run that is interrupted, never see a partly written file."""
+    temp_path = temp_name(path)
+    img.save(temp_path, format=image_format, **params)
+    os.replace(temp_path, path)
+
+
 def file_not_empty(path):
     """Return True if the file indicated by path exists and is not empty."""
     return os.path.exists(path) and os.path.getsize(path) > 0
@@ -188,8 +401,122 @@ def get_attrs_file_name(prefix):
 
 
 def get_page_attrs(page_key):
-    """Return the page attributes dict by reading the attributes
-    stored in the JSON file."""
+    """Return the page attributes dict from the artifact store, if used,
+    or by reading the attributes stored in the JSON file."""
+    if store_enabled():
+        attrs = get_store().get_json(ATTRS, page_key)
+        if attrs is not None:
+            return attrs
     prefix = page_key.split('-')[0]
-    all_pages = read_json(get_attrs_file_name(prefix))
+    all_pages = read_cached(get_attrs_file_name(prefix), read_json)
     return all_pages[page_key]
+
+
+def store_enabled():
+    """Return True if the project keeps its artifacts in the artifact
+    store rather than in stage directories."""
+    if not os.path.exists(CONFIG_FILE):
+        return False
+    return get_config_default(read_config(), "jobs", "store",
+                              "files") == "sqlite"
+
+
+def get_store():
+    """Return the artifact store of the project in the current
+    directory."""
+    owner = (os.getcwd(), os.getpid(), threading.get_ident())
+    if owner not in _store:
+        _store[owner] = ArtifactStore(STORE_FILE)
+    return _store[owner]
+
+
+def stored_name(path):
+    """Return the (kind, key) path is kept under in the artifact store,
+    or None if it is an ordinary file."""
+    directory, name = os.path.split(path)
+    key, ext = os.path.splitext(name)
+    if directory in STORED_DIRS and ext == ".txt" and store_enabled():
+        return directory, key
+    return None
+
+
+def write_output(path, text):
+    """Write a stage's output to path, or to the artifact store if path
+    is kept there, so readers never see a partly written output."""
+    stored = stored_name(path)
+    if stored is None:
+        write_file_atomic(path, text)
+    else:
+        get_store().put(*stored, text)
+
+
+def write_outputs(outputs):
+    """Write a dict of path to text of stage outputs, with those kept in
+    the artifact store written in one transaction for each kind."""
+    by_kind = {}
+    for path, text in outputs.items():
+        stored = stored_name(path)
+        if stored is None:
+            write_file_atomic(path, text)
+        else:
+            by_kind.setdefault(stored[0], {})[stored[1]] = text
+    for kind, contents in by_kind.items():
+        get_store().put_many(kind, contents)
+
+
+def read_output(path, default=None):
+    """Return the text of the output at path, from the artifact store if
+    it is kept there, or default if there is no such output."""
+    stored = stored_name(path)
+    if stored is not None:
+        text = get_store().get(*stored)
+        return default if text is None else text
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError:
+        return default
+
+
+def output_source(path):
+    """Return what merging reads the output at path from: the file name,
+    or its lines if it is kept in the artifact store. A missing output
+    is given as its file name, so the reader reports it as missing."""
+    text = None
+    if stored_name(path) is not None:
+        text = read_output(path)
+    return path if text is None else text.splitlines(keepends=True)
+
+
+def output_exists(path):
+    """Return True if there is an output at path, even if empty."""
+    stored = stored_name(path)
+    if stored is None:
+        return os.path.exists(path)
+    return get_store().get(*stored) is not None
+
+
+def output_not_empty(path):
+    """Return True if there is an output at path and it is not empty."""
+    if stored_name(path) is None:
+        return file_not_empty(path)
+    return bool(read_output(path))
+
+
+def delete_output(path):
+    """Delete the output at path, if there is one."""
+    stored = stored_name(path)
+    if stored is None:
+        delete_files(path)
+    else:
+        get_store().delete(*stored)
+
+
+def list_keys(directory, prefix, ext):
+    """Return the sorted keys of the pages of the document prefix that
+    have a file in directory with extension ext, or an entry in the
+    artifact store if the directory is kept there."""
+    if stored_name(f"{directory}/{prefix}.{ext}") is not None:
+        return get_store().keys(directory, prefix)
+    return sorted(get_file_key(file_path) for file_path in
+                  glob.glob(f"{directory}/{prefix}-*.{ext}"))
@@ -0,0 +1,76 @@
+"""Per page matrices of grid cell variances.
+
+gridlock templates saves the variance of every grid cell of a page in
+templates/KEY.npz next to the template, so the template can be made
+again with a different threshold without reading the page image. The
+file also records the grid and the size and modification time of the
+page it was measured from, and is measured again if either changes.
+
+Variances are stored as float32. float16 would be half the size, but
+near the default threshold it only has a resolution of 2, which would
+change which cells count as characters.
+"""
+
+
+import os
+import numpy as np
+from grid import cell_variances
+from raster import page_raster, source_stamp
+from segment import otsu_threshold
+from util import PAGES_DIR, TEMPLATES_DIR, temp_name
+
+
+GRID_KEYS = ("grid_x_spacing", "grid_y_spacing", "x_offset", "y_offset")
+
+
+def variances_file_name(page_key):
+    """Return the name of the variance matrix file for a page."""
+    return f"{TEMPLATES_DIR}/{page_key}.npz"
+
+
+def save_variances(file_name, variances, pa, stamp):
+    """Save a variance matrix with the grid and page stamp it was
+    measured with."""
+    temp_file = temp_name(file_name)
+    with open(temp_file, 'wb') as f:
+        np.savez_compressed(f, variances=variances.astype(np.float32),
+                            grid=np.array([pa[key] for key in GRID_KEYS]),
+                            stamp=np.array(stamp, dtype=np.int64))
+    os.replace(temp_file, file_name)
+
+
+def load_variances(file_name, pa, stamp):
+    """Return the saved variance matrix, or None if there is none or it
+    was measured with a different grid or page."""
+    try:
+        with np.load(file_name) as data:
+            if tuple(data["stamp"]) != tuple(stamp) or \
+               not np.array_equal(data["grid"],
+                                  [pa[key] for key in GRID_KEYS]):
+                return None
+            return data["variances"]
+    except (FileNotFoundError, ValueError, KeyError, OSError):
+        return None
+
+
+def page_variances(page_key, pa):
+    """Return the variance matrix of a page, from its saved file if it
+    is up to date, otherwise measured from the page and saved."""
+    page_file = f"{PAGES_DIR}/{page_key}.png"
+    file_name = variances_file_name(page_key)
+    stamp = source_stamp(page_file)
+    variances = load_variances(file_name, pa, stamp)
+    if variances is None:
+        variances = cell_variances(page_raster(page_file), pa)
+        variances = variances.astype(np.float32)
+        save_variances(file_name, variances, pa, stamp)
+    return variances
+
+
+def auto_threshold(variances):
+    """Return a threshold that separates character cells from blank
+    cells on one page, using Otsu's method on the log of the cell
+    variances, as they spread over several orders of magnitude."""
+    threshold = otsu_threshold(np.log1p(np.asarray(variances,
+                                                   dtype=np.float64)))
+    return float(np.expm1(threshold))